@@ -0,0 +1,100 @@
+#!/usr/bin/env python3
+"""
+Check the compiled-plan preprocess against the original replace-loop version, then time both.
+
+The texts are extracted from the PDFs and text files in data/tests, plus randomly generated
+strings that are dense in drop words, Unicode whitespace and repeated punctuation.
+
+Usage:
+    python benchmarks/bench_preprocess.py
+    python benchmarks/bench_preprocess.py --fuzz 200000 --repeat 5
+"""
+
+import os, sys, time, random, argparse
+from pathlib import Path
+
+# Add src directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+import pymupdf
+from utils import preprocess, drop_words
+
+def preprocess_reference(text:str):
+    """The original preprocess: one str.replace pass per drop word and per doubled mark."""
+    text = text.replace('-\n', '')
+    for word in drop_words:
+        text = text.replace(f'{word}', ' ')
+    for i in [' ', '.', ',', '!', '?']:
+        text = text.replace(f'{i}{i}', f'{i}').replace(f'{i}{i}', f'{i}')
+    text = text.replace(' .', '.')
+    text = text.strip()
+    return(text)
+
+def load_texts(folder):
+    """Return one raw string per page/file in folder."""
+    texts = []
+    for name in sorted(os.listdir(folder)):
+        path = os.path.join(folder, name)
+        if name.endswith('.pdf'):
+            with pymupdf.open(path) as doc:
+                texts.extend(page.get_text() for page in doc)
+        elif name.endswith(('.txt', '.do', '.md', '.eml')):
+            with open(path, 'r', encoding='utf-8', errors='replace') as f:
+                texts.append(f.read())
+    return texts
+
+def fuzz_texts(count, seed=1234):
+    """Random strings built mostly from characters the normalizer treats specially."""
+    rng = random.Random(seed)
+    alphabet = list(set(drop_words)) + [' ', '.', ',', '!', '?', '-', '-\n', 'a', 'b', 'word', '․', '\x1c']
+    return [''.join(rng.choice(alphabet) for _ in range(rng.randint(0, 60))) for _ in range(count)]
+
+def timed(label, func, texts, repeat):
+    best = float('inf')
+    for _ in range(repeat):
+        start = time.perf_counter()
+        for text in texts:
+            func(text)
+        best = min(best, time.perf_counter() - start)
+    chars = sum(len(t) for t in texts)
+    print(f"{label:<28} {best * 1000:9.1f} ms  ({chars / best / 1e6:7.1f} M chars/s)")
+    return best
+
+def main():
+    parser = argparse.ArgumentParser(description="Compare preprocess against the original implementation.")
+    parser.add_argument('--fuzz', type=int, default=50_000, help="Number of random strings to check")
+    parser.add_argument('--repeat', type=int, default=5, help="Timing repetitions (best is reported)")
+    args = parser.parse_args()
+
+    corpus = load_texts(Path(__file__).parent.parent / "data" / "tests")
+    fuzz = fuzz_texts(args.fuzz)
+
+    mismatches = [t for t in corpus + fuzz if preprocess(t) != preprocess_reference(t)]
+    print(f"Checked {len(corpus) + len(fuzz)} texts: {len(mismatches)} mismatches")
+    if mismatches:
+        print(repr(mismatches[0]))
+        sys.exit(1)
+
+    # Whole documents, as preprocess sees them in prepare_text / prepare_PDF
+    documents = [' '.join(corpus)] * 10
+    print(f"\nWhole documents ({len(documents)} x {len(documents[0])} chars):")
+    old = timed("replace loop (original)", preprocess_reference, documents, args.repeat)
+    new = timed("compiled plan", preprocess, documents, args.repeat)
+    print(f"speedup: {old / new:.1f}x")
+
+    # ASCII-only documents, e.g. most source code and plain text files
+    ascii_docs = [''.join(t for t in corpus if t.isascii())] * 10
+    print(f"\nASCII documents ({len(ascii_docs)} x {len(ascii_docs[0])} chars):")
+    old = timed("replace loop (original)", preprocess_reference, ascii_docs, args.repeat)
+    new = timed("compiled plan", preprocess, ascii_docs, args.repeat)
+    print(f"speedup: {old / new:.1f}x")
+
+    # Short strings, as preprocess sees them for queries and filenames
+    short = [t[:80] for t in corpus] * 50
+    print(f"\nShort strings ({len(short)} x <= 80 chars):")
+    old = timed("replace loop (original)", preprocess_reference, short, args.repeat)
+    new = timed("compiled plan", preprocess, short, args.repeat)
+    print(f"speedup: {old / new:.1f}x")
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+"""
+Benchmark the directory scanner on a synthetic file tree.
+
+Creates a tree of empty files (a mix of allowed and ignored extensions) and times:
+  - a plain os.walk with separate getmtime/getsize calls (the old per-file stat cost)
+  - the old file_scanner loop, with list-based dedup, on the first --legacy-files files
+  - scan_tree, sequentially and with a thread pool
+  - file_scanner on a first scan and on a rescan against the saved file list
+
+Usage:
+    python benchmarks/bench_scanner.py --files 500000 --threads 8
+    python benchmarks/bench_scanner.py --root /tmp/scan_tree --keep   # reuse an existing tree
+"""
+
+import os, sys, time, json, shutil, hashlib, argparse, tempfile, logging
+from pathlib import Path
+from datetime import datetime
+
+# Add src directory to path
+sys.path.insert(0, str(Path(__file__).parent.parent / "src"))
+
+from utils import file_scanner, preprocess, allowed_texts, file_list_defaults
+from scanner import scan_tree
+
+def make_tree(root, num_files, files_per_dir=50, dirs_per_level=20):
+    """Create num_files empty files under root, files_per_dir per leaf directory."""
+    exts = ['.txt', '.pdf', '.py', '.csv', '.png']
+    num_dirs = -(-num_files // files_per_dir)
+    created = 0
+    for d in range(num_dirs):
+        parts = [f"d{(d // dirs_per_level ** level) % dirs_per_level}" for level in range(2, -1, -1)]
+        leaf = os.path.join(root, *parts, f"leaf{d}")
+        os.makedirs(leaf, exist_ok=True)
+        for i in range(min(files_per_dir, num_files - created)):
+            open(os.path.join(leaf, f"file_{d}_{i}{exts[i % len(exts)]}"), 'w').close()
+        created += files_per_dir
+
+def legacy_walk(root, allowed_text_types):
+    """os.walk with separate getmtime/getsize calls per file."""
+    count = 0
+    for dirpath, dirs, files in os.walk(root):
+        for file in files:
+            if not any(file.endswith(ext) for ext in allowed_text_types):
+                continue
+            full_path = os.path.join(dirpath, file)
+            os.path.getmtime(full_path)
+            os.path.getsize(full_path)
+            count += 1
+    return count
+
+def legacy_scanner_loop(root, allowed_text_types, limit):
+    """The old file_scanner loop (list membership dedup), stopped after `limit` files."""
+    file_list = {key: [] for key in file_list_defaults}
+    for dirpath, dirs, files in os.walk(root):
+        for file in files:
+            if not any(file.endswith(ext) for ext in allowed_text_types):
+                continue
+            full_path = os.path.join(dirpath, file)
+            mod_time = datetime.fromtimestamp(os.path.getmtime(full_path)).strftime('%Y-%m-%d %H:%M:%S')
+            size = os.path.getsize(full_path)
+            hash_id = hashlib.sha1(full_path.encode('utf-8')).hexdigest()
+            if hash_id in file_list['file_id']:
+                continue
+            file_list['filepath'].append(full_path)
+            file_list['filename'].append(preprocess(os.path.splitext(file)[0]))
+            file_list['last_modified'].append(mod_time)
+            file_list['file_size'].append(int(size/(1024**2)))
+            file_list['date_added'].append(datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+            file_list['file_id'].append(hash_id)
+            if len(file_list['file_id']) >= limit:
+                return len(file_list['file_id'])
+    return len(file_list['file_id'])
+
+def timed(label, func, *args, **kwargs):
+    start = time.perf_counter()
+    result = func(*args, **kwargs)
+    elapsed = time.perf_counter() - start
+    print(f"{label:<45} {elapsed:9.2f} s")
+    return result
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the directory scanner on a synthetic tree.")
+    parser.add_argument('--files', type=int, default=500_000, help="Number of files in the synthetic tree")
+    parser.add_argument('--threads', type=int, default=8, help="Threads for the parallel scan")
+    parser.add_argument('--legacy-files', type=int, default=20_000, help="Files to process with the old O(n^2) loop")
+    parser.add_argument('--root', type=str, default=None, help="Directory for the tree (default: a temp dir)")
+    parser.add_argument('--keep', action='store_true', help="Keep (and reuse) the tree instead of deleting it")
+    args = parser.parse_args()
+
+    logging.getLogger().setLevel(logging.WARNING)
+
+    root = args.root or tempfile.mkdtemp(prefix="scan_bench_")
+    tree = os.path.join(root, "tree")
+    if not os.path.isdir(tree):
+        timed(f"create tree ({args.files} files)", make_tree, tree, args.files)
+
+    # file_scanner writes its output to ./search_utils
+    os.chdir(root)
+    os.makedirs("search_utils", exist_ok=True)
+
+    try:
+        n = timed("os.walk + getmtime/getsize", legacy_walk, tree, allowed_texts)
+        print(f"  -> {n} matching files")
+        n_legacy = timed(f"old file_scanner loop (first {args.legacy_files} files)",
+                         legacy_scanner_loop, tree, allowed_texts, args.legacy_files)
+        print(f"  -> {n_legacy} files; list dedup makes this grow quadratically with n")
+        timed("scan_tree (1 thread)", scan_tree, tree, allowed_texts, num_threads=1)
+        timed(f"scan_tree ({args.threads} threads)", scan_tree, tree, allowed_texts, num_threads=args.threads)
+        timed("file_scanner, first scan", file_scanner, tree)
+        timed("file_scanner, rescan", file_scanner, tree, file_list_path="./search_utils/file_list.json")
+        timed(f"file_scanner, rescan ({args.threads} threads)", file_scanner, tree,
+              file_list_path="./search_utils/file_list.json", num_threads=args.threads)
+    finally:
+        os.chdir(Path(__file__).parent)
+        if not args.keep:
+            shutil.rmtree(root, ignore_errors=True)
+
+if __name__ == "__main__":
+    main()
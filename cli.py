@@ -30,8 +30,10 @@ src_path = Path(__file__).parent / "src"
 sys.path.insert(0, str(src_path))
 
 from utils import convert_results
-from queries import query_bm25, query_direct, query_nn
+from queries import query_bm25, query_direct, query_nn, query_hybrid, query_files, query_filenames, query_with_filename_boost
 from initialize import initialize, load_existing_indices
+from cache import ResultCache
+from filters import filter_mask
 
 # unsilence command-line output
 sys.stdout, sys.stderr = sys.__stdout__, sys.__stderr__
@@ -76,6 +78,10 @@ class SearchCLI:
         self.chunks = None
         self.bm25_retriever = None
         self.ann_index = None
+        self.trigram_index = None
+        self.corpus_arena = None
+        self.filename_index = None
+        self.result_cache = None
         self.initialized = False
         self.has_semantic = False
         self.mode = None  # 'simplified' or 'advanced'
@@ -145,10 +151,12 @@ class SearchCLI:
         # Step 1: Get directory path first
         default_path = os.getcwd()
         path = self.get_user_input("Enter path to document directory, or press enter to use", default=default_path)
+        # initialize changes the working directory, so resolve the cache location now
+        search_utils_path = os.path.join(os.path.abspath(path), 'search_utils')
         
         # Step 2: Check for existing indices in the selected directory
         print("\nChecking for existing search indices...")
-        existing = load_existing_indices(path)
+        existing = load_existing_indices(path, warm_up=True)
         
         use_existing = False
         if existing['success'] and existing['has_chunks']:
@@ -185,7 +193,11 @@ class SearchCLI:
                     self.file_dict = existing['file_dict']
                     self.bm25_retriever = existing['bm25_retriever']
                     self.ann_index = existing['ann_index']
+                    self.trigram_index = existing['trigram_index']
+                    self.corpus_arena = existing['corpus_arena']
+                    self.filename_index = existing['filename_index']
                     self.has_semantic = existing['has_ann']
+                    self.result_cache = ResultCache(search_utils_path, persist=True)
                     
                     # Check what's missing and inform user
                     missing = []
@@ -299,6 +311,10 @@ class SearchCLI:
             
             if semantic_search and 'ann_index' in return_packet:
                 self.ann_index = return_packet['ann_index']
+            self.trigram_index = return_packet.get('trigram_index')
+            self.corpus_arena = return_packet.get('corpus_arena')
+            self.filename_index = return_packet.get('filename_index')
+            self.result_cache = ResultCache(search_utils_path, persist=True)
             
             self.initialized = True
             
@@ -326,7 +342,8 @@ class SearchCLI:
         
         for idx, chunk_id in enumerate(results_full['chunk_id'], 1):
             score = results_full['score'][idx-1]
-            chunk_text = results_full['processed_chunk'][idx-1]
+            # Prefer the original, unprocessed text when the chunk database keeps it
+            chunk_text = results_full.get('original_chunk', results_full['processed_chunk'])[idx-1]
             file_props = results_full['file_properties'][idx-1]
             
             # Convert file path to absolute path and create clickable hyperlink
@@ -338,6 +355,10 @@ class SearchCLI:
             print(f"File: {hyperlink}")
             print(f"Last modified: {file_props['last_modified']}")
             print(f"Chunk ID: {chunk_id}")
+            # Page range, only known for PDF chunks
+            if results_full.get('page_start') and results_full['page_start'][idx-1]:
+                page_start, page_end = results_full['page_start'][idx-1], results_full['page_end'][idx-1]
+                print(f"Pages: {page_start}" if page_start == page_end else f"Pages: {page_start}-{page_end}")
             print(f"\nText preview:")
             # Show first 300 characters
             preview = chunk_text[:300] + "..." if len(chunk_text) > 300 else chunk_text
@@ -345,6 +366,30 @@ class SearchCLI:
         
         print("\n" + "="*70)
     
+    def display_files(self, results, query_text):
+        """Display filename search results in a readable format."""
+        print("\n" + "="*70)
+        print(f"Files matching: '{query_text}' (Filename Search)")
+        print("="*70)
+        
+        if not results['file_id']:
+            print("\nNo results found.")
+            return
+        
+        for idx, (file_id, score) in enumerate(zip(results['file_id'], results['score']), 1):
+            file_props = self.file_dict[file_id]
+            
+            # Convert file path to absolute path and create clickable hyperlink
+            filepath = os.path.abspath(file_props['filepath'])
+            file_uri = Path(filepath).as_uri()
+            hyperlink = f"\x1b]8;;{file_uri}\x1b\\{filepath}\x1b]8;;\x1b\\"
+            
+            print(f"\n--- Result {idx} (Score: {score:.4f}) ---")
+            print(f"File: {hyperlink}")
+            print(f"Last modified: {file_props['last_modified']}")
+        
+        print("\n" + "="*70)
+    
     def search_menu(self):
         """Display search options and handle search queries."""
         # Simplified mode: streamlined search with no options
@@ -370,7 +415,8 @@ class SearchCLI:
                     results = query_bm25(
                         query=query_text,
                         retriever=self.bm25_retriever,
-                        num_results=5
+                        num_results=5,
+                        cache=self.result_cache
                     )
                     
                     # Convert results to include full information
@@ -378,6 +424,7 @@ class SearchCLI:
                     
                     # Display results
                     self.display_results(results_full, query_text, "BM25 Keyword Search")
+                    logging.info(f"Result cache: {self.result_cache.stats()}")
                     
                 except Exception as e:
                     print(f"\n✗ Error during search: {e}")
@@ -390,21 +437,27 @@ class SearchCLI:
                 print("2. Direct Search (exact/regex matching)")
                 if self.has_semantic:
                     print("3. Semantic Search (meaning-based, intelligent)")
-                print("4. Return to main menu")
+                    print("4. Hybrid Search (keyword + semantic, fused)")
+                print("5. Filename Search (file and folder names)")
+                print("6. Return to main menu")
                 
-                choice = input("\nSelect search type (1-4): ").strip()
+                choice = input("\nSelect search type (1-6): ").strip()
                 
-                if choice == '4':
+                if choice == '6':
                     break
                 
-                if choice not in ['1', '2', '3']:
+                if choice not in ['1', '2', '3', '4', '5']:
                     print("Invalid choice. Please try again.")
                     continue
                 
-                if choice == '3' and not self.has_semantic:
+                if choice in ['3', '4'] and not self.has_semantic:
                     print("Semantic search not available. Please choose another option.")
                     continue
                 
+                if choice == '5' and self.filename_index is None:
+                    print("Filename search not available. Please choose another option.")
+                    continue
+                
                 # Get search query
                 query_text = input("\nEnter your search query: ").strip()
                 if not query_text:
@@ -419,16 +472,41 @@ class SearchCLI:
                     validator=lambda x: x > 0
                 )
                 
+                # Filename search returns files directly and has no other options
+                if choice == '5':
+                    try:
+                        print("\nSearching...")
+                        results = query_filenames(
+                            query_text,
+                            index=self.filename_index,
+                            num_results=num_results,
+                            cache=self.result_cache
+                        )
+                        self.display_files(results, query_text)
+                    except Exception as e:
+                        print(f"\n✗ Error during search: {e}")
+                    continue
+                
+                # Ask whether to return the top files instead of the top chunks
+                by_file = input("Return the top files instead of chunks? (y/n) [default: n]: ").strip().lower()
+                by_file = by_file in ['y', 'yes']
+                
+                # Ask whether to rank chunks from files named like the query higher
+                boost = False
+                if not by_file and self.filename_index is not None:
+                    boost = input("Boost results from files whose name matches the query? (y/n) [default: n]: ").strip().lower()
+                    boost = boost in ['y', 'yes']
+                
+                # Ask for an optional filter on the files searched
+                filter_text = input("Filter files, e.g. ext:pdf path:/docs after:2024-01-01 [default: none]: ").strip()
+                
                 # Perform search
                 try:
                     print("\nSearching...")
                     
                     if choice == '1':
-                        results = query_bm25(
-                            query=query_text,
-                            retriever=self.bm25_retriever,
-                            num_results=num_results
-                        )
+                        search = 'bm25'
+                        options = {'retriever': self.bm25_retriever}
                         search_type = "BM25 Keyword Search"
                     
                     elif choice == '2':
@@ -440,13 +518,13 @@ class SearchCLI:
                         use_regex = input("Use regex? (y/n) [default: n]: ").strip().lower()
                         is_regex = use_regex in ['y', 'yes']
                         
-                        results = query_direct(
-                            query=query_text,
-                            chunks=self.chunks,
-                            num_results=num_results,
-                            case_sensitive=case_sensitive,
-                            is_regex=is_regex
-                        )
+                        search = 'direct'
+                        options = {
+                            'case_sensitive': case_sensitive,
+                            'is_regex': is_regex,
+                            'trigram_index': self.trigram_index,
+                            'arena': self.corpus_arena
+                        }
                         search_type = f"Direct Search ({'regex' if is_regex else 'exact'}, {'case-sensitive' if case_sensitive else 'case-insensitive'})"
                     
                     elif choice == '3':
@@ -459,19 +537,65 @@ class SearchCLI:
                             validator=lambda x: 0.01 <= x <= 1.0
                         )
                         
-                        results = query_nn(
+                        # Ask about diversifying the results
+                        diversify = input("Skip near-duplicate results? (y/n) [default: n]: ").strip().lower()
+                        mmr_lambda = 0.5 if diversify in ['y', 'yes'] else None
+                        
+                        search = 'nn'
+                        options = {'index': self.ann_index, 'query_epsilon': epsilon, 'mmr_lambda': mmr_lambda}
+                        search_type = "Semantic Search (ANN, diversified)" if mmr_lambda is not None else "Semantic Search (ANN)"
+                    
+                    elif choice == '4':
+                        # Ask about the fusion method
+                        use_weighted = input("Fuse by weighted scores instead of ranks? (y/n) [default: n]: ").strip().lower()
+                        fusion = 'weighted' if use_weighted in ['y', 'yes'] else 'rrf'
+                        
+                        search = 'hybrid'
+                        options = {'retriever': self.bm25_retriever, 'index': self.ann_index, 'fusion': fusion}
+                        search_type = f"Hybrid Search ({'weighted score' if fusion == 'weighted' else 'reciprocal rank'} fusion)"
+                    
+                    if filter_text:
+                        options['mask'] = filter_mask(self.chunks, self.file_dict, filter_text)
+                        search_type += f", filtered by {filter_text}"
+                    
+                    if by_file:
+                        results = query_files(
+                            query_text,
+                            self.chunks,
+                            search=search,
+                            num_files=num_results,
+                            cache=self.result_cache,
+                            **options
+                        )
+                        search_type += ", top files"
+                    elif boost:
+                        results = query_with_filename_boost(
+                            query_text,
+                            self.chunks,
+                            search=search,
+                            filename_index=self.filename_index,
+                            num_results=num_results,
+                            cache=self.result_cache,
+                            **options
+                        )
+                        search_type += ", filename boost"
+                    else:
+                        if search == 'direct':
+                            options['chunks'] = self.chunks
+                        search_functions = {'bm25': query_bm25, 'direct': query_direct, 'nn': query_nn, 'hybrid': query_hybrid}
+                        results = search_functions[search](
                             query=query_text,
-                            index=self.ann_index,
                             num_results=num_results,
-                            query_epsilon=epsilon
+                            cache=self.result_cache,
+                            **options
                         )
-                        search_type = "Semantic Search (ANN)"
                     
                     # Convert results to include full information
                     results_full = convert_results(results, self.chunks, self.file_dict)
                     
                     # Display results
                     self.display_results(results_full, query_text, search_type)
+                    logging.info(f"Result cache: {self.result_cache.stats()}")
                     
                 except Exception as e:
                     print(f"\n✗ Error during search: {e}")
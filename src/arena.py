@@ -0,0 +1,345 @@
+import os
+import re
+import mmap
+import logging
+import numpy as np
+from itertools import chain, islice
+try:
+    from re import _parser as sre_parse
+    from re import _constants as sre_constants
+except ImportError: # Python < 3.11
+    import sre_parse
+    import sre_constants
+
+#### Define constants/defaults for various functions below
+# Separator between chunks in the arena. Chunks never contain it, since preprocess drops it.
+arena_separator = '\n'
+
+# query_direct scans the arena instead of the trigram candidates once the candidates are more than this
+# share of all chunks. Below it, scanning only the candidates chunk by chunk is faster.
+arena_min_candidate_fraction = 0.25
+
+# Number of regex matches taken from the arena scan at a time
+regex_batch_size = 4096
+
+# A regex scan of the arena is abandoned for a chunk by chunk scan once more than this share of the
+# chunks scanned so far had a match crossing into the next chunk, since each of those is re-counted.
+arena_max_crossing_fraction = 0.05
+
+# A regex scan of the arena is also abandoned once it averages more than this many matches per chunk.
+# Recording a match position costs more than the arena saves per chunk beyond that.
+arena_max_matches_per_chunk = 4
+
+def _has_context_dependence(parsed):
+    """
+    Check whether a parsed regex can behave differently inside the arena than on a single chunk,
+    even for matches that stay within one chunk.
+
+    Lookarounds can look past the chunk edges, and \\A / \\Z only match at the start and end of the
+    whole arena. Everything else either behaves the same or produces a match that crosses a chunk
+    boundary, which CorpusArena.count_regex detects.
+
+    Args:
+        parsed (list): Sequence of (opcode, argument) pairs from sre_parse.
+
+    Returns:
+        bool: True if the pattern has to be matched chunk by chunk.
+    """
+    for op, av in parsed:
+        if op in (sre_constants.ASSERT, sre_constants.ASSERT_NOT):
+            return True
+        if op is sre_constants.AT and av in (sre_constants.AT_BEGINNING_STRING, sre_constants.AT_END_STRING):
+            return True
+        if op is sre_constants.SUBPATTERN:
+            if _has_context_dependence(av[-1]):
+                return True
+        elif op is sre_constants.BRANCH:
+            if any(_has_context_dependence(branch) for branch in av[1]):
+                return True
+        elif op is sre_constants.GROUPREF_EXISTS:
+            if any(branch is not None and _has_context_dependence(branch) for branch in av[1:]):
+                return True
+        elif isinstance(av, tuple) and len(av) == 3 and isinstance(av[2], sre_parse.SubPattern):
+            # Repeats: (min, max, subpattern)
+            if _has_context_dependence(av[2]):
+                return True
+        elif op is getattr(sre_constants, 'ATOMIC_GROUP', None):
+            if _has_context_dependence(av):
+                return True
+    return False
+
+def _write_arena(path:str, texts:list):
+    """
+    Write chunks to an arena file, separated by arena_separator, and return the byte offset of each chunk.
+
+    Args:
+        path (str): File to write.
+        texts (list): Chunk texts.
+
+    Returns:
+        numpy.ndarray: n+1 byte offsets; chunk i is bytes starts[i]:starts[i+1]-1 of the file.
+    """
+    sizes = np.zeros(len(texts) + 1, dtype=np.int64)
+    with open(path, 'wb') as f:
+        for i, text in enumerate(texts):
+            data = text.encode('utf-8')
+            f.write(data)
+            f.write(b'\n')
+            sizes[i + 1] = len(data) + 1
+    return np.cumsum(sizes)
+
+def _map_file(path:str):
+    """Memory-map a file read-only (an empty file gives an empty bytes object, which can't be mapped)."""
+    if os.path.getsize(path) == 0:
+        return b''
+    with open(path, 'rb') as f:
+        return mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+def _find_all(buf, needle:bytes):
+    """
+    Find the start offsets of the non-overlapping occurrences of a byte string, scanning left to right.
+
+    The buffer is compared with numpy one needle byte at a time, which is much faster than a regex
+    scan when the needle is frequent. A needle that can overlap itself (e.g. b'aa') needs a real left
+    to right scan to skip the overlapping occurrences, so it uses re.finditer.
+
+    Args:
+        buf (mmap.mmap or bytes): Buffer to search.
+        needle (bytes): Non-empty byte string to find.
+
+    Returns:
+        numpy.ndarray: Sorted start offsets.
+    """
+    n = len(needle)
+    if any(needle[:k] == needle[-k:] for k in range(1, n)):
+        return np.fromiter((m.start() for m in re.finditer(re.escape(needle), buf)), dtype=np.int64)
+    data = np.frombuffer(buf, dtype=np.uint8)
+    if len(data) < n:
+        return np.empty(0, dtype=np.int64)
+    positions = np.flatnonzero(data[:len(data) - n + 1] == needle[0])
+    for i in range(1, n):
+        positions = positions[data[positions + i] == needle[i]]
+    return positions
+
+def _count_by_chunk(positions, starts):
+    """
+    Count match start positions per chunk.
+
+    Args:
+        positions (numpy.ndarray): Sorted match start offsets in the arena.
+        starts (numpy.ndarray): Chunk start offsets from _write_arena.
+
+    Returns:
+        tuple: Tuple of (chunk IDs, match counts), both ascending by chunk ID.
+    """
+    return _run_lengths(np.searchsorted(starts, positions, side='right') - 1)
+
+def _run_lengths(sorted_ids):
+    """
+    Count the repeats of each value in a sorted array (np.unique with return_counts, without the sort).
+
+    Args:
+        sorted_ids (numpy.ndarray): Sorted integer array.
+
+    Returns:
+        tuple: Tuple of (distinct values, number of repeats of each).
+    """
+    if len(sorted_ids) == 0:
+        return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+    first = np.flatnonzero(np.concatenate(([True], sorted_ids[1:] != sorted_ids[:-1])))
+    return sorted_ids[first], np.diff(np.append(first, len(sorted_ids)))
+
+class CorpusArena:
+    """
+    All chunks of a chunk database in two contiguous, memory-mapped buffers, for whole-corpus direct search.
+
+    One buffer holds the lowercased chunks (str.lower, the same folding query_direct uses for
+    case-insensitive search) and one the chunks as they are, both UTF-8 and separated by '\\n'. A literal
+    is found with a single scan over the mapped bytes instead of lowercasing and scanning every chunk,
+    and each hit is mapped back to its chunk with numpy.searchsorted on the chunk start offsets.
+    UTF-8 is self-synchronizing, so byte matches are exactly the character matches.
+
+    Regular expressions need str semantics, so their buffer is decoded once, on the first regex query.
+
+    Args:
+        path (str): Directory holding the arena files, written by CorpusArena.build.
+    """
+
+    def __init__(self, path:str):
+        self.path = path
+        self.lower = _map_file(os.path.join(path, 'lower.bin'))
+        self.lower_starts = np.load(os.path.join(path, 'lower_starts.npy'))
+        self.text = _map_file(os.path.join(path, 'text.bin'))
+        self.text_starts = np.load(os.path.join(path, 'text_starts.npy'))
+        self.num_chunks = len(self.text_starts) - 1
+        # Regexes can only run over the arena if the separators are the only newlines in it
+        self.separators_only = np.count_nonzero(np.frombuffer(self.text, dtype=np.uint8) == ord(arena_separator)) == self.num_chunks
+        self._decoded = None
+        self._char_starts = None
+
+    @classmethod
+    def build(cls, texts:list, path:str):
+        """
+        Write the arena files for a list of chunks and map them.
+
+        Args:
+            texts (list): Chunk texts, in chunk ID order.
+            path (str): Directory to write the arena to. Created if it doesn't exist.
+
+        Returns:
+            CorpusArena: The arena.
+        """
+        os.makedirs(path, exist_ok=True)
+        for name, buf_texts in (('lower', (t.lower() for t in texts)), ('text', texts)):
+            # Write new files and swap them in, so arenas still mapping the old files keep working
+            buf_path = os.path.join(path, f'{name}.bin')
+            starts_path = os.path.join(path, f'{name}_starts.npy')
+            starts = _write_arena(buf_path + '.tmp', list(buf_texts))
+            with open(starts_path + '.tmp', 'wb') as f:
+                np.save(f, starts)
+            os.replace(buf_path + '.tmp', buf_path)
+            os.replace(starts_path + '.tmp', starts_path)
+        return cls(path)
+
+    @classmethod
+    def load(cls, path:str, num_chunks:int = None):
+        """
+        Map an existing arena.
+
+        Args:
+            path (str): Directory holding the arena files.
+            num_chunks (int, optional): Expected number of chunks. Defaults to None (not checked).
+
+        Returns:
+            CorpusArena: The arena.
+
+        Raises:
+            ValueError: If the arena doesn't hold num_chunks chunks.
+        """
+        arena = cls(path)
+        if num_chunks is not None and arena.num_chunks != num_chunks:
+            arena.close()
+            raise ValueError(f"Corpus arena holds {arena.num_chunks} chunks, expected {num_chunks}.")
+        return arena
+
+    def close(self):
+        """Unmap the arena files."""
+        for buf in (self.lower, self.text):
+            if isinstance(buf, mmap.mmap):
+                buf.close()
+
+    def count_literal(self, pattern:str, case_sensitive:bool = False):
+        """
+        Count non-overlapping occurrences of a literal in every chunk, like str.count on each chunk.
+
+        Args:
+            pattern (str): Literal to count. Must already be lowercased if case_sensitive is False.
+            case_sensitive (bool, optional): Search the original text instead of the lowercased text.
+                Defaults to False.
+
+        Returns:
+            tuple: Tuple of (chunk IDs, match counts) for the chunks with at least one match, ascending
+                by chunk ID. None if the literal can't be searched in the arena (it is empty or contains
+                the separator).
+        """
+        if not pattern or arena_separator in pattern:
+            return None
+        buf, starts = (self.text, self.text_starts) if case_sensitive else (self.lower, self.lower_starts)
+        return _count_by_chunk(_find_all(buf, pattern.encode('utf-8')), starts)
+
+    def _decoded_text(self):
+        """Return the original-case arena as a str, and the character offset of each chunk."""
+        if self._decoded is None:
+            self._decoded = str(self.text, 'utf-8')
+            # Character offsets: byte offsets minus the UTF-8 continuation bytes before them
+            data = np.frombuffer(self.text, dtype=np.uint8)
+            continuation = np.flatnonzero((data & 0xC0) == 0x80)
+            self._char_starts = self.text_starts - np.searchsorted(continuation, self.text_starts)
+        return self._decoded, self._char_starts
+
+    def count_regex(self, pattern:re.Pattern, chunk_texts:list):
+        """
+        Count regex matches in every chunk, like len(list(pattern.finditer(chunk))) on each chunk.
+
+        The whole original-case arena is scanned once, with re.MULTILINE added so '^' and '$' match at
+        chunk edges. A match that crosses a chunk boundary (e.g. '\\s+' running over the separator)
+        means the scan went differently from a per-chunk scan, so every chunk it touched is counted
+        again on its own with the original pattern.
+
+        Args:
+            pattern (re.Pattern): Compiled pattern.
+            chunk_texts (list): Chunk texts, used to re-count chunks touched by boundary-crossing matches.
+
+        Returns:
+            tuple: Tuple of (chunk IDs, match counts) for the chunks with at least one match, ascending
+                by chunk ID. None if the pattern is better matched chunk by chunk: it uses lookarounds or
+                \\A / \\Z, starts with '^', matches very often or keeps crossing chunk boundaries, or a
+                chunk contains a newline.
+        """
+        if not self.separators_only:
+            return None
+        try:
+            parsed = sre_parse.parse(pattern.pattern, pattern.flags)
+        except Exception:
+            return None
+        parsed = list(parsed)
+        if _has_context_dependence(parsed):
+            return None
+        # Anchored patterns only try the start of each chunk, which a chunk by chunk scan does faster
+        if parsed and parsed[0] == (sre_constants.AT, sre_constants.AT_BEGINNING):
+            return None
+
+        text, starts = self._decoded_text()
+        arena_pattern = re.compile(pattern.pattern, pattern.flags | re.MULTILINE)
+        matches = arena_pattern.finditer(text)
+        span_batches, start_batches, crossing_batches = [], [], []
+        num_crossing = num_matches = 0
+        while True:
+            spans = np.fromiter(chain.from_iterable(m.span() for m in islice(matches, regex_batch_size)), dtype=np.int64).reshape(-1, 2)
+            # An empty match after the last separator isn't in any chunk
+            spans = spans[spans[:, 0] < starts[-1]]
+            if len(spans) == 0:
+                break
+            start_chunks = np.searchsorted(starts, spans[:, 0], side='right') - 1
+            # Chunk i ends at starts[i+1] - 1, where its separator is
+            crossing = spans[:, 1] > starts[start_chunks + 1] - 1
+            num_crossing += int(crossing.sum())
+            # Judge by at least the first 1000 chunks, so a few early matches don't end the scan
+            num_matches += len(spans)
+            num_scanned = max(start_chunks[-1] + 1, 1000)
+            # Patterns that keep running over separators (e.g. '\s+') would need most chunks re-counted
+            if num_crossing > arena_max_crossing_fraction * num_scanned:
+                logging.info("Regex matches keep crossing chunk boundaries, matching chunk by chunk instead.")
+                return None
+            # Collecting match positions costs more per match than counting them chunk by chunk
+            if num_matches > arena_max_matches_per_chunk * num_scanned:
+                logging.info("Regex matches too often for the arena, matching chunk by chunk instead.")
+                return None
+            span_batches.append(spans)
+            start_batches.append(start_chunks)
+            crossing_batches.append(crossing)
+
+        if not span_batches:
+            return np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        start_chunks = np.concatenate(start_batches)
+        if num_crossing == 0:
+            return _run_lengths(start_chunks)
+        crossing = np.concatenate(crossing_batches)
+        spans = np.concatenate(span_batches)
+
+        # Chunks touched by a crossing match, including the one the scan resumed in
+        end_chunks = np.searchsorted(starts, spans[crossing, 1], side='right') - 1
+        touched = np.unique(np.concatenate([np.arange(a, b + 1) for a, b in zip(start_chunks[crossing], end_chunks)]))
+        touched = touched[touched < self.num_chunks]
+        logging.info(f"{int(crossing.sum())} regex matches crossed a chunk boundary, re-counting {len(touched)} chunks.")
+
+        keep = ~np.isin(start_chunks, touched)
+        ids, counts = _run_lengths(start_chunks[keep])
+        recount = [(i, sum(1 for _ in pattern.finditer(chunk_texts[i]))) for i in touched.tolist()]
+        recount = [(i, c) for i, c in recount if c > 0]
+        if recount:
+            ids = np.concatenate([ids, np.array([i for i, _ in recount], dtype=np.int64)])
+            counts = np.concatenate([counts, np.array([c for _, c in recount], dtype=np.int64)])
+            order = np.argsort(ids)
+            ids, counts = ids[order], counts[order]
+        return ids, counts
@@ -0,0 +1,251 @@
+import os
+import json
+import uuid
+import shutil
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+
+#### Define constants/defaults for various functions below
+# File in search_utils holding the current index version. initialize writes a new version whenever
+# it rebuilds the indexes, which invalidates every cached result.
+index_version_filename = 'index_version'
+
+# Directory in search_utils holding the on-disk tier of the result cache
+result_cache_dirname = 'result_cache'
+
+def read_index_version(search_utils_path:str = './search_utils'):
+    """
+    Read the current index version.
+
+    Args:
+        search_utils_path (str, optional): Path to the search_utils directory. Defaults to './search_utils'.
+
+    Returns:
+        str: The index version, or None if the indexes were built before versions were recorded.
+    """
+    try:
+        with open(os.path.join(search_utils_path, index_version_filename), 'r', encoding='utf-8') as f:
+            return f.read().strip() or None
+    except FileNotFoundError:
+        return None
+
+def bump_index_version(search_utils_path:str = './search_utils'):
+    """
+    Record a new index version and drop the on-disk result cache.
+
+    Called by initialize after the indexes are rebuilt. Results cached under an older version are
+    never returned again, by this process or any other.
+
+    Args:
+        search_utils_path (str, optional): Path to the search_utils directory. Defaults to './search_utils'.
+
+    Returns:
+        str: The new index version.
+    """
+    version = uuid.uuid4().hex
+    # Swap in a new file, so caches see a new inode even where modification times are too coarse to change
+    path = os.path.join(search_utils_path, index_version_filename)
+    with open(path + '.tmp', 'w', encoding='utf-8') as f:
+        f.write(version)
+    os.replace(path + '.tmp', path)
+    shutil.rmtree(os.path.join(search_utils_path, result_cache_dirname), ignore_errors=True)
+    logging.info(f"Index version is now {version}.")
+    return version
+
+class ResultCache:
+    """
+    Cache of query results, keyed on search type, normalized query, options and index version.
+
+    Results are kept in an in-memory LRU and, if persist is set, also written as small JSON files
+    to search_utils/result_cache so they survive restarts. The index version is read from
+    search_utils/index_version; the file is only re-read when it changes on disk, so a rebuild
+    by initialize (in this or another process) invalidates all cached results automatically.
+
+    Pass an instance as the cache argument of query_bm25, query_direct or query_nn.
+
+    Args:
+        search_utils_path (str, optional): Path to the search_utils directory. Defaults to './search_utils'.
+        max_entries (int, optional): Maximum number of results kept in memory. Defaults to 256.
+        persist (bool, optional): Also store results on disk. Defaults to False.
+        max_disk_entries (int, optional): Maximum number of results kept on disk. Defaults to 10000.
+    """
+
+    def __init__(self, search_utils_path:str = './search_utils', max_entries:int = 256,
+                 persist:bool = False, max_disk_entries:int = 10000):
+        self.search_utils_path = search_utils_path
+        self.max_entries = max_entries
+        self.persist = persist
+        self.max_disk_entries = max_disk_entries
+        self.hits = 0
+        self.disk_hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        self._version = None
+        self._version_stat = None
+        self._disk_count = None
+
+    @property
+    def disk_path(self):
+        """Directory of the on-disk tier."""
+        return os.path.join(self.search_utils_path, result_cache_dirname)
+
+    def _current_version(self):
+        """
+        Return the current index version, re-reading it only if the version file changed.
+        Drops the in-memory tier when the version changes.
+        """
+        try:
+            st = os.stat(os.path.join(self.search_utils_path, index_version_filename))
+            stat = (st.st_mtime_ns, st.st_size, st.st_ino)
+        except FileNotFoundError:
+            stat = None
+        if stat != self._version_stat:
+            version = read_index_version(self.search_utils_path) if stat is not None else None
+            if version != self._version:
+                self._entries.clear()
+                self._disk_count = None
+            self._version = version
+            self._version_stat = stat
+        return self._version
+
+    def _disk_file(self, key_str:str):
+        """Path of the on-disk entry for a serialized key."""
+        return os.path.join(self.disk_path, hashlib.sha1(key_str.encode('utf-8')).hexdigest() + '.json')
+
+    @staticmethod
+    def _copy(results):
+        """Copy a result so callers can't modify the cached one."""
+        return {key: [dict(v) if isinstance(v, dict) else v for v in value] for key, value in results.items()}
+
+    def get(self, search_type:str, query:str, **options):
+        """
+        Look up a cached result.
+
+        Args:
+            search_type (str): Name of the search, e.g. 'bm25', 'direct' or 'nn'.
+            query (str): Normalized query text.
+            **options: Every other argument that changes the result, e.g. num_results.
+
+        Returns:
+            dict: The cached result with 'id' and 'score', or None on a miss.
+        """
+        with self._lock:
+            version = self._current_version()
+            key_str = json.dumps([search_type, query, sorted(options.items()), version])
+            results = self._entries.get(key_str)
+            if results is not None:
+                self._entries.move_to_end(key_str)
+                self.hits += 1
+                return self._copy(results)
+
+        if self.persist:
+            try:
+                with open(self._disk_file(key_str), 'r', encoding='utf-8') as f:
+                    entry = json.load(f)
+                # Guard against hash collisions and entries written under an older version
+                if entry['key'] == key_str:
+                    with self._lock:
+                        self._store(key_str, entry['results'])
+                        self.hits += 1
+                        self.disk_hits += 1
+                    return self._copy(entry['results'])
+            except (OSError, ValueError, KeyError):
+                pass
+
+        with self._lock:
+            self.misses += 1
+        return None
+
+    def put(self, search_type:str, query:str, results:dict, **options):
+        """
+        Store a query result.
+
+        Args:
+            search_type (str): Name of the search, e.g. 'bm25', 'direct' or 'nn'.
+            query (str): Normalized query text.
+            results (dict): Query result with 'id' and 'score'.
+            **options: Every other argument that changes the result, as passed to get.
+        """
+        results = self._copy(results)
+        with self._lock:
+            version = self._current_version()
+            key_str = json.dumps([search_type, query, sorted(options.items()), version])
+            self._store(key_str, results)
+
+        if self.persist:
+            try:
+                self._write_disk(key_str, results)
+            except OSError as e:
+                logging.warning(f"Could not write result cache entry: {e}")
+
+    def _store(self, key_str:str, results:dict):
+        """Add an entry to the in-memory LRU. Caller holds the lock."""
+        self._entries[key_str] = results
+        self._entries.move_to_end(key_str)
+        while len(self._entries) > self.max_entries:
+            self._entries.popitem(last=False)
+
+    def _write_disk(self, key_str:str, results:dict):
+        """Write an entry to the on-disk tier, pruning the oldest entries when it is full."""
+        os.makedirs(self.disk_path, exist_ok=True)
+        path = self._disk_file(key_str)
+        is_new = not os.path.exists(path)
+        # Write to a temporary file first so a concurrent reader never sees a partial entry
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as f:
+            f.write(json.dumps({'key': key_str, 'results': results}))
+        os.replace(tmp_path, path)
+
+        if not is_new:
+            return
+        with self._lock:
+            if self._disk_count is None:
+                self._disk_count = sum(1 for name in os.listdir(self.disk_path) if name.endswith('.json'))
+            else:
+                self._disk_count += 1
+            if self._disk_count <= self.max_disk_entries:
+                return
+            # Prune the oldest tenth in one pass rather than one file per write
+            with os.scandir(self.disk_path) as it:
+                entries = sorted((e.stat().st_mtime, e.path) for e in it if e.name.endswith('.json'))
+            excess = len(entries) - self.max_disk_entries + self.max_disk_entries // 10
+            for _, old_path in entries[:max(excess, 0)]:
+                try:
+                    os.remove(old_path)
+                except OSError:
+                    pass
+            self._disk_count = len(entries) - max(excess, 0)
+
+    def clear(self):
+        """Remove every cached result from memory and disk. Counters are kept."""
+        with self._lock:
+            self._entries.clear()
+            self._disk_count = None
+        shutil.rmtree(self.disk_path, ignore_errors=True)
+
+    def stats(self):
+        """
+        Report cache counters, for sizing the cache.
+
+        Returns:
+            dict: Dictionary containing:
+                - 'hits': Lookups answered from the cache (memory or disk)
+                - 'disk_hits': Lookups answered from the on-disk tier
+                - 'misses': Lookups not in the cache
+                - 'hit_rate': hits / (hits + misses), or 0.0 before the first lookup
+                - 'entries': Number of results currently held in memory
+                - 'max_entries': Capacity of the in-memory tier
+        """
+        with self._lock:
+            lookups = self.hits + self.misses
+            return {
+                'hits': self.hits,
+                'disk_hits': self.disk_hits,
+                'misses': self.misses,
+                'hit_rate': self.hits / lookups if lookups else 0.0,
+                'entries': len(self._entries),
+                'max_entries': self.max_entries,
+            }
@@ -0,0 +1,284 @@
+import os
+import json
+import struct
+import shutil
+import logging
+import numpy as np
+from array import array
+from itertools import groupby
+from chunktable import ChunkTable, DocumentMap, int_columns
+
+#### Define constants/defaults for various functions below
+chunk_store_filename = 'chunk_store.bin'
+legacy_chunk_db_filename = 'chunked_db.json'
+default_chunk_store_path = os.path.join('.', 'search_utils', chunk_store_filename)
+
+# File header: magic, format version, reserved, offset and length of the JSON footer
+chunk_store_magic = b'SSCHUNKS'
+# Version 2 keeps the original documents in their own section instead of the footer
+chunk_store_version = 2
+_header = struct.Struct('<8sIIQQ')
+
+# Windows can't replace a file while it is memory-mapped, which updating a chunk store in place needs,
+# so there stores are read into memory instead
+mmap_chunk_store = os.name != 'nt'
+
+_array_codes = {np.int64: 'q', np.int32: 'i'}
+
+class ChunkStoreWriter:
+    """
+    Write a binary chunk store one file's chunks at a time.
+
+    A chunk store holds a chunk database as a chunktable.ChunkTable: a header, the UTF-8 chunk texts as
+    one blob, the per-chunk arrays (text offsets, file indexes, page numbers, ...), with keep_original the
+    UTF-8 documents as another blob with their offsets, and a JSON footer with the file ID table, the
+    position of every array and the database's other, small keys. Texts and documents are written to disk
+    as they are added; only the per-chunk and per-document integers are kept in memory until the store is
+    closed.
+
+    The store is written to path + '.tmp' and moved into place by close, so an interrupted write never
+    leaves a partial store behind. Use it as a context manager:
+
+        with ChunkStoreWriter(path, track_pages=True) as writer:
+            writer.add_file(f_id, chunks)
+            writer.metadata['chunk_size'] = chunk_size
+
+    Args:
+        path (str): Path of the chunk store.
+        keep_original (bool, optional): Store the 'text_start' and 'text_end' columns and the original
+            documents, as utils.chunk_db does with keep_original. Defaults to False.
+        track_pages (bool, optional): Store the 'page_start' and 'page_end' columns. Defaults to False.
+    """
+
+    def __init__(self, path:str, keep_original:bool = False, track_pages:bool = False):
+        self.path = path
+        self.metadata = {}
+        keys = (['text_start', 'text_end'] if keep_original else []) + (['page_start', 'page_end'] if track_pages else [])
+        self._columns = {key: array(_array_codes[int_columns[key]]) for key in keys}
+        self._offsets = array('q', [0])
+        self._file_index = array('i')
+        self._file_positions = {}
+        self._file = open(path + '.tmp', 'wb')
+        self._file.write(bytes(_header.size))
+        # Documents go to a file of their own until close appends them after the chunk texts
+        self._documents = open(path + '.documents.tmp', 'w+b') if keep_original else None
+        self._document_offsets = array('q', [0])
+        self._document_index = array('i')
+
+    @property
+    def num_chunks(self):
+        """Number of chunks added so far."""
+        return len(self._file_index)
+
+    def add_file(self, f_id:str, chunks):
+        """
+        Append the chunks of one file.
+
+        Args:
+            f_id (str): File ID of the chunks.
+            chunks (list or dict): List of chunk texts, or a dictionary of per-chunk columns (with
+                'processed_chunk', and optionally a 'document'), as returned by utils.chunk_files.
+        """
+        code = self._file_positions.setdefault(f_id, len(self._file_positions))
+        if isinstance(chunks, dict):
+            for key, values in self._columns.items():
+                if key in chunks:
+                    values.extend(chunks[key])
+            if 'document' in chunks and self._documents is not None:
+                document = chunks['document'].encode('utf-8')
+                self._documents.write(document)
+                self._document_offsets.append(self._document_offsets[-1] + len(document))
+                self._document_index.append(code)
+            chunks = chunks['processed_chunk']
+
+        encoded = [text.encode('utf-8') for text in chunks]
+        self._file.write(b''.join(encoded))
+        end = self._offsets[-1]
+        for text in encoded:
+            end += len(text)
+            self._offsets.append(end)
+        self._file_index.extend([code] * len(encoded))
+
+    def add_chunks(self, chunks, exclude=()):
+        """
+        Append the chunks of an existing chunk database, one file at a time.
+
+        Args:
+            chunks (dict or chunktable.ChunkTable): Chunk database, as returned by utils.chunk_db.
+            exclude (set, optional): File IDs whose chunks are left out. Defaults to none.
+        """
+        file_ids, documents = chunks['file_id'], chunks.get('documents', {})
+        columns = [key for key in self._columns if key in chunks]
+        start = 0
+        for f_id, rows in groupby(file_ids):
+            end = start + sum(1 for _ in rows)
+            if f_id not in exclude:
+                file_chunks = {key: chunks[key][start:end] for key in columns}
+                file_chunks['processed_chunk'] = chunks['processed_chunk'][start:end]
+                if f_id in documents:
+                    file_chunks['document'] = documents[f_id]
+                self.add_file(f_id, file_chunks)
+            start = end
+
+    def _write_array(self, sections:dict, name:str, values:np.ndarray):
+        """Write one array, 8-byte aligned, and record where it is."""
+        self._file.write(bytes(-self._file.tell() % 8))
+        sections[name] = [self._file.tell(), values.dtype.str, len(values)]
+        self._file.write(values.tobytes())
+
+    def close(self):
+        """Write the arrays and footer, and move the store into place."""
+        sections = {'text': [_header.size, '|u1', self._offsets[-1]]}
+        self._write_array(sections, 'text_offsets', np.frombuffer(self._offsets, dtype=np.int64))
+        self._write_array(sections, 'file_index', np.array(self._file_index, dtype=np.int32))
+        for key, values in self._columns.items():
+            self._write_array(sections, key, np.array(values, dtype=int_columns[key]))
+        if self._documents is not None:
+            sections['documents'] = [self._file.tell(), '|u1', self._document_offsets[-1]]
+            self._documents.seek(0)
+            shutil.copyfileobj(self._documents, self._file)
+            self._close_documents()
+            self._write_array(sections, 'document_offsets', np.frombuffer(self._document_offsets, dtype=np.int64))
+            self._write_array(sections, 'document_index', np.array(self._document_index, dtype=np.int32))
+
+        footer = json.dumps({
+            'num_chunks': self.num_chunks,
+            'file_ids': list(self._file_positions),
+            'sections': sections,
+            'metadata': self.metadata,
+        }, ensure_ascii=False).encode('utf-8')
+        footer_offset = self._file.tell()
+        self._file.write(footer)
+        self._file.seek(0)
+        self._file.write(_header.pack(chunk_store_magic, chunk_store_version, 0, footer_offset, len(footer)))
+        self._file.close()
+        os.replace(self.path + '.tmp', self.path)
+
+    def _close_documents(self):
+        """Close and remove the temporary documents file."""
+        self._documents.close()
+        os.remove(self.path + '.documents.tmp')
+        self._documents = None
+
+    def abort(self):
+        """Discard the partly written store."""
+        self._file.close()
+        os.remove(self.path + '.tmp')
+        if self._documents is not None:
+            self._close_documents()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc, tb):
+        if exc_type is None:
+            self.close()
+        else:
+            self.abort()
+
+def write_chunk_store(chunks, path:str = default_chunk_store_path):
+    """
+    Write a whole chunk database to a chunk store.
+
+    Args:
+        chunks (dict or chunktable.ChunkTable): Chunk database, as returned by utils.chunk_db.
+        path (str, optional): Path of the chunk store. Defaults to './search_utils/chunk_store.bin'.
+    """
+    with ChunkStoreWriter(path, keep_original='documents' in chunks, track_pages='page_start' in chunks) as writer:
+        writer.add_chunks(chunks)
+        # add_chunks already wrote the documents
+        writer.metadata.update({key: chunks[key] for key in chunks
+                                if key not in ('processed_chunk', 'file_id', 'chunk_id', 'documents') and key not in int_columns})
+
+def is_chunk_store(path:str):
+    """Whether a file is a chunk store, judging by its first bytes."""
+    with open(path, 'rb') as f:
+        return f.read(len(chunk_store_magic)) == chunk_store_magic
+
+def load_chunk_store(path:str = default_chunk_store_path, mmap:bool = None):
+    """
+    Open a chunk store.
+
+    Only the footer is read up front. The texts, documents and per-chunk arrays are memory-mapped, so a
+    chunk's text or a file's document is only read from disk when it is accessed.
+
+    Args:
+        path (str, optional): Path of the chunk store. Defaults to './search_utils/chunk_store.bin'.
+        mmap (bool, optional): Memory-map the store instead of reading it into memory. Defaults to
+            mmap_chunk_store, which is True except on Windows.
+
+    Returns:
+        chunktable.ChunkTable: The chunk database.
+
+    Raises:
+        ValueError: If the file is not a chunk store or was written by a newer format version.
+    """
+    mmap = mmap_chunk_store if mmap is None else mmap
+    with open(path, 'rb') as f:
+        magic, version, _, footer_offset, footer_length = _header.unpack(f.read(_header.size))
+        if magic != chunk_store_magic:
+            raise ValueError(f"{path} is not a chunk store.")
+        if version > chunk_store_version:
+            raise ValueError(f"{path} is a version {version} chunk store; this version reads up to {chunk_store_version}.")
+        f.seek(footer_offset)
+        footer = json.loads(f.read(footer_length).decode('utf-8'))
+
+    data = np.memmap(path, dtype=np.uint8, mode='r') if mmap else np.fromfile(path, dtype=np.uint8)
+
+    def section(name):
+        offset, dtype, length = footer['sections'][name]
+        dtype = np.dtype(dtype)
+        return data[offset:offset + length * dtype.itemsize].view(dtype)
+
+    columns = {key: section(key) for key in int_columns if key in footer['sections']}
+    metadata = footer['metadata']
+    if 'documents' in footer['sections']:
+        # Version 1 stores kept the documents in the footer metadata instead
+        metadata['documents'] = DocumentMap(section('documents'), section('document_offsets'),
+                                            section('document_index'), footer['file_ids'])
+    return ChunkTable(section('text'), section('text_offsets'), section('file_index'), footer['file_ids'],
+                      columns, metadata)
+
+def migrate_chunk_db(json_path:str, store_path:str = default_chunk_store_path, remove_json:bool = True):
+    """
+    Convert a JSON chunk database, as written by earlier versions, to a chunk store.
+
+    Args:
+        json_path (str): Path of the JSON chunk database.
+        store_path (str, optional): Path of the chunk store to write. Defaults to './search_utils/chunk_store.bin'.
+        remove_json (bool, optional): Delete the JSON file once the store is written, so it is never
+            read again in place of the newer store. Defaults to True.
+
+    Returns:
+        chunktable.ChunkTable: The chunk database, opened from the new store.
+    """
+    logging.info(f"Migrating {json_path} to a chunk store...")
+    with open(json_path, 'r', encoding='utf-8') as f:
+        chunks = json.load(f)
+    write_chunk_store(chunks, store_path)
+    del chunks
+    if remove_json:
+        os.remove(json_path)
+    logging.info(f"Chunk database migrated to {store_path}")
+    return load_chunk_store(store_path)
+
+def load_chunk_db(path:str = None, mmap:bool = None):
+    """
+    Load a chunk database from a chunk store or a JSON file.
+
+    Args:
+        path (str, optional): Path of a chunk store or JSON chunk database. Defaults to
+            './search_utils/chunk_store.bin', or './search_utils/chunked_db.json' if there is no store.
+        mmap (bool, optional): Memory-map a chunk store, as in load_chunk_store. Defaults to mmap_chunk_store.
+
+    Returns:
+        chunktable.ChunkTable or dict: The chunk database; a dictionary if it was read from JSON.
+    """
+    if path is None:
+        path = default_chunk_store_path
+        if not os.path.exists(path):
+            path = os.path.join(os.path.dirname(path), legacy_chunk_db_filename)
+    if is_chunk_store(path):
+        return load_chunk_store(path, mmap)
+    with open(path, 'r', encoding='utf-8') as f:
+        return json.load(f)
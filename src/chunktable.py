@@ -0,0 +1,256 @@
+import numpy as np
+from collections.abc import Mapping, Sequence
+
+#### Define constants/defaults for various functions below
+# Per-chunk integer columns of a chunk database, and the dtype each is stored as
+int_columns = {'text_start': np.int64, 'text_end': np.int64, 'page_start': np.int32, 'page_end': np.int32}
+
+class _Column(Sequence):
+    """
+    Read-only, list-like view of one column of a ChunkTable.
+
+    Indexing with an int returns a plain Python value and slicing returns a list, as with the lists of
+    a chunk database dictionary.
+    """
+
+    def __len__(self):
+        return self._length
+
+    def _index(self, i):
+        """Check an index and make it non-negative."""
+        i = int(i)
+        if i < 0:
+            i += self._length
+        if not 0 <= i < self._length:
+            raise IndexError("chunk index out of range")
+        return i
+
+    def __getitem__(self, i):
+        if isinstance(i, slice):
+            return [self._get(j) for j in range(*i.indices(self._length))]
+        return self._get(self._index(i))
+
+    def __iter__(self):
+        for i in range(self._length):
+            yield self._get(i)
+
+    def tolist(self):
+        """The column as a list."""
+        return list(self)
+
+class _TextColumn(_Column):
+    """Chunk texts, decoded on access from a single UTF-8 buffer."""
+
+    def __init__(self, data, offsets):
+        self._data = data
+        self._offsets = offsets
+        self._length = len(offsets) - 1
+
+    def _get(self, i):
+        return bytes(self._data[self._offsets[i]:self._offsets[i + 1]]).decode('utf-8')
+
+    def __iter__(self):
+        data, offsets = self._data, self._offsets.tolist()
+        for start, end in zip(offsets[:-1], offsets[1:]):
+            yield bytes(data[start:end]).decode('utf-8')
+
+class _FileIdColumn(_Column):
+    """File ID of every chunk, looked up from the file ID table by the chunk's file index."""
+
+    def __init__(self, file_index, file_ids):
+        self._file_index = file_index
+        self._file_ids = file_ids
+        self._length = len(file_index)
+
+    def _get(self, i):
+        return self._file_ids[self._file_index[i]]
+
+    def __iter__(self):
+        file_ids = self._file_ids
+        for code in self._file_index.tolist():
+            yield file_ids[code]
+
+class _ChunkIdColumn(_Column):
+    """Chunk IDs, which are implicit: the ID of a chunk is its index."""
+
+    def __init__(self, length:int):
+        self._length = length
+
+    def _get(self, i):
+        return i
+
+    def __iter__(self):
+        return iter(range(self._length))
+
+class _IntColumn(_Column):
+    """Integer column, returning Python ints."""
+
+    def __init__(self, values):
+        self._values = values
+        self._length = len(values)
+
+    def _get(self, i):
+        return int(self._values[i])
+
+    def __iter__(self):
+        return iter(self._values.tolist())
+
+class DocumentMap(Mapping):
+    """
+    Read-only mapping of file ID to original document, decoded on access from a single UTF-8 buffer.
+
+    Chunk stores written with keep_original keep the documents this way, so only the document of a
+    chunk being read is decoded, instead of every document being parsed when the store is opened.
+
+    Args:
+        data (bytes or numpy.ndarray): Concatenated UTF-8 documents.
+        offsets (numpy.ndarray): Start of every document in data, plus the end of the last (int64).
+        file_index (numpy.ndarray): File index of every document (int32).
+        file_ids (list): File ID of every file index.
+    """
+
+    def __init__(self, data, offsets, file_index, file_ids:list):
+        self._texts = _TextColumn(data, offsets)
+        self._positions = {file_ids[f]: d for d, f in enumerate(file_index.tolist())}
+
+    def __getitem__(self, file_id):
+        return self._texts[self._positions[file_id]]
+
+    def __iter__(self):
+        return iter(self._positions)
+
+    def __len__(self):
+        return len(self._positions)
+
+class ChunkTable(Mapping):
+    """
+    Compact, columnar chunk database.
+
+    A chunk database dictionary keeps a Python string per chunk for its text and for its file ID, and
+    writes the chunk IDs out as a list. Here the texts are one UTF-8 buffer with an offset per chunk, the
+    file ID of every chunk is an int32 index into a table of the distinct file IDs, and chunk IDs are
+    implicit. The chunks of each file are found through CSR offsets: the chunks of file index f are
+    chunk IDs file_offsets[f] to file_offsets[f+1] - 1 (see chunks_of). Chunk databases store each file's
+    chunks contiguously; if a table's aren't, file_chunks holds the chunk IDs grouped by file, and the
+    offsets index into it instead.
+
+    The table is also a read-only mapping with the keys of the dictionary it was built from, so it can be
+    passed wherever a chunk database dictionary is read: table['processed_chunk'][i], table['file_id'][i],
+    table['chunk_id'] and so on return the same values. Keys that aren't per-chunk columns, such as
+    'documents' or 'source_files', are returned as they are; 'documents' may be a DocumentMap.
+
+    Args:
+        text (bytes or numpy.ndarray): Concatenated UTF-8 chunk texts.
+        text_offsets (numpy.ndarray): Start of every chunk's text in text, plus the end of the last (int64).
+        file_index (numpy.ndarray): File index of every chunk (int32).
+        file_ids (list): File ID of every file index.
+        columns (dict, optional): Other per-chunk integer columns, e.g. 'page_start', as numpy arrays.
+            Defaults to None.
+        metadata (dict, optional): Keys of the chunk database that aren't per-chunk columns. Defaults to None.
+    """
+
+    def __init__(self, text, text_offsets, file_index, file_ids:list, columns:dict = None, metadata:dict = None):
+        self.text = text
+        self.text_offsets = text_offsets
+        self.file_index = file_index
+        self.file_ids = list(file_ids)
+        self.columns = {} if columns is None else columns
+        self.metadata = {} if metadata is None else metadata
+
+        # CSR offsets of each file's chunks; file indexes are numbered in order of first appearance, so
+        # the chunks are contiguous exactly when the file indexes never decrease
+        counts = np.bincount(file_index, minlength=len(self.file_ids))
+        self.file_offsets = np.zeros(len(self.file_ids) + 1, dtype=np.int64)
+        self.file_offsets[1:] = np.cumsum(counts)
+        self.file_chunks = None
+        if not np.all(file_index[1:] >= file_index[:-1]):
+            self.file_chunks = np.argsort(file_index, kind='stable')
+        self._file_positions = {f_id: f for f, f_id in enumerate(self.file_ids)}
+
+        self._views = {
+            'processed_chunk': _TextColumn(text, text_offsets),
+            'file_id': _FileIdColumn(file_index, self.file_ids),
+            'chunk_id': _ChunkIdColumn(len(file_index)),
+        }
+        self._views.update({key: _IntColumn(values) for key, values in self.columns.items()})
+
+    @property
+    def num_chunks(self):
+        """Number of chunks."""
+        return len(self.file_index)
+
+    @property
+    def num_files(self):
+        """Number of distinct files."""
+        return len(self.file_ids)
+
+    @classmethod
+    def from_dict(cls, chunks:dict):
+        """
+        Build a table from a chunk database dictionary.
+
+        Args:
+            chunks (dict): Chunk database dictionary as returned by utils.chunk_db, with at least
+                'processed_chunk' and 'file_id' lists.
+
+        Returns:
+            ChunkTable: The table. File indexes are numbered in order of the files' first chunks.
+        """
+        encoded = [text.encode('utf-8') for text in chunks['processed_chunk']]
+        text_offsets = np.zeros(len(encoded) + 1, dtype=np.int64)
+        text_offsets[1:] = np.cumsum([len(text) for text in encoded])
+
+        codes_by_id = {}
+        file_index = np.fromiter((codes_by_id.setdefault(f_id, len(codes_by_id)) for f_id in chunks['file_id']),
+                                 dtype=np.int32, count=len(encoded))
+
+        columns = {key: np.array(chunks[key], dtype=dtype) for key, dtype in int_columns.items() if key in chunks}
+        metadata = {key: value for key, value in chunks.items()
+                    if key not in ('processed_chunk', 'file_id', 'chunk_id') and key not in columns}
+        return cls(b''.join(encoded), text_offsets, file_index, list(codes_by_id), columns, metadata)
+
+    def to_dict(self):
+        """
+        Convert the table back to a chunk database dictionary of lists, e.g. to save it as JSON.
+
+        Returns:
+            dict: Chunk database dictionary, in the format of utils.chunk_db.
+        """
+        chunks = {
+            'processed_chunk': self._views['processed_chunk'].tolist(),
+            'file_id': self._views['file_id'].tolist(),
+        }
+        chunks.update({key: values.tolist() for key, values in self.columns.items()})
+        chunks.update({key: dict(value) if isinstance(value, DocumentMap) else value for key, value in self.metadata.items()})
+        chunks['chunk_id'] = list(range(self.num_chunks))
+        return chunks
+
+    def chunks_of(self, file_id:str):
+        """
+        Chunk IDs of one file.
+
+        Args:
+            file_id (str): File ID.
+
+        Returns:
+            numpy.ndarray: The file's chunk IDs in order, empty if the file has no chunks.
+        """
+        f = self._file_positions.get(file_id)
+        if f is None:
+            return np.empty(0, dtype=np.int64)
+        start, end = self.file_offsets[f], self.file_offsets[f + 1]
+        if self.file_chunks is None:
+            return np.arange(start, end, dtype=np.int64)
+        return self.file_chunks[start:end]
+
+    def __getitem__(self, key):
+        if key in self._views:
+            return self._views[key]
+        return self.metadata[key]
+
+    def __iter__(self):
+        yield from self._views
+        yield from self.metadata
+
+    def __len__(self):
+        return len(self._views) + len(self.metadata)
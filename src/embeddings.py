@@ -0,0 +1,147 @@
+import os
+import json
+import hashlib
+import logging
+import numpy as np
+from models import default_model_name, default_model_options, get_model
+
+#### Define constants/defaults for various functions below
+# Files in search_utils holding the chunk embeddings, the content key of every row, and what they were
+# encoded with. Row i of the matrix is the embedding of chunk i.
+embeddings_filename = 'embeddings.npy'
+embedding_keys_filename = 'embedding_keys.npy'
+embeddings_meta_filename = 'embeddings.json'
+
+# Bytes of the BLAKE2b digest used as the content key of a chunk
+key_size = 16
+
+def chunk_keys(texts:list):
+    """
+    Compute the content key of every chunk.
+
+    Args:
+        texts (list): Chunk texts.
+
+    Returns:
+        numpy.ndarray: One key_size-byte key per chunk.
+    """
+    return np.array([hashlib.blake2b(text.encode('utf-8'), digest_size=key_size).digest() for text in texts],
+                    dtype=f'S{key_size}')
+
+def model_id(model_name:str, options:dict = None):
+    """Describe a model and its options, to check that stored embeddings came from the same model."""
+    if options is None:
+        options = default_model_options
+    return {'model_name': model_name, 'options': dict(sorted(options.items()))}
+
+def _paths(search_utils_path:str):
+    """Paths of the embedding matrix, the row keys and the metadata."""
+    return (os.path.join(search_utils_path, embeddings_filename),
+            os.path.join(search_utils_path, embedding_keys_filename),
+            os.path.join(search_utils_path, embeddings_meta_filename))
+
+def load_embeddings(search_utils_path:str = './search_utils', model_name:str = default_model_name,
+                    options:dict = None, keys:np.ndarray = None):
+    """
+    Memory-map the stored chunk embeddings.
+
+    Args:
+        search_utils_path (str, optional): Path to the search_utils directory. Defaults to './search_utils'.
+        model_name (str, optional): Model the embeddings must have been encoded with. Defaults to
+            "minishlab/potion-retrieval-32M".
+        options (dict, optional): Model options the embeddings must have been encoded with. Defaults
+            to models.default_model_options if None.
+        keys (numpy.ndarray, optional): Content key of every current chunk, in chunk ID order, e.g. from
+            chunk_keys or incremental.IncrementalIndex.keys_by_chunk. If given, every row is checked to
+            hold the embedding of the chunk with the same ID. Defaults to None.
+
+    Returns:
+        tuple: Tuple of (embedding matrix, row keys), both memory-mapped.
+
+    Raises:
+        ValueError: If there are no stored embeddings, they were encoded with another model, the files
+            don't agree with each other, or the rows don't line up with keys.
+    """
+    matrix_path, keys_path, meta_path = _paths(search_utils_path)
+    try:
+        with open(meta_path, 'r', encoding='utf-8') as f:
+            meta = json.load(f)
+        matrix = np.load(matrix_path, mmap_mode='r')
+        row_keys = np.load(keys_path, mmap_mode='r')
+    except (OSError, ValueError) as e:
+        raise ValueError(f"No stored embeddings in {search_utils_path}: {e}")
+
+    if meta.get('model') != model_id(model_name, options):
+        raise ValueError(f"Stored embeddings were encoded with another model: {meta.get('model')}.")
+    if not (matrix.shape[0] == row_keys.shape[0] == meta.get('num_rows')):
+        raise ValueError("Stored embeddings and their keys don't have the same number of rows.")
+    if keys is not None:
+        if len(keys) != matrix.shape[0]:
+            raise ValueError(f"Stored embeddings have {matrix.shape[0]} rows, but there are {len(keys)} chunks.")
+        misaligned = np.flatnonzero(row_keys != keys)
+        if len(misaligned):
+            raise ValueError(f"Stored embeddings don't match {len(misaligned)} chunks, e.g. chunk {misaligned[0]}.")
+    return matrix, row_keys
+
+def embed_chunks(texts:list, search_utils_path:str = './search_utils', model_name:str = default_model_name,
+                 options:dict = None, show_progress:bool = True):
+    """
+    Return the embedding of every chunk, encoding only the chunks that have no stored embedding yet.
+
+    Stored rows are looked up by content key, so chunks that kept their text reuse their row even if
+    their chunk ID changed. The rows are rewritten in chunk ID order, the new files swapped in, and
+    the result memory-mapped.
+
+    Args:
+        texts (list): Chunk texts, in chunk ID order.
+        search_utils_path (str, optional): Path to the search_utils directory. Defaults to './search_utils'.
+        model_name (str, optional): Name of the Model2Vec model. Defaults to "minishlab/potion-retrieval-32M".
+        options (dict, optional): Options passed to StaticModel.from_pretrained. Defaults to
+            models.default_model_options if None.
+        show_progress (bool, optional): Show the encoding progress bar. Defaults to True.
+
+    Returns:
+        numpy.ndarray: Memory-mapped (num_chunks, dim) float16 embedding matrix.
+    """
+    matrix_path, keys_path, meta_path = _paths(search_utils_path)
+    keys = chunk_keys(texts)
+
+    try:
+        old_matrix, old_keys = load_embeddings(search_utils_path, model_name, options)
+        # The first row of every key, in case the same text occurs more than once
+        lookup = {}
+        for row, key in enumerate(old_keys.tolist()):
+            lookup.setdefault(key, row)
+        rows = np.array([lookup.get(key, -1) for key in keys.tolist()], dtype=np.int64)
+    except ValueError:
+        old_matrix = None
+        rows = np.full(len(texts), -1, dtype=np.int64)
+
+    missing = np.flatnonzero(rows < 0)
+    logging.info(f"Reusing {len(texts) - len(missing)} stored embeddings, encoding {len(missing)} chunks.")
+    if len(missing):
+        new_vecs = get_model(model_name, options).encode([texts[i] for i in missing.tolist()],
+                                                        show_progress_bar=show_progress, max_length=None)
+        dim = new_vecs.shape[1]
+    else:
+        new_vecs = None
+        dim = old_matrix.shape[1] if old_matrix is not None else get_model(model_name, options).dim
+
+    # Write new files and swap them in, so indexes still mapping the old files keep working
+    out = np.lib.format.open_memmap(matrix_path + '.tmp', mode='w+', dtype=np.float16, shape=(len(texts), dim))
+    reused = np.flatnonzero(rows >= 0)
+    if len(reused):
+        out[reused] = old_matrix[rows[reused]]
+    if new_vecs is not None:
+        out[missing] = new_vecs
+    out.flush()
+    del out
+    with open(keys_path + '.tmp', 'wb') as f:
+        np.save(f, keys)
+    with open(meta_path + '.tmp', 'w', encoding='utf-8') as f:
+        json.dump({'model': model_id(model_name, options), 'num_rows': len(texts)}, f)
+    os.replace(matrix_path + '.tmp', matrix_path)
+    os.replace(keys_path + '.tmp', keys_path)
+    os.replace(meta_path + '.tmp', meta_path)
+
+    return np.load(matrix_path, mmap_mode='r')
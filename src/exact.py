@@ -0,0 +1,141 @@
+import os
+import numpy as np
+
+#### Define constants/defaults for various functions below
+# create_ann_index builds an ExactIndex instead of an NNDescent graph for up to this many chunks.
+# Below it a full matrix product per query is exact and still fast, and it needs no graph build.
+exact_max_chunks = 200000
+
+# Number of embedding rows multiplied with the queries at a time
+exact_block_size = 32768
+
+def _top_k(ids:np.ndarray, sims:np.ndarray, k:int):
+    """
+    Keep the k most similar entries of each row, breaking ties by the lower ID.
+
+    numpy.argpartition picks arbitrarily among entries tied at the cutoff, so each row is partitioned
+    on enough entries to hold every one tied with its k-th best, and only those are sorted.
+
+    Args:
+        ids (numpy.ndarray): (num_queries, n) chunk IDs.
+        sims (numpy.ndarray): (num_queries, n) similarities.
+        k (int): Number of entries to keep per row, at most n.
+
+    Returns:
+        tuple: Tuple of (ids, sims), each (num_queries, k), most similar first, then lowest ID.
+    """
+    if sims.shape[1] > k:
+        kth = -np.partition(-sims, k - 1, axis=1)[:, k - 1:k]
+        num_keep = int((sims >= kth).sum(axis=1).max())
+        if num_keep < sims.shape[1]:
+            keep = np.argpartition(-sims, num_keep - 1, axis=1)[:, :num_keep]
+            ids = np.take_along_axis(ids, keep, axis=1)
+            sims = np.take_along_axis(sims, keep, axis=1)
+    order = np.lexsort((ids, -sims))[:, :k]
+    return np.take_along_axis(ids, order, axis=1), np.take_along_axis(sims, order, axis=1)
+
+class ExactIndex:
+    """
+    Exact cosine nearest neighbor search over a float16 embedding matrix.
+
+    The rows are normalized once when the index is built, so a query is a matrix product with the
+    normalized query vectors, done in blocks of exact_block_size rows to bound the float32 working
+    memory. Each block keeps its best k rows with numpy.argpartition, ties going to the lower chunk ID.
+
+    query has the same signature and return values as pynndescent.NNDescent.query, so query_nn,
+    query_nn_batch and query_hybrid accept either index.
+
+    Args:
+        vectors (numpy.ndarray): (num_chunks, dim) embedding matrix, one row per chunk. Rows must
+            already be normalized; use ExactIndex.build for raw embeddings.
+    """
+
+    def __init__(self, vectors:np.ndarray):
+        self.vectors = vectors
+
+    @classmethod
+    def build(cls, vectors:np.ndarray):
+        """
+        Create an index from raw embeddings.
+
+        Args:
+            vectors (numpy.ndarray): (num_chunks, dim) embedding matrix.
+
+        Returns:
+            ExactIndex: The index, holding the normalized rows as float16.
+        """
+        vectors = np.asarray(vectors, dtype=np.float32)
+        norms = np.linalg.norm(vectors, axis=1, keepdims=True)
+        # Zero rows (e.g. empty chunks) stay zero and are never closer than distance 1
+        norms[norms == 0] = 1
+        return cls((vectors / norms).astype(np.float16))
+
+    def save(self, path:str):
+        """
+        Save the normalized embedding matrix.
+
+        Args:
+            path (str): .npy file to write.
+        """
+        # Write a new file and swap it in, so indexes still mapping the old file keep working
+        with open(path + '.tmp', 'wb') as f:
+            np.save(f, self.vectors)
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path:str, mmap:bool = True):
+        """
+        Load a saved index.
+
+        Args:
+            path (str): .npy file written by ExactIndex.save.
+            mmap (bool, optional): Memory-map the matrix instead of reading it into memory. Defaults to True.
+
+        Returns:
+            ExactIndex: The index.
+        """
+        return cls(np.load(path, mmap_mode='r' if mmap else None))
+
+    @property
+    def num_chunks(self):
+        """Number of indexed chunks."""
+        return self.vectors.shape[0]
+
+    def query(self, query_data, k:int = 10, epsilon:float = None, mask:np.ndarray = None):
+        """
+        Find the k nearest chunks of each query vector by cosine distance.
+
+        Args:
+            query_data (numpy.ndarray): (num_queries, dim) query vectors.
+            k (int, optional): Number of neighbors to return per query. At most the number of chunks.
+                Defaults to 10.
+            epsilon (float, optional): Ignored; the search is always exact. Accepted so callers can
+                treat this index like pynndescent.NNDescent.
+            mask (numpy.ndarray, optional): Boolean mask over rows; only rows where it is True are
+                returned, and k is at most their number. Defaults to None, which searches every row.
+
+        Returns:
+            tuple: Tuple of (ids, distances), each (num_queries, k), nearest first. Equally distant
+                chunks are listed by chunk ID.
+        """
+        queries = np.asarray(query_data, dtype=np.float32).reshape(-1, self.vectors.shape[1])
+        norms = np.linalg.norm(queries, axis=1, keepdims=True)
+        norms[norms == 0] = 1
+        queries = queries / norms
+        k = min(k, self.num_chunks if mask is None else int(mask.sum()))
+        if k == 0:
+            return np.empty((queries.shape[0], 0), dtype=np.int64), np.empty((queries.shape[0], 0), dtype=np.float32)
+
+        best_ids = np.empty((queries.shape[0], 0), dtype=np.int64)
+        best_sims = np.empty((queries.shape[0], 0), dtype=np.float32)
+        for start in range(0, self.num_chunks, exact_block_size):
+            block = np.asarray(self.vectors[start:start + exact_block_size], dtype=np.float32)
+            sims = queries @ block.T
+            if mask is not None:
+                # Masked rows can never be among the k best
+                sims[:, ~mask[start:start + exact_block_size]] = -np.inf
+            ids = np.broadcast_to(np.arange(start, start + sims.shape[1]), sims.shape)
+            ids, sims = _top_k(ids, sims, min(k, sims.shape[1]))
+            best_ids, best_sims = _top_k(np.concatenate([best_ids, ids], axis=1),
+                                         np.concatenate([best_sims, sims], axis=1), k)
+        return best_ids, 1 - best_sims
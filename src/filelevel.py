@@ -0,0 +1,93 @@
+import threading
+import numpy as np
+from chunktable import ChunkTable
+
+#### Define constants/defaults for various functions below
+# query_files first asks the chunk search for this many chunks per requested file, and asks for
+# file_candidate_growth times as many each time the candidates come from too few files
+file_candidate_factor = 10
+file_candidate_growth = 4
+
+# Ways of combining the scores of a file's chunks into the file's score
+file_aggregations = ('max', 'sum', 'mean')
+
+# Chunk-to-file codes of the last chunk database seen, as (file_id list, codes, file IDs by code)
+_codes_cache = None
+_codes_lock = threading.Lock()
+
+def chunk_file_codes(chunks:dict):
+    """
+    Map every chunk to a compact integer code of its file.
+
+    The codes are computed once per chunk database and reused while the same chunks dictionary is passed.
+    A chunktable.ChunkTable already stores them, as its file indexes.
+
+    Args:
+        chunks (dict or chunktable.ChunkTable): Chunk database dictionary with a 'file_id' list.
+
+    Returns:
+        tuple: Tuple of (int32 array with the file code of every chunk, list of file IDs indexed by code).
+    """
+    global _codes_cache
+    if isinstance(chunks, ChunkTable):
+        return chunks.file_index, chunks.file_ids
+    file_id_list = chunks['file_id']
+    with _codes_lock:
+        if _codes_cache is not None and _codes_cache[0] is file_id_list and len(_codes_cache[1]) == len(file_id_list):
+            return _codes_cache[1], _codes_cache[2]
+
+        codes_by_id = {}
+        codes = np.fromiter((codes_by_id.setdefault(f_id, len(codes_by_id)) for f_id in file_id_list),
+                            dtype=np.int32, count=len(file_id_list))
+        file_ids = list(codes_by_id)
+        _codes_cache = (file_id_list, codes, file_ids)
+        return codes, file_ids
+
+def aggregate_by_file(ids, scores, codes:np.ndarray, num_files:int, aggregation:str = 'max', top_m:int = 3):
+    """
+    Combine chunk scores into file scores and pick the best files.
+
+    Args:
+        ids (array-like): Chunk IDs of the candidate chunks.
+        scores (array-like): Scores of the candidate chunks, higher is better.
+        codes (numpy.ndarray): File code of every chunk, as returned by chunk_file_codes.
+        num_files (int): Number of files to return.
+        aggregation (str, optional): 'max' for the best chunk score of each file, 'sum' for the sum of its
+            chunk scores, or 'mean' for the mean of its top_m chunk scores, counting missing chunks as 0.
+            Defaults to 'max'.
+        top_m (int, optional): Number of chunks per file averaged by 'mean'. Defaults to 3.
+
+    Returns:
+        tuple: Tuple of (file codes, file scores, best chunk ID of each file), best file first. Equal
+            file scores are ordered by best chunk ID.
+
+    Raises:
+        ValueError: If aggregation is not 'max', 'sum' or 'mean'.
+    """
+    if aggregation not in file_aggregations:
+        raise ValueError(f"Unknown aggregation: {aggregation}. Use 'max', 'sum' or 'mean'.")
+    ids = np.asarray(ids, dtype=np.int64)
+    scores = np.asarray(scores, dtype=np.float64)
+    files = codes[ids]
+    num_codes = int(files.max()) + 1 if len(files) else 0
+
+    # Candidates grouped by file, best first; the first of each group is the file's snippet
+    order = np.lexsort((ids, -scores, files))
+    files, ids, scores = files[order], ids[order], scores[order]
+    first = np.flatnonzero(np.concatenate(([True], files[1:] != files[:-1]))) if len(files) else np.empty(0, dtype=np.int64)
+    present = files[first]
+    best_chunk = ids[first]
+
+    if aggregation == 'max':
+        file_scores = np.full(num_codes, -np.inf)
+        np.maximum.at(file_scores, files, scores)
+    elif aggregation == 'sum':
+        file_scores = np.bincount(files, weights=scores, minlength=num_codes)
+    else:
+        rank = np.arange(len(files)) - np.repeat(first, np.diff(np.append(first, len(files))))
+        top = rank < top_m
+        file_scores = np.bincount(files[top], weights=scores[top], minlength=num_codes) / top_m
+    file_scores = file_scores[present]
+
+    best = np.lexsort((best_chunk, -file_scores))[:num_files]
+    return present[best], file_scores[best], best_chunk[best]
@@ -0,0 +1,156 @@
+import os
+import re
+import numpy as np
+
+#### Define constants/defaults for various functions below
+# Weight of a token that occurs only in a file's folders or extension, relative to one in its name
+filename_path_weight = 0.5
+
+# Share of a full token match's score earned by a token that only starts with the query token
+filename_prefix_weight = 0.5
+
+# Share of the blended score that comes from the filename match in query_with_filename_boost
+filename_boost = 0.3
+
+_token_pattern = re.compile(r'[^\W_]+')
+
+def _tokenize(text:str):
+    """Lowercased runs of letters and digits in a string."""
+    return _token_pattern.findall(text.lower())
+
+class FilenameIndex:
+    """
+    Prefix index from the tokens of every file's name and path to the files containing them.
+
+    Each file is indexed under the tokens of its preprocessed filename and, at filename_path_weight,
+    the tokens of its folders and extension. Postings are stored in compressed sparse row form: vocab
+    holds the sorted tokens, and the files of vocab[i] are postings[indptr[i]:indptr[i+1]], with the
+    field weight of each in weights. Because the vocabulary is sorted, the tokens starting with a
+    prefix are one range of it, and their postings one slice of postings, found with two binary
+    searches. The arrays are saved as .npy files and memory-mapped on load.
+
+    Args:
+        vocab (numpy.ndarray): Sorted tokens.
+        indptr (numpy.ndarray): Offsets into postings, one more than the number of tokens.
+        postings (numpy.ndarray): File positions (int32), indexing file_ids.
+        weights (numpy.ndarray): Field weight (float32) of every posting.
+        file_ids (numpy.ndarray): File ID of every file position.
+    """
+
+    def __init__(self, vocab, indptr, postings, weights, file_ids):
+        self.vocab = vocab
+        self.indptr = indptr
+        self.postings = postings
+        self.weights = weights
+        self.file_ids = file_ids
+
+        # Inverse document frequency of every token, as in bm25s' Lucene variant
+        df = np.diff(np.asarray(indptr))
+        self.idf = np.log(1 + (self.num_files - df + 0.5) / (df + 0.5)).astype(np.float32)
+
+    @property
+    def num_files(self):
+        """Number of indexed files."""
+        return len(self.file_ids)
+
+    @classmethod
+    def build(cls, file_list:dict):
+        """
+        Build the index from a file list.
+
+        Args:
+            file_list (dict): File list from utils.file_scanner, with 'filepath', 'filename' and 'file_id' lists.
+
+        Returns:
+            FilenameIndex: The index.
+        """
+        tokens, files, weights = [], [], []
+        for position, (path, filename) in enumerate(zip(file_list['filepath'], file_list['filename'])):
+            folders, ext = os.path.dirname(path), os.path.splitext(path)[1]
+            fields = {token: filename_path_weight for token in _tokenize(folders + ' ' + ext)}
+            fields.update({token: 1.0 for token in _tokenize(filename)})
+            tokens.extend(fields)
+            files.extend([position] * len(fields))
+            weights.extend(fields.values())
+
+        vocab, term_ids = np.unique(np.array(tokens, dtype=str), return_inverse=True)
+        files = np.array(files, dtype=np.int32)
+        order = np.lexsort((files, term_ids))
+        indptr = np.zeros(len(vocab) + 1, dtype=np.int64)
+        indptr[1:] = np.cumsum(np.bincount(term_ids, minlength=len(vocab)))
+        return cls(vocab, indptr, files[order], np.array(weights, dtype=np.float32)[order],
+                   np.array(file_list['file_id'], dtype=str))
+
+    def save(self, path:str):
+        """
+        Save the index to a directory.
+
+        Args:
+            path (str): Directory to save to. Created if it doesn't exist.
+        """
+        os.makedirs(path, exist_ok=True)
+        for name in ('vocab', 'indptr', 'postings', 'weights', 'file_ids'):
+            np.save(os.path.join(path, f'{name}.npy'), getattr(self, name))
+
+    @classmethod
+    def load(cls, path:str, mmap:bool = True):
+        """
+        Load an index saved with save.
+
+        Args:
+            path (str): Directory the index was saved to.
+            mmap (bool, optional): Memory-map the arrays instead of reading them into memory. Defaults to True.
+
+        Returns:
+            FilenameIndex: The index.
+        """
+        mmap_mode = 'r' if mmap else None
+        return cls(*(np.load(os.path.join(path, f'{name}.npy'), mmap_mode=mmap_mode)
+                     for name in ('vocab', 'indptr', 'postings', 'weights', 'file_ids')))
+
+    def search(self, query:str, num_results:int = None):
+        """
+        Score the files whose name or path contains the query's tokens.
+
+        Every query token scores a file by the best indexed token it matches: idf times the field weight
+        for the token itself, and filename_prefix_weight of that for a longer token starting with it, so
+        partly typed names still match. The token scores of a file are summed.
+
+        Args:
+            query (str): Search query; split into lowercased runs of letters and digits.
+            num_results (int, optional): Maximum number of files to return. Defaults to None, which
+                returns every matching file.
+
+        Returns:
+            tuple: Tuple of (file positions, scores), best first. Equal scores are ordered by file position.
+        """
+        file_parts, score_parts, token_parts = [], [], []
+        for q, token in enumerate(dict.fromkeys(_tokenize(query))):
+            lo = int(np.searchsorted(self.vocab, token, side='left'))
+            hi = int(np.searchsorted(self.vocab, token + '\U0010ffff', side='left'))
+            if lo == hi:
+                continue
+            start, end = int(self.indptr[lo]), int(self.indptr[hi])
+            terms = np.repeat(np.arange(lo, hi), np.diff(self.indptr[lo:hi + 1]))
+            scores = self.idf[terms] * self.weights[start:end]
+            if self.vocab[lo] == token:
+                scores[terms != lo] *= filename_prefix_weight
+            else:
+                scores *= filename_prefix_weight
+            file_parts.append(np.asarray(self.postings[start:end]))
+            score_parts.append(scores)
+            token_parts.append(np.full(end - start, q))
+        if not file_parts:
+            return np.empty(0, dtype=np.int32), np.empty(0, dtype=np.float32)
+
+        # Best match of each query token in each file, then summed over the tokens
+        files, scores, query_tokens = np.concatenate(file_parts), np.concatenate(score_parts), np.concatenate(token_parts)
+        order = np.lexsort((-scores, query_tokens, files))
+        files, scores, query_tokens = files[order], scores[order], query_tokens[order]
+        best = np.concatenate(([True], (files[1:] != files[:-1]) | (query_tokens[1:] != query_tokens[:-1])))
+        files, scores = files[best], scores[best]
+        first = np.flatnonzero(np.concatenate(([True], files[1:] != files[:-1])))
+        files, scores = files[first], np.add.reduceat(scores, first)
+
+        order = np.lexsort((files, -scores))[:num_results]
+        return files[order], scores[order]
@@ -0,0 +1,167 @@
+import os
+import hashlib
+import threading
+import numpy as np
+from filelevel import chunk_file_codes
+
+#### Define constants/defaults for various functions below
+# Keys of a filter dictionary, and the names they take in a filter expression
+filter_keys = {
+    'path': 'path_prefix',
+    'ext': 'extensions',
+    'after': 'modified_after',
+    'before': 'modified_before',
+    'min_size': 'min_size',
+    'max_size': 'max_size',
+}
+
+# Per-file columns of the last file dictionary seen, as (file_dict, file IDs, columns)
+_columns_cache = None
+_columns_lock = threading.Lock()
+
+def parse_filter(expression:str):
+    """
+    Parse a filter expression into a filter dictionary.
+
+    An expression is a space-separated list of key:value terms:
+        - path:<prefix> keeps files whose path starts with prefix; end it with a separator to only
+          keep files in that folder (use a filter dictionary for paths with spaces)
+        - ext:<ext>[,<ext>...] keeps files with one of the extensions, with or without the dot
+        - after:<date> and before:<date> keep files last modified at or after / before a date,
+          given as YYYY-MM-DD, or YYYY-MM-DD_HH:MM:SS to include a time
+        - min_size:<MB> and max_size:<MB> keep files of at least / at most a size in megabytes, which
+          may be fractional (e.g. min_size:0.5)
+
+    Example: "path:/home/me/reports ext:pdf,docx after:2024-01-01 max_size:10"
+
+    Args:
+        expression (str): The filter expression.
+
+    Returns:
+        dict: Filter dictionary with 'path_prefix', 'extensions', 'modified_after', 'modified_before',
+            'min_size' and/or 'max_size' keys, for filter_mask.
+
+    Raises:
+        ValueError: If a term is not key:value or its key or value is invalid.
+    """
+    filters = {}
+    for term in expression.split():
+        key, sep, value = term.partition(':')
+        if not sep or key not in filter_keys or not value:
+            raise ValueError(f"Invalid filter term: {term}. Use {', '.join(k + ':...' for k in filter_keys)}.")
+        if key == 'ext':
+            filters['extensions'] = value.split(',')
+        elif key in ('after', 'before'):
+            filters[filter_keys[key]] = value.replace('_', ' ')
+        elif key in ('min_size', 'max_size'):
+            try:
+                filters[key] = float(value)
+            except ValueError:
+                raise ValueError(f"Invalid file size in filter term: {term}.")
+        else:
+            filters[filter_keys[key]] = value
+    return filters
+
+def _file_columns(file_dict:dict):
+    """
+    Per-file columns used by filters, computed once per file dictionary.
+
+    Returns:
+        tuple: Tuple of (file IDs, dict of 'path', 'ext', 'modified' and 'size' arrays, in file ID order).
+            Sizes are in megabytes, from the exact 'file_bytes' where the file dictionary has it.
+    """
+    global _columns_cache
+    with _columns_lock:
+        if _columns_cache is not None and _columns_cache[0] is file_dict and len(_columns_cache[1]) == len(file_dict):
+            return _columns_cache[1], _columns_cache[2]
+
+        file_ids = list(file_dict)
+        props = [file_dict[f_id] for f_id in file_ids]
+        paths = [os.path.normcase(os.path.normpath(p['filepath'])) for p in props]
+        columns = {
+            'path': np.array(paths, dtype=str),
+            'ext': np.array([os.path.splitext(p)[1] for p in paths], dtype=str),
+            'modified': np.array([p['last_modified'].replace(' ', 'T') for p in props], dtype='datetime64[s]'),
+            # 'file_size' is whole megabytes, rounded down; file dictionaries of earlier versions only have that
+            'size': np.array([p['file_bytes'] / 1024**2 if p.get('file_bytes') is not None else p['file_size']
+                              for p in props], dtype=np.float64),
+        }
+        _columns_cache = (file_dict, file_ids, columns)
+        return file_ids, columns
+
+def filter_mask(chunks:dict, file_dict:dict, filters):
+    """
+    Compile a filter into a boolean mask over chunk IDs.
+
+    The filter is evaluated once per file over NumPy columns built from file_dict, and the file mask is
+    broadcast to chunks through the chunk-to-file codes (see filelevel.chunk_file_codes).
+
+    Args:
+        chunks (dict): Chunk database dictionary with a 'file_id' list.
+        file_dict (dict): File dictionary keyed by file_id, with 'filepath', 'last_modified', 'file_size' and,
+            from file_scanner, the exact size in bytes, 'file_bytes'. Without 'file_bytes', sizes are compared
+            in whole megabytes, rounded down.
+        filters (dict or str): Filter dictionary, or a filter expression for parse_filter. Missing keys
+            don't filter. Keys:
+            - 'path_prefix' (str): Keep files whose path starts with this prefix. With a trailing
+              separator, only files in that folder are kept.
+            - 'extensions' (list): Keep files with one of these extensions, with or without the dot.
+            - 'modified_after' (str): Keep files last modified at or after this date.
+            - 'modified_before' (str): Keep files last modified before this date.
+            - 'min_size' (float): Keep files of at least this many megabytes.
+            - 'max_size' (float): Keep files of at most this many megabytes.
+
+    Returns:
+        numpy.ndarray: Boolean mask with one entry per chunk, True for chunks that pass the filter.
+
+    Raises:
+        ValueError: If the filter has an unknown key or an invalid value.
+    """
+    if isinstance(filters, str):
+        filters = parse_filter(filters)
+    unknown = set(filters) - set(filter_keys.values())
+    if unknown:
+        raise ValueError(f"Unknown filter keys: {', '.join(sorted(unknown))}.")
+
+    file_ids, columns = _file_columns(file_dict)
+    keep = np.ones(len(file_ids), dtype=bool)
+    if filters.get('path_prefix'):
+        prefix = os.path.normcase(os.path.normpath(filters['path_prefix']))
+        if filters['path_prefix'].endswith(('/', os.sep)):
+            # A trailing separator limits the prefix to that folder; normpath drops it
+            prefix = os.path.join(prefix, '')
+        keep &= np.char.startswith(columns['path'], prefix)
+    if filters.get('extensions'):
+        extensions = [os.path.normcase(e if e.startswith('.') else '.' + e) for e in filters['extensions']]
+        keep &= np.isin(columns['ext'], extensions)
+    try:
+        if filters.get('modified_after'):
+            keep &= columns['modified'] >= np.datetime64(filters['modified_after'].replace(' ', 'T'), 's')
+        if filters.get('modified_before'):
+            keep &= columns['modified'] < np.datetime64(filters['modified_before'].replace(' ', 'T'), 's')
+    except ValueError:
+        raise ValueError(f"Invalid date in filter: {filters}. Use YYYY-MM-DD or YYYY-MM-DD HH:MM:SS.")
+    if filters.get('min_size') is not None:
+        keep &= columns['size'] >= filters['min_size']
+    if filters.get('max_size') is not None:
+        keep &= columns['size'] <= filters['max_size']
+
+    # Broadcast the file mask to chunks; chunks of files missing from file_dict never pass
+    codes, chunk_file_ids = chunk_file_codes(chunks)
+    position = {f_id: i for i, f_id in enumerate(file_ids)}
+    code_keep = np.array([keep[position[f_id]] if f_id in position else False for f_id in chunk_file_ids], dtype=bool)
+    return code_keep[codes]
+
+def mask_key(mask:np.ndarray):
+    """
+    Short digest of a chunk mask, for use in result cache keys.
+
+    Args:
+        mask (numpy.ndarray): Boolean mask over chunk IDs, or None.
+
+    Returns:
+        str: Hex digest of the mask, or None if mask is None.
+    """
+    if mask is None:
+        return None
+    return hashlib.blake2b(np.packbits(mask).tobytes() + str(len(mask)).encode(), digest_size=16).hexdigest()
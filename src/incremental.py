@@ -0,0 +1,283 @@
+import os
+import json
+import pickle
+import logging
+import numpy as np
+from exact import ExactIndex
+
+#### Define constants/defaults for various functions below
+# update_ann_index rebuilds the whole index once more than this fraction of its rows are tombstones,
+# i.e. rows of chunks that were deleted or changed since the last full build
+ann_max_tombstone_fraction = 0.2
+
+# update_ann_index also rebuilds once more than this fraction of the rows were added since the last
+# full build, since those are searched exhaustively
+ann_max_delta_fraction = 0.2
+
+# File next to the index holding the row map, tombstones and added rows
+ann_rows_filename = 'ann_rows.npz'
+
+def _load_base(path:str):
+    """Load an exact index (.npy) or a pickled NNDescent index."""
+    if path.endswith('.npy'):
+        return ExactIndex.load(path, mmap=True)
+    with open(path, 'rb') as f:
+        return pickle.load(f)
+
+def _num_rows(index):
+    """Number of rows of an exact or NNDescent index."""
+    return index.num_chunks if isinstance(index, ExactIndex) else index._raw_data.shape[0]
+
+class IncrementalIndex:
+    """
+    Nearest neighbor index over the chunk database that can follow chunk changes without a rebuild.
+
+    The base index (an ExactIndex or a pynndescent.NNDescent graph) holds the rows of the last full
+    build. Rows for chunks added since then are kept in a small exact delta index that is searched
+    alongside the base. Rows whose chunk was deleted or changed are marked in a tombstone bitmask and
+    dropped from query results. row_chunk maps every row (base rows first, then delta rows) to the
+    current ID of its chunk, and row_keys holds the content key of every row, which update matches
+    against the keys of the new chunks.
+
+    query has the same signature and return values as pynndescent.NNDescent.query, with chunk IDs in
+    place of row numbers, so query_nn, query_nn_batch and query_hybrid accept this index as well.
+
+    Args:
+        base (exact.ExactIndex or pynndescent.NNDescent): Index of the last full build.
+        row_chunk (numpy.ndarray, optional): Chunk ID of every row. Defaults to the row numbers of the base.
+        tombstones (numpy.ndarray, optional): Boolean mask of deleted rows. Defaults to no deleted rows.
+        row_keys (numpy.ndarray, optional): Content key of every row (see embeddings.chunk_keys). None if
+            unknown, in which case the index cannot be updated. Defaults to None.
+        delta (exact.ExactIndex, optional): Rows added since the last full build. Defaults to None.
+        model (dict, optional): embeddings.model_id of the model the rows were encoded with. Defaults to None.
+    """
+
+    def __init__(self, base, row_chunk:np.ndarray = None, tombstones:np.ndarray = None,
+                 row_keys:np.ndarray = None, delta:ExactIndex = None, model:dict = None):
+        self.base = base
+        self.num_base = _num_rows(base)
+        self.delta = delta
+        num_rows = self.num_base + (delta.num_chunks if delta is not None else 0)
+        self.row_chunk = np.arange(num_rows, dtype=np.int64) if row_chunk is None else row_chunk
+        self.tombstones = np.zeros(num_rows, dtype=bool) if tombstones is None else tombstones
+        self.row_keys = row_keys
+        self.model = model
+
+    @property
+    def backend(self):
+        """'exact' or 'nndescent', the kind of the base index."""
+        return 'exact' if isinstance(self.base, ExactIndex) else 'nndescent'
+
+    @property
+    def num_rows(self):
+        """Number of rows, including tombstones."""
+        return len(self.row_chunk)
+
+    @property
+    def num_chunks(self):
+        """Number of live rows, i.e. of indexed chunks."""
+        return self.num_rows - int(self.tombstones.sum())
+
+    @property
+    def tombstone_fraction(self):
+        """Fraction of the rows that are tombstones."""
+        return float(self.tombstones.mean()) if self.num_rows else 0.0
+
+    @property
+    def delta_fraction(self):
+        """Fraction of the rows that were added since the last full build."""
+        return (self.num_rows - self.num_base) / self.num_rows if self.num_rows else 0.0
+
+    def keys_by_chunk(self):
+        """
+        Content key of every chunk, read from the live rows.
+
+        Returns:
+            numpy.ndarray: One key per chunk, in chunk ID order, or None if the row keys are unknown.
+        """
+        if self.row_keys is None:
+            return None
+        live = ~self.tombstones
+        keys = np.empty(self.num_chunks, dtype=self.row_keys.dtype)
+        keys[self.row_chunk[live]] = self.row_keys[live]
+        return keys
+
+    def save_rows(self, search_utils_path:str):
+        """
+        Save the row map, tombstones, row keys and added rows. The base index is saved when it is built.
+
+        Args:
+            search_utils_path (str): Directory of the base index.
+        """
+        path = os.path.join(search_utils_path, ann_rows_filename)
+        delta = self.delta.vectors if self.delta is not None else np.empty((0, 0), dtype=np.float16)
+        # Write a new file and swap it in, so indexes still reading the old file keep working
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, num_base=self.num_base, row_chunk=self.row_chunk, tombstones=self.tombstones,
+                     row_keys=self.row_keys if self.row_keys is not None else np.empty(0, dtype='S1'),
+                     delta=delta, model=json.dumps(self.model))
+        os.replace(path + '.tmp', path)
+
+    @classmethod
+    def load(cls, path:str):
+        """
+        Load a saved index.
+
+        Args:
+            path (str): Base index file, a .npy file for an exact index, otherwise a pickled NNDescent index.
+                The rows file is read from the same directory. If there is none, e.g. for an index built by
+                an older version, every row maps to the chunk with the same ID and updates need a rebuild.
+
+        Returns:
+            IncrementalIndex: The index.
+
+        Raises:
+            ValueError: If the rows file does not belong to the base index.
+        """
+        base = _load_base(path)
+        rows_path = os.path.join(os.path.dirname(path), ann_rows_filename)
+        if not os.path.exists(rows_path):
+            return cls(base)
+
+        with np.load(rows_path) as rows:
+            if int(rows['num_base']) != _num_rows(base):
+                raise ValueError(f"{rows_path} belongs to an index of {int(rows['num_base'])} rows, not {_num_rows(base)}.")
+            row_keys = rows['row_keys'] if len(rows['row_keys']) else None
+            delta = ExactIndex(rows['delta']) if rows['delta'].shape[0] else None
+            return cls(base, rows['row_chunk'], rows['tombstones'], row_keys, delta, json.loads(str(rows['model'])))
+
+    def update(self, keys:np.ndarray, vectors:np.ndarray):
+        """
+        Return an index over a new set of chunks, reusing the rows of chunks whose text is unchanged.
+
+        Every new chunk takes a live row with the same content key, whatever its new chunk ID. Rows left
+        over become tombstones, and chunks without a row are added to the delta.
+
+        Args:
+            keys (numpy.ndarray): Content key of every new chunk, in chunk ID order.
+            vectors (numpy.ndarray): Embeddings of the new chunks, in chunk ID order. Only the rows of
+                chunks that need a new row are read.
+
+        Returns:
+            IncrementalIndex: The updated index. This index is left unchanged.
+
+        Raises:
+            ValueError: If the row keys of this index are unknown.
+        """
+        if self.row_keys is None:
+            raise ValueError("The index has no row keys, so it can only be rebuilt.")
+
+        # Live rows by content key; the same text can occur in several chunks
+        free = {}
+        row_keys = self.row_keys.tolist()
+        for row in np.flatnonzero(~self.tombstones).tolist():
+            free.setdefault(row_keys[row], []).append(row)
+
+        row_chunk = np.full(self.num_rows, -1, dtype=np.int64)
+        missing = []
+        for chunk, key in enumerate(keys.tolist()):
+            rows = free.get(key)
+            if rows:
+                row_chunk[rows.pop()] = chunk
+            else:
+                missing.append(chunk)
+        tombstones = row_chunk < 0
+
+        delta, new_keys = self.delta, self.row_keys
+        if missing:
+            added = ExactIndex.build(vectors[missing]).vectors
+            delta = ExactIndex(np.concatenate([delta.vectors, added]) if delta is not None else added)
+            row_chunk = np.concatenate([row_chunk, missing])
+            tombstones = np.concatenate([tombstones, np.zeros(len(missing), dtype=bool)])
+            new_keys = np.concatenate([new_keys, keys[missing]])
+
+        logging.info(f"ANN index update: {len(missing)} rows added, {int(tombstones.sum())} tombstones.")
+        return IncrementalIndex(self.base, row_chunk, tombstones, new_keys, delta, self.model)
+
+    def _live_top(self, index, offset:int, queries:np.ndarray, k:int, epsilon:float, dead:np.ndarray):
+        """
+        Find the k nearest live rows of the base or the delta.
+
+        An exact index scores only the live rows. An NNDescent index is asked for enough neighbors to make
+        up for the expected share of dead rows, and asked again for twice as many while some query has
+        fewer than k live ones.
+
+        Returns:
+            list: One (chunk IDs, distances) tuple per query, nearest first.
+        """
+        num_rows = _num_rows(index)
+        dead = dead[offset:offset + num_rows]
+        k = min(k, num_rows - int(dead.sum()))
+        if k == 0:
+            return [(np.empty(0, dtype=np.int64), np.empty(0, dtype=np.float32))] * len(queries)
+
+        if isinstance(index, ExactIndex):
+            ids, distances = index.query(queries, k=k, mask=~dead)
+            return [(self.row_chunk[offset + ids[i]], distances[i]) for i in range(len(queries))]
+
+        k_query = min(num_rows, int(k / (1 - dead.mean())) + 1)
+        while True:
+            ids, distances = index.query(queries, k=k_query, epsilon=epsilon)
+            live = ids >= 0
+            live[live] = ~dead[ids[live]]
+            if k_query == num_rows or live.sum(axis=1).min() >= k:
+                break
+            k_query = min(num_rows, 2 * k_query)
+
+        return [(self.row_chunk[offset + ids[i][live[i]][:k]], distances[i][live[i]][:k]) for i in range(len(queries))]
+
+    def query(self, query_data, k:int = 10, epsilon:float = 0.1, mask:np.ndarray = None):
+        """
+        Find the k nearest chunks of each query vector by cosine distance, skipping tombstones.
+
+        Args:
+            query_data (numpy.ndarray): (num_queries, dim) query vectors.
+            k (int, optional): Number of neighbors to return per query. At most the number of chunks.
+                Defaults to 10.
+            epsilon (float, optional): Search accuracy parameter of the NNDescent base. Defaults to 0.1.
+            mask (numpy.ndarray, optional): Boolean mask over chunk IDs; only chunks where it is True are
+                returned. Defaults to None, which searches every chunk.
+
+        Returns:
+            tuple: Tuple of (chunk IDs, distances), each (num_queries, k), nearest first.
+        """
+        queries = np.atleast_2d(np.asarray(query_data))
+        dead = self.tombstones
+        if mask is not None:
+            # Rows of chunks outside the mask are skipped like tombstones
+            dead = dead | ~mask[np.where(self.tombstones, 0, self.row_chunk)]
+        parts = [self._live_top(self.base, 0, queries, k, epsilon, dead)]
+        if self.delta is not None:
+            parts.append(self._live_top(self.delta, self.num_base, queries, k, epsilon, dead))
+
+        ids, distances = [], []
+        for i in range(len(queries)):
+            row_ids = np.concatenate([part[i][0] for part in parts])
+            row_distances = np.concatenate([part[i][1] for part in parts])
+            # Nearest first, then lowest chunk ID
+            order = np.lexsort((row_ids, row_distances))[:k]
+            ids.append(row_ids[order])
+            distances.append(row_distances[order])
+
+        # An approximate base can come up short for some query; keep the results every query has
+        k = min(len(row) for row in ids)
+        return np.array([row[:k] for row in ids]), np.array([row[:k] for row in distances])
+
+def load_ann_index(search_utils_path:str = './search_utils'):
+    """
+    Load the ANN index from its default location.
+
+    Args:
+        search_utils_path (str, optional): Path to the search_utils directory. Defaults to './search_utils'.
+
+    Returns:
+        IncrementalIndex: The index, loaded from exact_index.npy or, if there is none, nn_database.pkl.
+
+    Raises:
+        ValueError: If there is no ANN index.
+    """
+    for filename in ('exact_index.npy', 'nn_database.pkl'):
+        path = os.path.join(search_utils_path, filename)
+        if os.path.exists(path):
+            return IncrementalIndex.load(path)
+    raise ValueError(f"No ANN index found in {search_utils_path}.")
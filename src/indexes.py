@@ -1,7 +1,17 @@
 import json, bm25s, Stemmer
 import logging
 from tqdm import tqdm
-from model2vec import StaticModel
+from models import default_model_name
+from trigram import TrigramIndex
+from arena import CorpusArena
+from filenames import FilenameIndex
+from exact import ExactIndex, exact_max_chunks
+from embeddings import embed_chunks, chunk_keys, model_id
+from segments import SegmentedBM25
+from chunkstore import load_chunk_db
+from incremental import IncrementalIndex, load_ann_index, ann_max_tombstone_fraction, ann_max_delta_fraction
+import os
+import shutil
 import pickle, json
 import numpy as np
 import pynndescent as nn
@@ -20,8 +30,8 @@ def create_bm25_index(
     Either a chunk database path or pre-loaded chunks must be provided.
 
     Args:
-        chunk_db_path (str, optional): Path to the JSON file containing the processed chunk database.
-            If None and chunks is None, attempts to load from default location './search_utils/chunked_db.json'.
+        chunk_db_path (str, optional): Path to the chunk store (or JSON file) containing the processed chunk database.
+            If None and chunks is None, attempts to load from default location './search_utils/chunk_store.bin'.
         chunks (dict, optional): Pre-loaded chunk database dictionary containing 'processed_chunk' key.
             If provided, chunk_db_path is ignored.
 
@@ -37,11 +47,11 @@ def create_bm25_index(
         if chunk_db_path is None:
             # Search for a default location index
             try:
-                chunks = json.load(open("./search_utils/chunked_db.json", 'rb'))
+                chunks = load_chunk_db()
             except Exception as e: 
                 raise ValueError("Either chunk_db_path or chunks must be provided.")
-
-        chunks = json.load(open(chunk_db_path, 'rb'))
+        else:
+            chunks = load_chunk_db(chunk_db_path)
     
     stemmer = Stemmer.Stemmer("english")
 
@@ -66,69 +76,358 @@ def create_bm25_index(
     logger.info("Saving the BM25 index...")
     retriever.save("./search_utils/index_bm25")
 
+    # A segmented index was built from older chunks, so it must not be loaded later
+    if os.path.exists("./search_utils/index_bm25_segments"):
+        shutil.rmtree("./search_utils/index_bm25_segments")
+
     return(retriever)
 
+def update_bm25_index(
+        chunk_db_path:str = None,
+        chunks = None,
+        background_merge:bool = True):
+    """
+    Bring the segmented BM25 index in line with a changed chunk database without rebuilding it.
+
+    Only chunks added or changed since the last update are tokenized, into a new segment; rows of deleted
+    or changed chunks are marked as tombstones (see segments.SegmentedBM25). If there is no segmented index
+    yet, one is created with every chunk in a single segment. The merge policy then compacts small segments,
+    in a background thread unless background_merge is False. Queries score all segments with corpus-wide
+    statistics, so results are the same as with an index built by create_bm25_index.
+
+    Args:
+        chunk_db_path (str, optional): Path to the chunk store (or JSON file) containing the processed chunk database.
+            If None and chunks is None, attempts to load from default location './search_utils/chunk_store.bin'.
+        chunks (dict, optional): Pre-loaded chunk database dictionary containing 'processed_chunk' key.
+            If provided, chunk_db_path is ignored.
+        background_merge (bool, optional): Merge segments in a background thread instead of before
+            returning. Defaults to True.
+
+    Returns:
+        segments.SegmentedBM25: The updated index, ready for query operations.
+
+    Raises:
+        ValueError: If neither chunk_db_path nor chunks are provided and default location is not found.
+    """
+
+    # If given a chunks db, don't load anything
+    if chunks is None:
+        try:
+            chunks = load_chunk_db(chunk_db_path)
+        except Exception as e:
+            raise ValueError("Either chunk_db_path or chunks must be provided.")
+
+    index_path = "./search_utils/index_bm25_segments"
+    try:
+        retriever = SegmentedBM25.load(index_path)
+        logger.info("Updating the segmented BM25 index...")
+        retriever.update(chunks['processed_chunk'])
+    except (OSError, ValueError, KeyError) as e:
+        logger.info("Creating the segmented BM25 index...")
+        retriever = SegmentedBM25.create(index_path, chunks['processed_chunk'])
+
+    # A single-segment index was built from older chunks, so it must not be loaded later
+    if os.path.exists("./search_utils/index_bm25"):
+        shutil.rmtree("./search_utils/index_bm25")
+
+    retriever.merge(background=background_merge)
+
+    return retriever
+
+def create_trigram_index(
+        chunk_db_path:str = None,
+        chunks = None):
+    """
+    Create a trigram posting index used by query_direct to skip chunks that can't match.
+
+    Every trigram (3 consecutive characters) of each lowercased chunk is mapped to the IDs of the
+    chunks containing it. A literal or regex query then only needs to search the chunks that contain
+    all trigrams the query requires. The index is saved to disk for later use.
+
+    Args:
+        chunk_db_path (str, optional): Path to the chunk store (or JSON file) containing the processed chunk database.
+            If None and chunks is None, attempts to load from default location './search_utils/chunk_store.bin'.
+        chunks (dict, optional): Pre-loaded chunk database dictionary containing 'processed_chunk' key.
+            If provided, chunk_db_path is ignored.
+
+    Returns:
+        trigram.TrigramIndex: The trigram index, ready to pass to query_direct.
+
+    Raises:
+        ValueError: If neither chunk_db_path nor chunks are provided and default location is not found.
+    """
+
+    # If given a chunks db, don't load anything
+    if chunks is None:
+        if chunk_db_path is None:
+            # Search for a default location index
+            try:
+                chunks = load_chunk_db()
+            except Exception as e: 
+                raise ValueError("Either chunk_db_path or chunks must be provided.")
+        else:
+            chunks = load_chunk_db(chunk_db_path)
+
+    logger.info("Creating trigram index...")
+    index = TrigramIndex.build(chunks['processed_chunk'], show_progress=True)
+
+    logger.info("Saving the trigram index...")
+    index.save("./search_utils/index_trigram")
+
+    return index
+
+
+def create_filename_index(
+        file_list_path:str = None,
+        files = None):
+    """
+    Create a prefix index over file names and folders, used by query_filenames to find files by name.
+
+    Every token of each file's preprocessed filename, folders and extension is mapped to the files
+    containing it. The index is small (one posting per file and token) and is saved to disk for later use.
+
+    Args:
+        file_list_path (str, optional): Path to the JSON file list. If None and files is None, attempts to
+            load from default location './search_utils/file_list.json'.
+        files (dict, optional): Pre-loaded file list with 'filepath', 'filename' and 'file_id' keys.
+            If provided, file_list_path is ignored.
+
+    Returns:
+        filenames.FilenameIndex: The filename index, ready to pass to query_filenames.
+
+    Raises:
+        ValueError: If neither file_list_path nor files are provided and default location is not found.
+    """
+
+    # If given a file list, don't load anything
+    if files is None:
+        if file_list_path is None:
+            # Search for a default location file list
+            try:
+                files = json.load(open("./search_utils/file_list.json", 'rb'))
+            except Exception as e:
+                raise ValueError("Either file_list_path or files must be provided.")
+        else:
+            files = json.load(open(file_list_path, 'rb'))
+
+    logger.info("Creating filename index...")
+    index = FilenameIndex.build(files)
+
+    logger.info("Saving the filename index...")
+    index.save("./search_utils/index_filenames")
+
+    return index
+
+
+def create_corpus_arena(
+        chunk_db_path:str = None,
+        chunks = None):
+    """
+    Create the corpus arena used by query_direct to search every chunk in one pass.
+
+    All chunks are written, lowercased and as they are, into two contiguous files separated by
+    newlines, together with the offset of each chunk. The files are memory-mapped when loaded.
+
+    Args:
+        chunk_db_path (str, optional): Path to the chunk store (or JSON file) containing the processed chunk database.
+            If None and chunks is None, attempts to load from default location './search_utils/chunk_store.bin'.
+        chunks (dict, optional): Pre-loaded chunk database dictionary containing 'processed_chunk' key.
+            If provided, chunk_db_path is ignored.
+
+    Returns:
+        arena.CorpusArena: The corpus arena, ready to pass to query_direct.
+
+    Raises:
+        ValueError: If neither chunk_db_path nor chunks are provided and default location is not found.
+    """
+
+    # If given a chunks db, don't load anything
+    if chunks is None:
+        if chunk_db_path is None:
+            # Search for a default location index
+            try:
+                chunks = load_chunk_db()
+            except Exception as e: 
+                raise ValueError("Either chunk_db_path or chunks must be provided.")
+        else:
+            chunks = load_chunk_db(chunk_db_path)
+
+    logger.info("Writing the corpus arena...")
+    return CorpusArena.build(chunks['processed_chunk'], "./search_utils/corpus_arena")
+
 
 def create_ann_index(
         chunk_db_path:str = None,
         chunks = None,
-        model_name = "minishlab/potion-retrieval-32M"
+        model_name = default_model_name,
+        backend:str = 'auto'
     ):
     """
-    Create an Approximate Nearest Neighbor (ANN) index for semantic search using static embeddings.
+    Create a nearest neighbor index for semantic search using static embeddings.
     
     This function encodes text chunks into vector embeddings using a Model2Vec static embedding model,
-    then builds a PyNNDescent index for efficient similarity search. The index is saved to disk
-    for later use in semantic query operations.
+    then builds either an exact index or a PyNNDescent index for efficient similarity search. The index
+    is saved to disk for later use in semantic query operations.
+
+    For corpora of up to exact_max_chunks chunks the exact index is chosen: it only stores the
+    normalized embeddings, so there is no graph to build, and a query is one blocked matrix product.
+    Larger corpora get an approximate PyNNDescent graph. Only the index that was built is kept on disk.
+
+    The raw embeddings are kept in ./search_utils/embeddings.npy, keyed by a hash of each chunk's text,
+    so rebuilding the index, or re-chunking a corpus that mostly kept its text, only encodes the new chunks.
+    To follow a changed chunk database without rebuilding the index, use update_ann_index.
 
     Args:
-        chunk_db_path (str, optional): Path to the JSON file containing the processed chunk database.
-            If None and chunks is None, attempts to load from default location './search_utils/chunked_db.json'.
+        chunk_db_path (str, optional): Path to the chunk store (or JSON file) containing the processed chunk database.
+            If None and chunks is None, attempts to load from default location './search_utils/chunk_store.bin'.
         chunks (dict, optional): Pre-loaded chunk database dictionary containing 'processed_chunk' key.
             If provided, chunk_db_path is ignored.
         model_name (str, optional): Name of the Model2Vec model to use for embeddings.
             Defaults to "minishlab/potion-retrieval-32M".
+        backend (str, optional): 'exact', 'nndescent', or 'auto' to choose by corpus size.
+            Defaults to 'auto'.
 
     Returns:
-        pynndescent.NNDescent: The nearest neighbor index object ready for similarity queries.
+        incremental.IncrementalIndex: The nearest neighbor index object ready for similarity queries.
         
     Raises:
-        ValueError: If neither chunk_db_path nor chunks are provided and default location is not found.
+        ValueError: If neither chunk_db_path nor chunks are provided and default location is not found,
+            or if backend is not one of 'auto', 'exact' or 'nndescent'.
     """
 
+    if backend not in ('auto', 'exact', 'nndescent'):
+        raise ValueError(f"Unknown ANN backend: {backend}. Use 'auto', 'exact' or 'nndescent'.")
+
     # If given a chunks db, don't load anything
     if chunks is None:
         if chunk_db_path is None:
             # Search for a default location index
             try:
-                chunks = json.load(open("./search_utils/chunked_db.json", 'rb'))
+                chunks = load_chunk_db()
             except Exception as e: 
                 raise ValueError("Either chunk_db_path or chunks must be provided.")
+        else:
+            chunks = load_chunk_db(chunk_db_path)
 
-        chunks = json.load(open(chunk_db_path, 'r', encoding='utf-8'))
+    if backend == 'auto':
+        backend = 'exact' if len(chunks['processed_chunk']) <= exact_max_chunks else 'nndescent'
 
-    # Define the model
-    model = StaticModel.from_pretrained(
-        model_name,
-        normalize=True,
-        dimensionality=256,
-        quantize_to="float16",
-        force_download=False
-        ) # make sure these options work with your chosen model
-    
-    # Encode the chunks
+    # Encode the chunks that have no stored embedding yet and memory-map the rest
     logger.info("Encoding the text...")
-    vecs = model.encode(chunks['processed_chunk'], show_progress_bar=True, max_length=None)
-    
-    # Create the nearest-neighbor index
-    logger.info("Creating the nearest-neighbor index...")
-    index = nn.NNDescent(vecs, metric='cosine', n_neighbors=10, compressed=True, verbose=True, random_state=1234, low_memory=False, n_jobs=4)
-    index.prepare() # preloads the operations so that future uses are faster
+    vecs = embed_chunks(chunks['processed_chunk'], './search_utils', model_name)
+
+    return _build_ann_index(vecs, chunk_keys(chunks['processed_chunk']), backend, model_name)
+
+def _build_ann_index(vecs:np.ndarray, keys:np.ndarray, backend:str, model_name:str):
+    """
+    Build and save a new exact or NNDescent index from the chunk embeddings.
+
+    Args:
+        vecs (numpy.ndarray): Embedding of every chunk, in chunk ID order.
+        keys (numpy.ndarray): Content key of every chunk, in chunk ID order.
+        backend (str): 'exact' or 'nndescent'.
+        model_name (str): Name of the Model2Vec model the embeddings were encoded with.
+
+    Returns:
+        incremental.IncrementalIndex: The index, with no tombstones and no added rows.
+    """
+    if backend == 'exact':
+        logger.info("Creating the exact nearest-neighbor index...")
+        index = ExactIndex.build(vecs)
+        index.save('./search_utils/exact_index.npy')
+        logger.info(f"Saved the exact index to ./search_utils/exact_index.npy.")
+        stale_path = './search_utils/nn_database.pkl'
+    else:
+        # Create the nearest-neighbor index
+        logger.info("Creating the nearest-neighbor index...")
+        index = nn.NNDescent(np.asarray(vecs, dtype=np.float32), metric='cosine', n_neighbors=10, compressed=True, verbose=True, random_state=1234, low_memory=False, n_jobs=4)
+        index.prepare() # preloads the operations so that future uses are faster
+
+        # Pickle the nn data
+        logger.info("Saving the nearest-neighbor index...")
+        with open('./search_utils/nn_database.pkl', 'wb') as f:
+            pickle.dump(index, f)
+            logger.info(f"Saved the NN data to ./search_utils/nn_database.pkl.")
+        stale_path = './search_utils/exact_index.npy'
+
+    # An index of the other kind was built from older chunks, so it must not be loaded later
+    if os.path.exists(stale_path):
+        os.remove(stale_path)
+
+    index = IncrementalIndex(index, row_keys=keys, model=model_id(model_name))
+    index.save_rows('./search_utils')
+
+    return index
+
+def update_ann_index(
+        chunk_db_path:str = None,
+        chunks = None,
+        model_name = default_model_name,
+        backend:str = 'auto'
+    ):
+    """
+    Bring the nearest neighbor index in line with a changed chunk database without rebuilding it.
+
+    Chunks are matched to index rows by content key, so chunks whose text is unchanged keep their row even
+    if update_chunk_db renumbered them. Rows of deleted or changed chunks become tombstones that queries skip,
+    and new chunks are encoded and added to an exact delta searched alongside the index. The whole index is
+    rebuilt instead, from the stored embeddings, once more than ann_max_tombstone_fraction of its rows are
+    tombstones or more than ann_max_delta_fraction were added, and whenever there is no index that can be
+    updated: none was built yet, it was built by an older version or with another model, or the backend
+    changes.
+
+    Args:
+        chunk_db_path (str, optional): Path to the chunk store (or JSON file) containing the processed chunk database.
+            If None and chunks is None, attempts to load from default location './search_utils/chunk_store.bin'.
+        chunks (dict, optional): Pre-loaded chunk database dictionary containing 'processed_chunk' key.
+            If provided, chunk_db_path is ignored.
+        model_name (str, optional): Name of the Model2Vec model to use for embeddings.
+            Defaults to "minishlab/potion-retrieval-32M".
+        backend (str, optional): 'exact', 'nndescent', or 'auto' to choose by corpus size.
+            Defaults to 'auto'.
+
+    Returns:
+        incremental.IncrementalIndex: The updated nearest neighbor index.
+
+    Raises:
+        ValueError: If neither chunk_db_path nor chunks are provided and default location is not found,
+            or if backend is not one of 'auto', 'exact' or 'nndescent'.
+    """
+
+    if backend not in ('auto', 'exact', 'nndescent'):
+        raise ValueError(f"Unknown ANN backend: {backend}. Use 'auto', 'exact' or 'nndescent'.")
+
+    # If given a chunks db, don't load anything
+    if chunks is None:
+        try:
+            chunks = load_chunk_db(chunk_db_path)
+        except Exception as e:
+            raise ValueError("Either chunk_db_path or chunks must be provided.")
+
+    if backend == 'auto':
+        backend = 'exact' if len(chunks['processed_chunk']) <= exact_max_chunks else 'nndescent'
+
+    try:
+        index = load_ann_index('./search_utils')
+    except Exception as e:
+        logger.info(f"Could not load the ANN index ({e}).")
+        index = None
+
+    # Encode the chunks that have no stored embedding yet and memory-map the rest
+    logger.info("Encoding the text...")
+    vecs = embed_chunks(chunks['processed_chunk'], './search_utils', model_name)
+    keys = chunk_keys(chunks['processed_chunk'])
+
+    if (index is None or index.row_keys is None or index.model != model_id(model_name)
+            or index.backend != backend):
+        logger.info("The ANN index cannot be updated, rebuilding it.")
+        return _build_ann_index(vecs, keys, backend, model_name)
 
-    # Pickle the nn data
-    logger.info("Saving the nearest-neighbor index...")
-    with open('./search_utils/nn_database.pkl', 'wb') as f:
-        pickle.dump(index, f)
-        logger.info(f"Saved the NN data to ./search_utils/nn_database.pkl.")
+    index = index.update(keys, vecs)
+    if index.tombstone_fraction > ann_max_tombstone_fraction or index.delta_fraction > ann_max_delta_fraction:
+        logger.info(f"{index.tombstone_fraction:.0%} of the ANN index rows are tombstones and "
+                    f"{index.delta_fraction:.0%} were added since it was built, rebuilding it.")
+        return _build_ann_index(vecs, keys, backend, model_name)
 
+    index.save_rows('./search_utils')
     return index
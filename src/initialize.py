@@ -1,12 +1,21 @@
 import os
 import json
+import shutil
 import pickle
 import bm25s
 from utils import *
 from queries import *
 from indexes import *
+from models import default_model_name, warm_up_model
+from cache import bump_index_version
+from trigram import TrigramIndex
+from arena import CorpusArena
+from filenames import FilenameIndex
+from chunkstore import load_chunk_store, migrate_chunk_db, chunk_store_filename, legacy_chunk_db_filename
+from incremental import load_ann_index
+from segments import SegmentedBM25
 
-def load_existing_indices(path:str = None):
+def load_existing_indices(path:str = None, warm_up:bool = False, model_name:str = default_model_name):
     """
     Load existing search indices from disk if they exist.
     
@@ -16,18 +25,26 @@ def load_existing_indices(path:str = None):
     Args:
         path (str, optional): Root directory path where search_utils is located. 
                              If None, uses current working directory.
+        warm_up (bool, optional): If an ANN index was loaded, also load its embedding model now,
+            so the first semantic query does not pay for it. Defaults to False.
+        model_name (str, optional): Embedding model to warm up. Must match the model used to build
+            the ANN index. Defaults to "minishlab/potion-retrieval-32M".
     
     Returns:
         dict: Dictionary containing:
             - 'success': Boolean indicating if at least chunk database was loaded
-            - 'chunks': Loaded chunk database (None if not found)
+            - 'chunks': Loaded chunk database, a chunktable.ChunkTable memory-mapped from the chunk store (None if not found)
             - 'files': Loaded file list (None if not found)
             - 'file_dict': Loaded file dictionary (None if not found)
             - 'bm25_retriever': Loaded BM25 index (None if not found)
             - 'ann_index': Loaded ANN index (None if not found)
+            - 'trigram_index': Loaded trigram index (None if not found)
+            - 'corpus_arena': Corpus arena of the chunk database (None if there is no chunk database)
+            - 'filename_index': Filename index of the file list (None if there is no file list)
             - 'has_chunks': Boolean
             - 'has_bm25': Boolean
             - 'has_ann': Boolean
+            - 'has_trigram': Boolean
             - 'messages': List of status messages
     """
     if path is None:
@@ -40,23 +57,35 @@ def load_existing_indices(path:str = None):
         'file_dict': None,
         'bm25_retriever': None,
         'ann_index': None,
+        'trigram_index': None,
+        'corpus_arena': None,
+        'filename_index': None,
         'has_chunks': False,
         'has_bm25': False,
         'has_ann': False,
+        'has_trigram': False,
         'messages': []
     }
     
-    # Check for chunk database
-    chunk_db_path = os.path.join(path, 'search_utils', 'chunked_db.json')
+    # Check for chunk database, migrating a JSON database from an earlier version to a chunk store once
+    chunk_db_path = os.path.join(path, 'search_utils', chunk_store_filename)
+    legacy_chunk_db_path = os.path.join(path, 'search_utils', legacy_chunk_db_filename)
     if os.path.exists(chunk_db_path):
         try:
-            with open(chunk_db_path, 'r', encoding='utf-8') as f:
-                result['chunks'] = json.load(f)
+            result['chunks'] = load_chunk_store(chunk_db_path)
             result['has_chunks'] = True
             result['success'] = True
             result['messages'].append(f"✓ Loaded chunk database: {len(result['chunks']['chunk_id'])} chunks")
         except Exception as e:
             result['messages'].append(f"✗ Failed to load chunk database: {e}")
+    elif os.path.exists(legacy_chunk_db_path):
+        try:
+            result['chunks'] = migrate_chunk_db(legacy_chunk_db_path, chunk_db_path)
+            result['has_chunks'] = True
+            result['success'] = True
+            result['messages'].append(f"✓ Migrated chunk database to the binary chunk store: {len(result['chunks']['chunk_id'])} chunks")
+        except Exception as e:
+            result['messages'].append(f"✗ Failed to migrate chunk database: {e}")
     else:
         result['messages'].append("✗ Chunk database not found")
     
@@ -83,9 +112,17 @@ def load_existing_indices(path:str = None):
     else:
         result['messages'].append("✗ File dictionary not found")
     
-    # Check for BM25 index
+    # Check for BM25 index, segmented or single
+    bm25_segments_path = os.path.join(path, 'search_utils', 'index_bm25_segments')
     bm25_index_path = os.path.join(path, 'search_utils', 'index_bm25')
-    if os.path.exists(bm25_index_path):
+    if os.path.exists(bm25_segments_path):
+        try:
+            result['bm25_retriever'] = SegmentedBM25.load(bm25_segments_path)
+            result['has_bm25'] = True
+            result['messages'].append(f"✓ Loaded BM25 index ({len(result['bm25_retriever'].segments)} segments)")
+        except Exception as e:
+            result['messages'].append(f"✗ Failed to load BM25 index: {e}")
+    elif os.path.exists(bm25_index_path):
         try:
             result['bm25_retriever'] = bm25s.BM25.load(bm25_index_path, load_corpus=True, mmap=True)
             result['has_bm25'] = True
@@ -95,18 +132,65 @@ def load_existing_indices(path:str = None):
     else:
         result['messages'].append("✗ BM25 index not found")
     
-    # Check for ANN index
-    ann_index_path = os.path.join(path, 'search_utils', 'nn_database.pkl')
-    if os.path.exists(ann_index_path):
+    # Check for trigram index
+    trigram_index_path = os.path.join(path, 'search_utils', 'index_trigram')
+    if os.path.exists(trigram_index_path):
+        try:
+            result['trigram_index'] = TrigramIndex.load(trigram_index_path, mmap=True)
+            result['has_trigram'] = True
+            result['messages'].append("✓ Loaded trigram index")
+        except Exception as e:
+            result['messages'].append(f"✗ Failed to load trigram index: {e}")
+    else:
+        result['messages'].append("✗ Trigram index not found")
+    
+    # Map the corpus arena, writing it first if it is missing or belongs to another chunk database
+    if result['has_chunks']:
+        arena_path = os.path.join(path, 'search_utils', 'corpus_arena')
+        num_chunks = len(result['chunks']['processed_chunk'])
+        try:
+            try:
+                result['corpus_arena'] = CorpusArena.load(arena_path, num_chunks=num_chunks)
+                result['messages'].append("✓ Loaded corpus arena")
+            except (OSError, ValueError):
+                result['corpus_arena'] = CorpusArena.build(result['chunks']['processed_chunk'], arena_path)
+                result['messages'].append("✓ Built corpus arena")
+        except Exception as e:
+            result['messages'].append(f"✗ Failed to build corpus arena: {e}")
+
+    # Load the filename index, building it first if it is missing; it is small and quick to build
+    if result['files'] is not None:
+        filename_index_path = os.path.join(path, 'search_utils', 'index_filenames')
+        try:
+            try:
+                result['filename_index'] = FilenameIndex.load(filename_index_path, mmap=True)
+                result['messages'].append("✓ Loaded filename index")
+            except OSError:
+                result['filename_index'] = FilenameIndex.build(result['files'])
+                result['filename_index'].save(filename_index_path)
+                result['messages'].append("✓ Built filename index")
+        except Exception as e:
+            result['messages'].append(f"✗ Failed to build filename index: {e}")
+    
+    # Check for ANN index, exact or NNDescent
+    search_utils_path = os.path.join(path, 'search_utils')
+    if any(os.path.exists(os.path.join(search_utils_path, f)) for f in ('exact_index.npy', 'nn_database.pkl')):
         try:
-            with open(ann_index_path, 'rb') as f:
-                result['ann_index'] = pickle.load(f)
+            result['ann_index'] = load_ann_index(search_utils_path)
             result['has_ann'] = True
-            result['messages'].append("✓ Loaded ANN index")
+            result['messages'].append(f"✓ Loaded ANN index ({result['ann_index'].backend})")
         except Exception as e:
             result['messages'].append(f"✗ Failed to load ANN index: {e}")
     else:
         result['messages'].append("✗ ANN index not found")
+
+    # Load the embedding model once, so semantic queries only pay for the index lookup
+    if warm_up and result['has_ann']:
+        try:
+            warm_up_model(model_name)
+            result['messages'].append("✓ Loaded embedding model")
+        except Exception as e:
+            result['messages'].append(f"✗ Failed to load embedding model: {e}")
     
     return result
 
@@ -114,7 +198,13 @@ def initialize(
         path:str = None,
         chunk_size:int = 256,
         chunk_overlap:int = 16,
-        semantic_search:bool = True
+        semantic_search:bool = True,
+        num_workers:int = None,
+        incremental:bool = True,
+        keep_original:bool = False,
+        track_pages:bool = False,
+        trigram_index:bool = True,
+        ann_backend:str = 'auto'
         ):
     """
     Initialize a complete search system by scanning files, creating chunks, and building search indexes.
@@ -130,21 +220,41 @@ def initialize(
         chunk_overlap (int, optional): Number of overlapping words between consecutive chunks. Defaults to 16.
         semantic_search (bool, optional): Whether to create an ANN index for semantic search in addition
             to the BM25 index. Defaults to True.
+        num_workers (int, optional): Number of worker processes used to chunk files. Defaults to the
+            CPU count if None. Set to 1 to disable multiprocessing.
+        incremental (bool, optional): If an existing chunk database is found, only re-chunk files that
+            were added or changed since it was built, and update the BM25 and ANN indexes in place of
+            rebuilding them (see indexes.update_bm25_index and indexes.update_ann_index). Set to False to
+            always re-chunk every file and rebuild the indexes. Defaults to True.
+        keep_original (bool, optional): Also store the original text of every file so results can show
+            unprocessed text. Defaults to False.
+        track_pages (bool, optional): Record the first and last PDF page of every chunk so results can
+            show page numbers. Changing it rebuilds an existing chunk database. Defaults to False.
+        trigram_index (bool, optional): Whether to create a trigram index that speeds up direct
+            and regex search. Defaults to True.
+        ann_backend (str, optional): Semantic search index to build: 'exact' for brute-force search over
+            the embeddings, 'nndescent' for an approximate PyNNDescent graph, or 'auto' to use exact
+            search for corpora of up to exact.exact_max_chunks chunks. Defaults to 'auto'.
 
     Returns:
         dict: Dictionary containing initialized components:
             - 'files': File list dictionary with metadata
             - 'file_dict': File dictionary keyed by file_id
-            - 'chunks': Chunk database dictionary
+            - 'chunks': Chunk database, a chunktable.ChunkTable memory-mapped from the chunk store
             - 'bm25_retriever': BM25 index object for keyword search
+            - 'corpus_arena': Corpus arena for direct search
+            - 'filename_index': Filename index for searching files by name
             - 'ann_index': ANN index object for semantic search (only if semantic_search=True)
+            - 'trigram_index': Trigram index for direct search (only if trigram_index=True)
 
     Raises:
         NotADirectoryError: If the specified path is not a valid directory.
         
     Note:
         Creates a 'search_utils' subdirectory in the specified path to store all index files
-        and databases. If an existing file list is found, new files are appended to it.
+        and databases. If an existing file list is found, new files are appended to it, and an existing
+        chunk database is updated in place of a full rebuild. Every run records a new index version,
+        which invalidates all cached query results.
     """
 
     if path is None:
@@ -169,25 +279,67 @@ def initialize(
         file_list_path = None
     
     files, file_dict = file_scanner(path, file_list_path=file_list_path)
+
+    logging.info("Creating filename index.")
+    filename_index = create_filename_index(files=files)
     
-    logging.info("Creating chunk database.")
-    chunks = chunk_db(file_list=files, chunk_size=chunk_size, chunk_overlap=chunk_overlap)
+    chunk_db_path = f'{path}/search_utils/{chunk_store_filename}'
+    legacy_chunk_db_path = f'{path}/search_utils/{legacy_chunk_db_filename}'
+    if incremental and not os.path.exists(chunk_db_path) and os.path.exists(legacy_chunk_db_path):
+        logging.info("Found a JSON chunk database, migrating it to a chunk store.")
+        migrate_chunk_db(legacy_chunk_db_path, chunk_db_path)
+    if incremental and os.path.exists(chunk_db_path):
+        logging.info("Found existing chunk database, updating it.")
+        chunks = load_chunk_store(chunk_db_path)
+        chunks = update_chunk_db(chunks, files, output_path=chunk_db_path, chunk_size=chunk_size, chunk_overlap=chunk_overlap, num_workers=num_workers, keep_original=keep_original, track_pages=track_pages)
+    else:
+        logging.info("Creating chunk database.")
+        chunks = chunk_db(file_list=files, output_path=chunk_db_path, chunk_size=chunk_size, chunk_overlap=chunk_overlap, num_workers=num_workers, keep_original=keep_original, track_pages=track_pages)
+        if os.path.exists(legacy_chunk_db_path):
+            # A JSON database from an earlier version is now stale
+            os.remove(legacy_chunk_db_path)
+
+    if incremental:
+        logging.info("Updating BM25 index.")
+        bm25_retriever = update_bm25_index(chunks=chunks)
+    else:
+        logging.info("Creating BM25 index.")
+        bm25_retriever = create_bm25_index(chunks=chunks)
 
-    logging.info("Creating BM25 index.")
-    bm25_retriever = create_bm25_index(chunks=chunks)
+    if trigram_index:
+        logging.info("Creating trigram index.")
+        trigram = create_trigram_index(chunks=chunks)
+    elif os.path.exists(f'{path}/search_utils/index_trigram'):
+        # An old trigram index no longer matches the chunks, so it must not be loaded later
+        shutil.rmtree(f'{path}/search_utils/index_trigram')
+
+    logging.info("Writing corpus arena.")
+    arena = create_corpus_arena(chunks=chunks)
 
     if semantic_search:
-        logging.info("Creating ANN index.")
-        ann_index = create_ann_index(chunks=chunks)
+        if incremental:
+            logging.info("Updating ANN index.")
+            ann_index = update_ann_index(chunks=chunks, backend=ann_backend)
+        else:
+            logging.info("Creating ANN index.")
+            ann_index = create_ann_index(chunks=chunks, backend=ann_backend)
+
+    # Invalidate cached query results from the previous indexes
+    bump_index_version(f'{path}/search_utils')
     
     return_packet = {
         "files": files,
         "file_dict": file_dict,
         "chunks": chunks,
-        "bm25_retriever": bm25_retriever
+        "bm25_retriever": bm25_retriever,
+        "corpus_arena": arena,
+        "filename_index": filename_index
     }
 
     if semantic_search:
         return_packet["ann_index"] = ann_index
 
+    if trigram_index:
+        return_packet["trigram_index"] = trigram
+
     return return_packet
\ No newline at end of file
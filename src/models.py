@@ -0,0 +1,180 @@
+import logging
+import threading
+from collections import OrderedDict
+import numpy as np
+from model2vec import StaticModel
+
+#### Define constants/defaults for various functions below
+default_model_name = "minishlab/potion-retrieval-32M"
+
+# Model options shared by indexing and querying. Query vectors are only comparable
+# to the indexed vectors if both were encoded with the same options.
+default_model_options = {
+    'normalize': True,
+    'dimensionality': 256,
+    'quantize_to': "float16",
+}
+
+# Maximum number of query vectors kept in the query embedding cache
+query_cache_size = 1024
+
+# Models loaded in this process, keyed by (model_name, options)
+_models = {}
+_models_lock = threading.Lock()
+
+# LRU cache of query vectors, keyed by (model key, preprocessed query text)
+_query_cache = OrderedDict()
+_query_cache_lock = threading.Lock()
+
+def _model_key(model_name:str, options:dict = None):
+    """
+    Build the registry key for a model name and its load options.
+
+    Args:
+        model_name (str): Name of the Model2Vec model.
+        options (dict, optional): Load options passed to StaticModel.from_pretrained.
+            Defaults to default_model_options if None.
+
+    Returns:
+        tuple: Hashable key of (model_name, sorted options).
+    """
+    if options is None:
+        options = default_model_options
+    return (model_name, tuple(sorted(options.items())))
+
+def get_model(model_name:str = default_model_name, options:dict = None):
+    """
+    Return a Model2Vec model, loading it only the first time it is requested in this process.
+
+    Models are kept resident in a process-wide registry, one per model name and option set, so
+    repeated queries and index builds share a single loaded copy instead of reloading it every time.
+
+    Args:
+        model_name (str, optional): Name of the Model2Vec model. Defaults to "minishlab/potion-retrieval-32M".
+        options (dict, optional): Options passed to StaticModel.from_pretrained. Defaults to
+            default_model_options if None.
+
+    Returns:
+        model2vec.StaticModel: The loaded model.
+    """
+    key = _model_key(model_name, options)
+    model = _models.get(key)
+    if model is not None:
+        return model
+
+    with _models_lock:
+        # Another thread may have loaded it while we waited for the lock
+        model = _models.get(key)
+        if model is None:
+            logging.info(f"Loading embedding model {model_name}...")
+            model = StaticModel.from_pretrained(
+                model_name,
+                force_download=False,
+                **dict(key[1])
+                )
+            _models[key] = model
+    return model
+
+def warm_up_model(model_name:str = default_model_name, options:dict = None):
+    """
+    Load a model into the registry and run one encoding so the first real query is fast.
+
+    Args:
+        model_name (str, optional): Name of the Model2Vec model. Defaults to "minishlab/potion-retrieval-32M".
+        options (dict, optional): Options passed to StaticModel.from_pretrained. Defaults to
+            default_model_options if None.
+
+    Returns:
+        model2vec.StaticModel: The loaded model.
+    """
+    model = get_model(model_name, options)
+    model.encode("warm up", max_length=None)
+    return model
+
+def encode_query(query:str, model_name:str = default_model_name, options:dict = None, use_cache:bool = True):
+    """
+    Encode an already preprocessed query with a resident model, reusing cached vectors for repeat queries.
+
+    The most recently used query_cache_size vectors are kept. Cached vectors are shared between calls,
+    so they are returned read-only.
+
+    Args:
+        query (str): Preprocessed query text. This text is the cache key.
+        model_name (str, optional): Name of the Model2Vec model. Defaults to "minishlab/potion-retrieval-32M".
+        options (dict, optional): Options passed to StaticModel.from_pretrained. Defaults to
+            default_model_options if None.
+        use_cache (bool, optional): Look up and store the vector in the query cache. Defaults to True.
+
+    Returns:
+        numpy.ndarray: 1-D query vector.
+    """
+    key = (_model_key(model_name, options), query)
+    if use_cache:
+        with _query_cache_lock:
+            vec = _query_cache.get(key)
+            if vec is not None:
+                _query_cache.move_to_end(key)
+                return vec
+
+    vec = get_model(model_name, options).encode(query, max_length=None)
+    vec.setflags(write=False)
+
+    if use_cache and query_cache_size > 0:
+        with _query_cache_lock:
+            _query_cache[key] = vec
+            _query_cache.move_to_end(key)
+            while len(_query_cache) > query_cache_size:
+                _query_cache.popitem(last=False)
+    return vec
+
+def encode_queries(queries:list, model_name:str = default_model_name, options:dict = None, use_cache:bool = True):
+    """
+    Encode a list of already preprocessed queries in one model call, reusing cached vectors.
+
+    Only the queries missing from the query cache are encoded, together in a single batch.
+
+    Args:
+        queries (list): Preprocessed query texts.
+        model_name (str, optional): Name of the Model2Vec model. Defaults to "minishlab/potion-retrieval-32M".
+        options (dict, optional): Options passed to StaticModel.from_pretrained. Defaults to
+            default_model_options if None.
+        use_cache (bool, optional): Look up and store the vectors in the query cache. Defaults to True.
+
+    Returns:
+        numpy.ndarray: 2-D array with one query vector per row, in input order.
+    """
+    model_key = _model_key(model_name, options)
+    vecs = [None] * len(queries)
+    if use_cache:
+        with _query_cache_lock:
+            for i, query in enumerate(queries):
+                vec = _query_cache.get((model_key, query))
+                if vec is not None:
+                    _query_cache.move_to_end((model_key, query))
+                    vecs[i] = vec
+
+    # Encode each distinct missing query once
+    missing = list(dict.fromkeys(query for query, vec in zip(queries, vecs) if vec is None))
+    if missing:
+        encoded = dict(zip(missing, get_model(model_name, options).encode(missing, max_length=None)))
+        vecs = [encoded[query] if vec is None else vec for query, vec in zip(queries, vecs)]
+        if use_cache and query_cache_size > 0:
+            with _query_cache_lock:
+                for query in missing:
+                    vec = encoded[query].copy()
+                    vec.setflags(write=False)
+                    _query_cache[(model_key, query)] = vec
+                    _query_cache.move_to_end((model_key, query))
+                while len(_query_cache) > query_cache_size:
+                    _query_cache.popitem(last=False)
+
+    if not vecs:
+        return np.empty((0, get_model(model_name, options).dim))
+    return np.stack(vecs)
+
+def clear_query_cache():
+    """
+    Remove all vectors from the query embedding cache.
+    """
+    with _query_cache_lock:
+        _query_cache.clear()
@@ -0,0 +1,136 @@
+import numpy as np
+from collections import deque
+from numba import njit
+
+#### Define constants/defaults for various functions below
+# Initial capacity of the hit buffers filled by the automaton scan; they grow by doubling
+initial_hit_capacity = 1 << 16
+
+@njit(cache=True, nogil=True)
+def _scan_chunks(data, starts, chunk_ids, delta, out_ptr, out_terms, term_lengths):
+    """
+    Run an Aho-Corasick automaton over a set of chunks of a buffer and record the term hits.
+
+    Like str.count, a hit of a term is only recorded if it starts after the end of the previous recorded
+    hit of the same term, so overlapping occurrences of one term (e.g. 'aa' in 'aaa') count once.
+    Occurrences of one term all have the same length, so taking them by end position picks the same
+    leftmost occurrences as str.count does.
+
+    Args:
+        data (numpy.ndarray): uint8 view of the buffer.
+        starts (numpy.ndarray): Chunk start offsets; chunk i is data[starts[i]:starts[i+1]-1].
+        chunk_ids (numpy.ndarray): IDs of the chunks to scan.
+        delta (numpy.ndarray): (num_states, 256) transition table of the automaton.
+        out_ptr (numpy.ndarray): CSR pointers into out_terms for every state.
+        out_terms (numpy.ndarray): IDs of the terms that end in each state.
+        term_lengths (numpy.ndarray): Length in bytes of every term.
+
+    Returns:
+        tuple: Tuple of (chunk IDs, term IDs) arrays with one entry per hit.
+    """
+    hit_chunks = np.empty(initial_hit_capacity, dtype=np.int64)
+    hit_terms = np.empty(initial_hit_capacity, dtype=np.int32)
+    num_hits = 0
+    # Buffer offset where the next hit of each term may start; chunks don't overlap, so it never needs a reset
+    next_start = np.zeros(len(term_lengths), dtype=np.int64)
+    for chunk in chunk_ids:
+        state = 0
+        for pos in range(starts[chunk], starts[chunk + 1] - 1):
+            state = delta[state, data[pos]]
+            for j in range(out_ptr[state], out_ptr[state + 1]):
+                term = out_terms[j]
+                if pos + 1 - term_lengths[term] < next_start[term]:
+                    continue
+                next_start[term] = pos + 1
+                if num_hits == len(hit_chunks):
+                    grown_chunks = np.empty(2 * num_hits, dtype=np.int64)
+                    grown_chunks[:num_hits] = hit_chunks
+                    hit_chunks = grown_chunks
+                    grown_terms = np.empty(2 * num_hits, dtype=np.int32)
+                    grown_terms[:num_hits] = hit_terms
+                    hit_terms = grown_terms
+                hit_chunks[num_hits] = chunk
+                hit_terms[num_hits] = term
+                num_hits += 1
+    return hit_chunks[:num_hits], hit_terms[:num_hits]
+
+class AhoCorasick:
+    """
+    Aho-Corasick automaton over the UTF-8 bytes of a list of terms, for finding all of them in one pass.
+
+    The automaton is stored as a dense transition table with one row of 256 next states per trie node,
+    so the scan does a single table lookup per byte, whatever the number of terms. Each term is counted
+    like str.count counts it: overlapping occurrences of the same term count once, while occurrences of
+    different terms are counted independently even where they overlap.
+
+    Args:
+        terms (list): Distinct, non-empty terms to search for.
+    """
+
+    def __init__(self, terms:list):
+        self.terms = list(terms)
+        encoded = [term.encode('utf-8') for term in self.terms]
+
+        # Trie of the terms
+        children = [{}]
+        ends = [[]]
+        for term_id, term in enumerate(encoded):
+            state = 0
+            for byte in term:
+                nxt = children[state].get(byte)
+                if nxt is None:
+                    nxt = len(children)
+                    children[state][byte] = nxt
+                    children.append({})
+                    ends.append([])
+                state = nxt
+            ends[state].append(term_id)
+
+        # Breadth-first pass filling in failure transitions, so the table never needs to backtrack
+        num_states = len(children)
+        delta = np.zeros((num_states, 256), dtype=np.int32)
+        outputs = [None] * num_states
+        outputs[0] = []
+        queue = deque()
+        for byte, nxt in children[0].items():
+            delta[0, byte] = nxt
+            outputs[nxt] = ends[nxt]
+            queue.append((nxt, 0))
+        while queue:
+            state, fail = queue.popleft()
+            delta[state] = delta[fail]
+            for byte, nxt in children[state].items():
+                delta[state, byte] = nxt
+                next_fail = delta[fail, byte]
+                # A state also reports every term ending in its longest proper suffix state
+                outputs[nxt] = ends[nxt] + outputs[next_fail]
+                queue.append((nxt, next_fail))
+
+        self.delta = delta
+        self.out_ptr = np.zeros(num_states + 1, dtype=np.int64)
+        self.out_ptr[1:] = np.cumsum([len(out) for out in outputs])
+        self.out_terms = np.array([term_id for out in outputs for term_id in out], dtype=np.int32)
+        self.term_lengths = np.array([len(term) for term in encoded], dtype=np.int64)
+
+    def count(self, data:np.ndarray, starts:np.ndarray, chunk_ids:np.ndarray):
+        """
+        Count the hits of every term in every chunk.
+
+        Args:
+            data (numpy.ndarray): uint8 view of a buffer of newline-separated chunks, e.g. a corpus arena.
+            starts (numpy.ndarray): Chunk start offsets; chunk i is data[starts[i]:starts[i+1]-1].
+            chunk_ids (numpy.ndarray): IDs of the chunks to scan.
+
+        Returns:
+            tuple: Tuple of (chunk IDs, term IDs, hit counts), one entry per chunk and term with at
+                least one hit, sorted by chunk ID and then term ID.
+        """
+        hit_chunks, hit_terms = _scan_chunks(data, starts, np.asarray(chunk_ids, dtype=np.int64),
+                                             self.delta, self.out_ptr, self.out_terms, self.term_lengths)
+        if len(hit_chunks) == 0:
+            empty = np.empty(0, dtype=np.int64)
+            return empty, empty, empty
+        keys = np.sort(hit_chunks * len(self.terms) + hit_terms)
+        first = np.flatnonzero(np.concatenate(([True], keys[1:] != keys[:-1])))
+        counts = np.diff(np.append(first, len(keys)))
+        return keys[first] // len(self.terms), keys[first] % len(self.terms), counts
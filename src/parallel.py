@@ -0,0 +1,196 @@
+import os
+import re
+import time
+import heapq
+import logging
+import threading
+import numpy as np
+from concurrent.futures import ProcessPoolExecutor
+from arena import CorpusArena
+
+#### Define constants/defaults for various functions below
+# Number of chunks scanned in-process to measure how expensive a pattern is before deciding whether
+# the rest of the scan is worth sending to the worker pool
+parallel_sample_chunks = 256
+
+# Number of contiguous work units handed out per worker. A few units per worker even out slices
+# that happen to be slower to scan, while keeping the per-unit overhead low.
+parallel_units_per_worker = 4
+
+# Process-wide worker pool, reused by every parallel scan
+_pool = None
+_pool_workers = None
+_pool_overhead = None
+_pool_lock = threading.Lock()
+
+# Arenas mapped in a worker process, keyed by arena path
+_worker_arenas = {}
+
+def _ping():
+    """No-op task used to start the workers and time a round trip to them."""
+    return os.getpid()
+
+def get_pool(max_workers:int = None):
+    """
+    Return the shared worker pool, starting it the first time it is requested in this process.
+
+    When the pool starts, the time of one round of no-op tasks on every worker is measured and
+    kept as the pool's per-scan overhead, which scan_regex weighs against the expected scan time.
+
+    Args:
+        max_workers (int, optional): Number of worker processes. Defaults to the CPU count if None.
+            Asking for a different number restarts the pool.
+
+    Returns:
+        tuple: Tuple of (concurrent.futures.ProcessPoolExecutor, number of workers, overhead in seconds).
+    """
+    global _pool, _pool_workers, _pool_overhead
+    if max_workers is None:
+        max_workers = os.cpu_count() or 1
+
+    with _pool_lock:
+        if _pool is not None and _pool_workers != max_workers:
+            _pool.shutdown(wait=True)
+            _pool = None
+        if _pool is None:
+            logging.info(f"Starting {max_workers} search workers...")
+            _pool = ProcessPoolExecutor(max_workers=max_workers)
+            _pool_workers = max_workers
+            # The first round starts the processes, the second measures a warm round trip
+            for _ in range(2):
+                start = time.perf_counter()
+                for future in [_pool.submit(_ping) for _ in range(max_workers)]:
+                    future.result()
+                _pool_overhead = time.perf_counter() - start
+            logging.info(f"Search workers ready, round trip {_pool_overhead * 1000:.1f} ms.")
+        return _pool, _pool_workers, _pool_overhead
+
+def shutdown_pool():
+    """
+    Stop the shared worker pool. The next parallel scan starts a new one.
+    """
+    global _pool, _pool_workers, _pool_overhead
+    with _pool_lock:
+        if _pool is not None:
+            _pool.shutdown(wait=True)
+        _pool = _pool_workers = _pool_overhead = None
+
+def _worker_arena(path:str, num_chunks:int):
+    """
+    Return the arena at path, mapped once per worker process and re-mapped if it was rebuilt.
+
+    Args:
+        path (str): Directory holding the arena files.
+        num_chunks (int): Number of chunks the caller's chunk database holds.
+
+    Returns:
+        arena.CorpusArena: The arena.
+    """
+    st = os.stat(os.path.join(path, 'text.bin'))
+    stamp = (st.st_ino, st.st_mtime_ns, st.st_size)
+    cached = _worker_arenas.get(path)
+    if cached is None or cached[0] != stamp:
+        if cached is not None:
+            cached[1].close()
+        cached = (stamp, CorpusArena.load(path, num_chunks=num_chunks))
+        _worker_arenas[path] = cached
+    return cached[1]
+
+def _count_top_k(pattern:re.Pattern, texts, chunk_ids, num_results:int):
+    """
+    Count pattern matches per chunk and keep the num_results chunks with the most matches.
+
+    Args:
+        pattern (re.Pattern): Compiled pattern.
+        texts: Chunk texts, indexable by chunk ID.
+        chunk_ids: Chunk IDs to scan.
+        num_results (int): Number of chunks to keep.
+
+    Returns:
+        list: (chunk ID, match count) tuples of the top chunks, in no particular order.
+    """
+    heap = []
+    for idx in chunk_ids:
+        match_count = sum(1 for _ in pattern.finditer(texts[idx]))
+        if match_count > 0:
+            # Fewer matches, then higher IDs, lose, as in query_direct's ranking
+            item = (match_count, -idx)
+            if len(heap) < num_results:
+                heapq.heappush(heap, item)
+            elif item > heap[0]:
+                heapq.heapreplace(heap, item)
+    return [(-neg_idx, match_count) for match_count, neg_idx in heap]
+
+class _ArenaTexts:
+    """Read-only view of an arena's original chunk texts, decoded one chunk at a time."""
+
+    def __init__(self, arena:CorpusArena):
+        self.buf = arena.text
+        self.starts = arena.text_starts
+
+    def __getitem__(self, idx:int):
+        return str(self.buf[self.starts[idx]:self.starts[idx + 1] - 1], 'utf-8')
+
+def _scan_unit(arena_path:str, num_chunks:int, pattern:re.Pattern, chunk_ids, num_results:int):
+    """
+    Worker task: count pattern matches in one contiguous slice of chunk IDs, read from the mapped arena.
+
+    Args:
+        arena_path (str): Directory holding the arena files.
+        num_chunks (int): Number of chunks the caller's chunk database holds.
+        pattern (re.Pattern): Compiled pattern.
+        chunk_ids (numpy.ndarray): Chunk IDs to scan.
+        num_results (int): Number of chunks to keep.
+
+    Returns:
+        list: (chunk ID, match count) tuples of the slice's top chunks.
+    """
+    arena = _worker_arena(arena_path, num_chunks)
+    return _count_top_k(pattern, _ArenaTexts(arena), chunk_ids.tolist(), num_results)
+
+def scan_regex(pattern:re.Pattern, texts:list, chunk_ids, num_results:int, arena:CorpusArena = None, max_workers:int = None):
+    """
+    Count regex matches in a set of chunks, in parallel when that is measured to be faster.
+
+    The first parallel_sample_chunks chunks are scanned in this process and timed. If the time
+    the rest would take here, less the time it would take split over the workers, exceeds the
+    measured round trip to the worker pool, the rest is split into a few large contiguous slices
+    per worker. Workers read the chunks from the memory-mapped corpus arena, so no chunk text is
+    pickled, and each returns only its own top num_results chunks. Otherwise the scan simply
+    continues in this process.
+
+    Args:
+        pattern (re.Pattern): Compiled pattern.
+        texts (list): Chunk texts, indexable by chunk ID.
+        chunk_ids (range or list): Chunk IDs to scan, ascending.
+        num_results (int): Number of top chunks needed by the caller.
+        arena (arena.CorpusArena, optional): Corpus arena of the chunks. Without it the scan always
+            runs in this process. Defaults to None.
+        max_workers (int, optional): Number of worker processes, at most the CPU count. Defaults to
+            the CPU count if None.
+
+    Returns:
+        list: (chunk ID, match count) tuples, containing at least the top num_results chunks.
+    """
+    # Workers beyond the number of CPUs only take turns, so they don't shorten the scan
+    num_cpus = os.cpu_count() or 1
+    num_workers = min(max_workers if max_workers is not None else num_cpus, num_cpus)
+    sample, rest = chunk_ids[:parallel_sample_chunks], chunk_ids[parallel_sample_chunks:]
+    if arena is None or num_workers < 2 or len(rest) == 0:
+        return _count_top_k(pattern, texts, chunk_ids, num_results)
+
+    start = time.perf_counter()
+    results = _count_top_k(pattern, texts, sample, num_results)
+    estimate = (time.perf_counter() - start) / len(sample) * len(rest)
+
+    executor, num_workers, overhead = get_pool(num_workers)
+    if estimate * (1 - 1 / num_workers) <= overhead:
+        return results + _count_top_k(pattern, texts, rest, num_results)
+
+    logging.info(f"Scanning {len(rest)} chunks on {num_workers} workers (about {estimate:.2f} s sequentially).")
+    rest = np.asarray(rest, dtype=np.int64)
+    units = np.array_split(rest, min(len(rest), num_workers * parallel_units_per_worker))
+    futures = [executor.submit(_scan_unit, arena.path, arena.num_chunks, pattern, unit, num_results) for unit in units]
+    for future in futures:
+        results.extend(future.result())
+    return results
@@ -1,17 +1,241 @@
 import json, bm25s, Stemmer, re, os, sys, pickle
 from typing import List, Dict, Union
 from utils import *
-from model2vec import StaticModel
+from models import default_model_name, encode_query, encode_queries
+from embeddings import load_embeddings
+from trigram import literal_query, regex_query
+from arena import arena_min_candidate_fraction
+from parallel import scan_regex
+from multipattern import AhoCorasick
+from exact import ExactIndex
+from filelevel import chunk_file_codes, aggregate_by_file, file_aggregations, file_candidate_factor, file_candidate_growth
+from filters import mask_key
+from filenames import FilenameIndex, filename_boost
+from incremental import IncrementalIndex, load_ann_index
+from segments import SegmentedBM25, segments_state_filename
+from chunkstore import load_chunk_db
 import numpy as np
 import pynndescent
 import heapq
-from concurrent.futures import ProcessPoolExecutor, as_completed
-from functools import partial
+from scipy.sparse import csr_matrix
+from tqdm import tqdm
+from functools import lru_cache
+from concurrent.futures import ThreadPoolExecutor
+
+@lru_cache(maxsize=None)
+def get_stemmer(language:str = "english"):
+    """
+    Return a shared Snowball stemmer, created once per language.
+
+    Args:
+        language (str, optional): Stemmer language. Defaults to "english".
+
+    Returns:
+        Stemmer.Stemmer: The stemmer. Must match the stemmer used in create_bm25_index.
+    """
+    return Stemmer.Stemmer(language)
+
+def _load_bm25_retriever(index_path:str = None, retriever = None):
+    """
+    Return the given BM25 retriever, or load it from disk.
+
+    Args:
+        index_path (str, optional): Path to the BM25 index directory, either a bm25s index or a segmented
+            index. Defaults to './search_utils/index_bm25_segments', or './search_utils/index_bm25' if there
+            is no segmented index, if both index_path and retriever are None.
+        retriever (bm25s.BM25 or segments.SegmentedBM25, optional): Pre-loaded BM25 retriever object. If
+            provided, index_path is ignored.
+
+    Returns:
+        bm25s.BM25 or segments.SegmentedBM25: The BM25 retriever.
+
+    Raises:
+        ValueError: If neither index_path nor retriever are provided and default location is not found.
+    """
+    if retriever is not None:
+        return retriever
+    if index_path is None:
+        # Search for a default location index
+        if os.path.exists("./search_utils/index_bm25_segments"):
+            return SegmentedBM25.load("./search_utils/index_bm25_segments")
+        try:
+            return bm25s.BM25.load("./search_utils/index_bm25", load_corpus=True, mmap=True)
+        except Exception as e:
+            raise ValueError("Either index_path or retriever must be provided.")
+    if os.path.exists(os.path.join(index_path, segments_state_filename)):
+        return SegmentedBM25.load(index_path)
+    return bm25s.BM25.load(index_path, load_corpus=True, mmap=True)
+
+def _bm25_num_docs(retriever):
+    """Number of chunks in a bm25s.BM25 or segments.SegmentedBM25 index."""
+    return retriever.num_docs if isinstance(retriever, SegmentedBM25) else int(retriever.scores['num_docs'])
+
+def _load_nn_index(index_path:str = None, index = None):
+    """
+    Return the given nearest neighbor index, or load it from disk.
+
+    Args:
+        index_path (str, optional): Path to the saved index: a .npy file for an exact index, otherwise a
+            pickled NN index file. Defaults to './search_utils/exact_index.npy', or
+            './search_utils/nn_database.pkl' if there is no exact index, if both index_path and index are None.
+        index (incremental.IncrementalIndex, exact.ExactIndex or pynndescent.NNDescent, optional): Pre-loaded
+            nearest neighbor index. If provided, index_path is ignored.
+
+    Returns:
+        incremental.IncrementalIndex, exact.ExactIndex or pynndescent.NNDescent: The nearest neighbor index.
+
+    Raises:
+        ValueError: If neither index_path nor index are provided and default location is not found.
+    """
+    if index is not None:
+        return index
+    if index_path is None:
+        # Search for a default location index
+        try:
+            return load_ann_index('./search_utils')
+        except Exception as e:
+            raise ValueError("Either index_path or index must be provided.")
+    return IncrementalIndex.load(index_path)
+
+def _load_filename_index(index_path:str = None, index = None):
+    """
+    Return the given filename index, or load it from disk.
+
+    Args:
+        index_path (str, optional): Path to the filename index directory. Defaults to
+            './search_utils/index_filenames' if both index_path and index are None.
+        index (filenames.FilenameIndex, optional): Pre-loaded filename index. If provided, index_path is ignored.
+
+    Returns:
+        filenames.FilenameIndex: The filename index.
+
+    Raises:
+        ValueError: If neither index_path nor index are provided and default location is not found.
+    """
+    if index is not None:
+        return index
+    if index_path is None:
+        # Search for a default location index
+        try:
+            return FilenameIndex.load('./search_utils/index_filenames')
+        except Exception as e:
+            raise ValueError("Either index_path or index must be provided.")
+    return FilenameIndex.load(index_path)
+
+def _bm25_results(ids, scores):
+    """
+    Format one row of BM25 results, normalizing the scores to sum to 1.
+
+    Args:
+        ids (numpy.ndarray): Chunk IDs of the top results.
+        scores (numpy.ndarray): BM25 scores of the top results.
+
+    Returns:
+        dict: Dictionary with 'id' and 'score' lists.
+    """
+    scores = scores.tolist()
+    t = sum(scores)
+    # A query with no indexed terms scores 0 everywhere; keep those scores as they are
+    scores = [x / t for x in scores] if t > 0 else scores
+    return {'id': ids.tolist(), 'score': scores}
+
+def _nn_results(ids, distances):
+    """
+    Format one row of nearest neighbor results, inverting the distances and normalizing them to sum to 1.
+
+    Args:
+        ids (numpy.ndarray): Chunk IDs of the nearest neighbors.
+        distances (numpy.ndarray): Cosine distances of the nearest neighbors.
+
+    Returns:
+        dict: Dictionary with 'id' and 'score' lists.
+    """
+    # NOTE: scores are distances, so lower is better
+    inv_scores = [1 - s for s in distances.tolist()]  # Invert scores for normalization. This works for cosine distance, but confirm if using a different metric.
+    t = sum(inv_scores)
+    inv_scores = [x / t for x in inv_scores]
+    return {'id': ids.tolist(), 'score': inv_scores}
+
+def _bm25_top_k(retriever, query_tokens, k:int, block_size:int = 256, show_progress:bool = False):
+    """
+    Score a batch of tokenized queries against a BM25 index and select the top-k chunks of each.
+
+    The index stores, for every token, the BM25 score of each chunk containing it. Each block of queries
+    is turned into a sparse (query x token) count matrix and multiplied with that (token x chunk) score
+    matrix, which scores the whole block in one sparse product. The top-k of each query is then selected
+    among the chunks that match at least one of its tokens, rather than among all chunks.
+
+    Ties are broken by lower chunk ID. If fewer than k chunks match, the rest are filled with the lowest
+    chunk IDs that don't match, as these all have the same score.
+
+    Args:
+        retriever (bm25s.BM25): BM25 retriever with a loaded index.
+        query_tokens (bm25s.tokenization.Tokenized): Tokenized queries.
+        k (int): Number of results per query.
+        block_size (int, optional): Number of queries scored per sparse product. Defaults to 256.
+        show_progress (bool, optional): Show a progress bar over the blocks. Defaults to False.
+
+    Returns:
+        tuple: Tuple of (ids, scores), two arrays of shape (number of queries, k).
+
+    Raises:
+        ValueError: If k is larger than the number of chunks in the index.
+    """
+    index_scores = retriever.scores
+    num_tokens = len(index_scores['indptr']) - 1
+    num_docs = index_scores['num_docs']
+    if k > num_docs:
+        raise ValueError(f"k of {k} is larger than the number of indexed chunks, which is {num_docs}.")
+
+    score_matrix = csr_matrix(
+        (index_scores['data'], index_scores['indices'], index_scores['indptr']),
+        shape=(num_tokens, num_docs)
+        )
+    token_ids = [retriever.get_tokens_ids(q) for q in bm25s.tokenization.convert_tokenized_to_string_list(query_tokens)]
+    # BM25 variants that give non-matching chunks a score store it per token
+    nonoccurrence = getattr(retriever, 'nonoccurrence_array', None)
+
+    ids = np.zeros((len(token_ids), k), dtype=np.int64)
+    scores = np.zeros((len(token_ids), k), dtype=score_matrix.dtype)
+    for block_start in tqdm(range(0, len(token_ids), block_size), desc="Scoring queries", disable=not show_progress):
+        block = token_ids[block_start:block_start + block_size]
+        query_ptr = np.zeros(len(block) + 1, dtype=np.int64)
+        np.cumsum([len(q) for q in block], out=query_ptr[1:])
+        flat_ids = np.fromiter((t for q in block for t in q), dtype=np.int64, count=query_ptr[-1])
+        query_matrix = csr_matrix(
+            (np.ones(len(flat_ids), dtype=score_matrix.dtype), flat_ids, query_ptr),
+            shape=(len(block), num_tokens)
+            )
+        block_scores = (query_matrix @ score_matrix).tocsr()
+
+        for row in range(len(block)):
+            lo, hi = block_scores.indptr[row], block_scores.indptr[row + 1]
+            doc_scores = block_scores.data[lo:hi]
+            docs = block_scores.indices[lo:hi]
+            base = nonoccurrence[block[row]].sum() if nonoccurrence is not None else 0
+            if len(docs) > k:
+                top = np.argpartition(-doc_scores, k - 1)[:k]
+                # Keep every chunk tied with the k-th score, so the tie-break below is by chunk ID
+                top = np.flatnonzero(doc_scores >= doc_scores[top].min())
+                doc_scores, docs = doc_scores[top], docs[top]
+            order = np.lexsort((docs, -doc_scores))[:k]
+            n = len(order)
+            i = block_start + row
+            ids[i, :n] = docs[order]
+            scores[i, :n] = doc_scores[order] + base
+            if n < k:
+                # Pad with the lowest non-matching chunk IDs, which all score just the base
+                padding = np.setdiff1d(np.arange(min(num_docs, k + n)), docs, assume_unique=True)[:k - n]
+                ids[i, n:] = padding
+                scores[i, n:] = base
+    return ids, scores
 
 def query_bm25(query:str
             , index_path:str = None
             , retriever = None
             , num_results:int = 3
+            , cache = None
+            , mask:np.ndarray = None
             ):
     """
     Retrieve the top-k most relevant text chunks using BM25 keyword-based search.
@@ -20,13 +244,20 @@ def query_bm25(query:str
     tokenized with English stopwords and stemming, and matched against the indexed corpus. Scores are
     normalized to sum to 1.
 
+    If a mask is given, chunks outside it are scored 0 inside the retriever and never returned, so fewer
+    than num_results chunks may come back.
+
     Args:
         query (str): The search query string to find relevant documents.
         index_path (str, optional): Path to the BM25 index directory. If None and retriever is None,
-            attempts to load from default location './search_utils/index_bm25'.
-        retriever (bm25s.BM25, optional): Pre-loaded BM25 retriever object. If provided, index_path is ignored.
+            attempts to load from the default locations in './search_utils'.
+        retriever (bm25s.BM25 or segments.SegmentedBM25, optional): Pre-loaded BM25 retriever object.
+            If provided, index_path is ignored.
         num_results (int, optional): Maximum number of top results to return. Defaults to 3.
             Minimum value is 1.
+        cache (cache.ResultCache, optional): Result cache to answer repeat queries from. Defaults to None.
+        mask (numpy.ndarray, optional): Boolean mask over chunk IDs, e.g. from filters.filter_mask; only
+            chunks where it is True are returned. Defaults to None.
 
     Returns:
         dict: Dictionary containing:
@@ -37,69 +268,166 @@ def query_bm25(query:str
         ValueError: If neither index_path nor retriever are provided and default location is not found.
     """
 
-    # If given a file_list, don't load anything
-    if retriever is None:
-        if index_path is None:
-            # Search for a default location index
-            try:
-                retriever = bm25s.BM25.load("./search_utils/index_bm25", load_corpus=True, mmap=True)
-            except Exception as e:
-                raise ValueError("Either index_path or retriever must be provided.")
-
-        # Load the BM25 index
-        retriever = bm25s.BM25.load(index_path, load_corpus=True, mmap=True)
-
-    stemmer = Stemmer.Stemmer("english")
-
     ### Error checks
     num_results = 1 if num_results < 1 else num_results
+    query = preprocess(query)
+
+    cache_options = {'num_results': num_results}
+    if mask is not None:
+        cache_options['mask'] = mask_key(mask)
+    if cache is not None:
+        # The BM25 tokenizer lowercases, so case doesn't change the result
+        results = cache.get('bm25', query.lower(), **cache_options)
+        if results is not None:
+            return results
+
+    # If given a retriever, don't load anything
+    retriever = _load_bm25_retriever(index_path, retriever)
 
     # Encode the query
-    query_tokens = bm25s.tokenize(preprocess(query), stopwords='en', stemmer=stemmer)
+    query_tokens = bm25s.tokenize(query, stopwords='en', stemmer=get_stemmer())
 
-    r, s = retriever.retrieve(query_tokens, k=num_results)
+    if mask is None:
+        r, s = retriever.retrieve(query_tokens, k=num_results)
+    else:
+        # Masked chunks score 0; drop them, along with any 0-score padding of the retriever
+        r, s = retriever.retrieve(query_tokens, k=num_results, weight_mask=mask.astype(np.float32))
+        keep = mask[r[0]] & (s[0] > 0)
+        r, s = r[:, keep], s[:, keep]
 
     # normalize query scores to sum to 1
-    scores = s[0].tolist()
-    t=sum(scores)
+    results = _bm25_results(r[0], s[0])
+
+    if cache is not None:
+        cache.put('bm25', query.lower(), results, **cache_options)
+
+    return results
+
+def _rank_matches(results_list:list, num_results:int):
+    """
+    Rank chunks by match count and normalize the counts of the top chunks into scores.
+
+    Args:
+        results_list (list): (chunk ID, match count) tuples. Must not be empty.
+        num_results (int): Maximum number of top results to return.
+
+    Returns:
+        dict: Dictionary containing:
+            - 'id': List of chunk IDs (indices) for the top results
+            - 'score': List of normalized match count scores (sum to 1)
+    """
+    # Use heap to get top num_results efficiently (O(n log k) instead of O(n log n))
+    if len(results_list) <= num_results:
+        # If we have fewer results than requested, use all of them
+        top_results = sorted(results_list, key=lambda x: (-x[1], x[0]))
+    else:
+        # Use nlargest for efficient partial sorting
+        top_results = heapq.nlargest(num_results, results_list, key=lambda x: (x[1], -x[0]))
+        # Sort by score descending, then by id ascending
+        top_results = sorted(top_results, key=lambda x: (-x[1], x[0]))
+
+    # normalize query scores to sum to 1
+    scores = [r[1] for r in top_results]
+    t = sum(scores)
     scores = [x / t for x in scores]
-    
-    results = {
-        'id': r[0].tolist()
-        , 'score': scores
+
+    # Format results to match the structure of other query functions
+    return {
+        'id': [r[0] for r in top_results],
+        'score': scores
     }
 
-    return results
+# Newline-joined chunks built by _joined_corpus, kept per case_sensitive for the last chunk list searched
+_joined_corpora = {}
 
-def _count_matches_chunk(idx_chunk_tuple, pattern, is_regex):
+def _joined_corpus(texts, case_sensitive:bool):
     """
-    Count occurrences of a pattern in a single text chunk for parallel processing.
-    
-    This helper function is designed for use with multiprocessing to count matches
-    in text chunks. It handles both regex patterns and simple string matching efficiently.
-    
+    Return the chunks as one newline-separated UTF-8 buffer, as in a corpus arena, building it only once.
+
+    The buffer of the last chunk list searched is kept, so repeat multi-pattern searches without an arena
+    don't copy the corpus again. It is rebuilt whenever a different chunk list (or one of a different
+    length) is searched.
+
     Args:
-        idx_chunk_tuple (tuple): Tuple containing (chunk_index, chunk_text).
-        pattern (re.Pattern or str): Compiled regex pattern or lowercase query string for matching.
-        is_regex (bool): If True, pattern is treated as a regex; if False, uses string counting.
-    
+        texts (list): Chunk texts, e.g. chunks['processed_chunk'].
+        case_sensitive (bool): Whether to keep the texts as they are instead of lowercasing them.
+
     Returns:
-        tuple or None: Tuple of (chunk_index, match_count) if matches found, None otherwise.
+        tuple: Tuple of (uint8 numpy.ndarray buffer, chunk start offsets), as expected by AhoCorasick.count.
     """
-    idx, chunk_text = idx_chunk_tuple
-    
-    if is_regex:
-        # Use finditer for memory efficiency - only count matches
-        match_count = sum(1 for _ in pattern.finditer(chunk_text))
+    cached = _joined_corpora.get(case_sensitive)
+    if cached is not None and cached[0] is texts and cached[1] == len(texts):
+        return cached[2], cached[3]
+    encoded = [(text if case_sensitive else text.lower()).encode('utf-8') for text in texts]
+    starts = np.zeros(len(encoded) + 1, dtype=np.int64)
+    starts[1:] = np.cumsum([len(text) + 1 for text in encoded])
+    data = np.frombuffer(b'\n'.join(encoded) + b'\n', dtype=np.uint8)
+    _joined_corpora[case_sensitive] = (texts, len(texts), data, starts)
+    return data, starts
+
+def _query_terms(terms:list, chunks:dict, num_results:int, case_sensitive:bool, trigram_index = None, arena = None, mask = None):
+    """
+    Count the hits of a list of terms in every chunk in one pass, for query_direct's multi-pattern mode.
+
+    Args:
+        terms (list): Distinct, non-empty terms, preprocessed (and lowercased unless case_sensitive).
+        chunks (dict): Chunk database.
+        num_results (int): Maximum number of top results to return.
+        case_sensitive (bool): Whether the terms are matched case-sensitively.
+        trigram_index (trigram.TrigramIndex, optional): Trigram index used to skip chunks containing none
+            of the terms. Defaults to None.
+        arena (arena.CorpusArena, optional): Corpus arena to scan. Without it the chunks are joined into
+            a buffer by _joined_corpus, once per chunk list. Defaults to None.
+        mask (numpy.ndarray, optional): Boolean mask over chunk IDs; only chunks where it is True are
+            scanned. Defaults to None.
+
+    Returns:
+        dict: Dictionary containing:
+            - 'id': List of chunk IDs (indices) for the top results
+            - 'score': List of normalized total hit count scores (sum to 1)
+            - 'term_counts': List with one {term: hit count} dictionary per result
+    """
+    texts = chunks['processed_chunk']
+    num_chunks = len(texts)
+
+    # Only chunks that could contain at least one of the terms need to be scanned
+    candidates = None
+    if trigram_index is not None:
+        if trigram_index.num_chunks != num_chunks:
+            logging.warning("Trigram index does not match the chunk database, searching all chunks.")
+        else:
+            candidates = trigram_index.candidates(('or', [literal_query(term, case_sensitive) for term in terms]))
+    chunk_ids = np.arange(num_chunks) if candidates is None else np.asarray(candidates, dtype=np.int64)
+    if mask is not None:
+        chunk_ids = chunk_ids[mask[chunk_ids]]
+
+    if arena is not None and arena.num_chunks != num_chunks:
+        logging.warning("Corpus arena does not match the chunk database, copying the chunks instead.")
+        arena = None
+    if arena is not None:
+        buf, starts = (arena.text, arena.text_starts) if case_sensitive else (arena.lower, arena.lower_starts)
+        data = np.frombuffer(buf, dtype=np.uint8)
     else:
-        # Fast string counting for non-regex
-        match_count = chunk_text.count(pattern)
-    
-    if match_count > 0:
-        return (idx, match_count)
-    return None
+        data, starts = _joined_corpus(texts, case_sensitive)
 
-def query_direct(query: Union[str, re.Pattern]
+    hit_chunks, hit_terms, hit_counts = AhoCorasick(terms).count(data, starts, chunk_ids)
+    if len(hit_chunks) == 0:
+        return {'id': [], 'score': [], 'term_counts': []}
+
+    # Total hits per chunk; the hits are sorted by chunk
+    first = np.flatnonzero(np.concatenate(([True], hit_chunks[1:] != hit_chunks[:-1])))
+    totals = np.add.reduceat(hit_counts, first)
+    results = _rank_matches(list(zip(hit_chunks[first].tolist(), totals.tolist())), num_results)
+
+    # Per-term counts of the returned chunks
+    bounds = dict(zip(hit_chunks[first].tolist(), zip(first.tolist(), np.append(first[1:], len(hit_chunks)).tolist())))
+    results['term_counts'] = []
+    for idx in results['id']:
+        lo, hi = bounds[idx]
+        results['term_counts'].append({terms[t]: c for t, c in zip(hit_terms[lo:hi].tolist(), hit_counts[lo:hi].tolist())})
+    return results
+
+def query_direct(query: Union[str, re.Pattern, List[str]]
                 , chunk_db_path:str = None
                 , chunks = None
                 , num_results: int = 3
@@ -107,55 +435,123 @@ def query_direct(query: Union[str, re.Pattern]
                 , is_regex: bool = False
                 , use_parallel: bool = True
                 , max_workers: int = None
+                , cache = None
+                , trigram_index = None
+                , arena = None
+                , mask:np.ndarray = None
                 ):
     """
     Search text chunks using direct keyword matching or regular expressions with optional parallel processing.
     
     This optimized function supports both simple string matching and complex regex patterns. It uses
-    heap-based sorting for efficiency and can leverage multiprocessing for large databases with regex searches.
+    heap-based sorting for efficiency and can leverage a persistent worker pool for expensive regex searches.
     Results are ranked by match count and scores are normalized to sum to 1.
 
+    If a trigram index is given, only the chunks that contain every trigram the query requires are
+    searched. Queries the index can't narrow (e.g. literals shorter than 3 characters or patterns such
+    as '.*') fall back to searching every chunk; the results are the same either way.
+
+    If a corpus arena is given, searches that would scan most of the chunks instead scan the arena's
+    contiguous buffer once and map the matches back to chunks, which avoids lowercasing and scanning
+    every chunk separately. Regexes that can't run over the arena correctly or quickly (e.g. patterns with
+    lookarounds) are still matched chunk by chunk; the results are the same either way.
+
+    If the query is a list of terms, every chunk is scanned once with an Aho-Corasick automaton built
+    from all of them, instead of once per term. Chunks are ranked by their total hits, and each result
+    also reports the hits of every term. Each term is counted like a single-term search counts it,
+    with str.count: overlapping occurrences of one term (e.g. 'aa' in 'aaa') count once, while
+    occurrences of different terms may overlap.
+
+    If a mask is given, chunks outside it are skipped, as if the trigram index had ruled them out.
+
     Args:
-        query (str or re.Pattern): Search query string or compiled regex pattern to match in chunks.
-        chunk_db_path (str, optional): Path to the chunked database JSON file. If None and chunks is None,
-            attempts to load from default location './search_utils/chunked_db.json'.
+        query (str, re.Pattern or list): Search query string, compiled regex pattern, or list of plain
+            terms to match in chunks.
+        chunk_db_path (str, optional): Path to the chunk store (or JSON file). If None and chunks is None,
+            attempts to load from default location './search_utils/chunk_store.bin'.
         chunks (dict, optional): Pre-loaded chunks dictionary containing 'processed_chunk' and 'file_id' keys.
             If provided, chunk_db_path is ignored.
         num_results (int, optional): Maximum number of top results to return. Defaults to 3. Minimum value is 1.
         case_sensitive (bool, optional): Whether search should be case-sensitive. Defaults to False.
         is_regex (bool, optional): Whether to treat query as a regular expression. Defaults to False.
-        use_parallel (bool, optional): Enable multiprocessing for parallel search. Only used for databases
-            with >1000 chunks. Defaults to True.
+        use_parallel (bool, optional): Enable multiprocessing for regex searches that scan chunk by chunk.
+            Needs the arena, and is only used when a timed sample of the scan shows the worker pool
+            would be faster. Defaults to True.
         max_workers (int, optional): Number of parallel worker processes. Defaults to CPU count if None.
+        cache (cache.ResultCache, optional): Result cache to answer repeat queries from. Defaults to None.
+        trigram_index (trigram.TrigramIndex, optional): Trigram index of the chunk database, used to skip
+            chunks that can't match. Defaults to None.
+        arena (arena.CorpusArena, optional): Corpus arena of the chunk database, used to search all
+            chunks in one pass. Defaults to None.
+        mask (numpy.ndarray, optional): Boolean mask over chunk IDs, e.g. from filters.filter_mask; only
+            chunks where it is True are searched. Defaults to None.
 
     Returns:
         dict: Dictionary containing:
             - 'id': List of chunk IDs (indices) for the top results
             - 'score': List of normalized match count scores (sum to 1)
+            - 'term_counts': For a list of terms only, one {term: hit count} dictionary per result,
+              keyed by the preprocessed (and, unless case_sensitive, lowercased) terms
 
     Raises:
         ValueError: If neither chunk_db_path nor chunks are provided and default location is not found,
-            if chunk database structure is invalid, or if regex pattern is invalid.
+            if chunk database structure is invalid, if regex pattern is invalid, or if a list of terms
+            is combined with is_regex or has no non-empty terms.
     """
     
     ### Error checks
     num_results = 1 if num_results < 1 else num_results
+
+    # A list of terms is searched in one pass with an Aho-Corasick automaton
+    multi_pattern = isinstance(query, (list, tuple))
+    if multi_pattern:
+        if is_regex:
+            raise ValueError("Multi-pattern search takes a list of plain terms, not regular expressions.")
+        terms = [preprocess(term) if case_sensitive else preprocess(term).lower() for term in query]
+        terms = list(dict.fromkeys(term for term in terms if term))
+        if not terms:
+            raise ValueError("Multi-pattern search needs at least one non-empty term.")
+
+    if cache is not None:
+        # Normalize the query the same way it is matched below
+        if multi_pattern:
+            cache_query = json.dumps(terms)
+            cache_flags = 0
+        elif is_regex:
+            cache_query = query.pattern if isinstance(query, re.Pattern) else query
+            cache_flags = query.flags if isinstance(query, re.Pattern) else 0
+        else:
+            cache_query = preprocess(query) if case_sensitive else preprocess(query).lower()
+            cache_flags = 0
+        cache_options = {'num_results': num_results, 'case_sensitive': case_sensitive, 'is_regex': is_regex,
+                         'flags': cache_flags, 'multi_pattern': multi_pattern}
+        if mask is not None:
+            cache_options['mask'] = mask_key(mask)
+        results = cache.get('direct', cache_query, **cache_options)
+        if results is not None:
+            return results
     
     # If given a chunks db, don't load anything
     if chunks is None:
         if chunk_db_path is None:
             # Search for a default location index
             try:
-                chunks = json.load(open("./search_utils/chunked_db.json", 'rb'))
+                chunks = load_chunk_db()
             except Exception as e: 
                 raise ValueError("Either chunk_db_path or chunks must be provided.")
-
-        chunks = json.load(open(chunk_db_path, 'rb'))
+        else:
+            chunks = load_chunk_db(chunk_db_path)
     
     # Validate chunk database structure
     if 'processed_chunk' not in chunks or 'file_id' not in chunks:
         raise ValueError("Chunk database must contain 'processed_chunk' and 'file_id' keys.")
 
+    if multi_pattern:
+        results = _query_terms(terms, chunks, num_results, case_sensitive, trigram_index, arena, mask)
+        if cache is not None:
+            cache.put('direct', cache_query, results, **cache_options)
+        return results
+
     # Prepare the search pattern
     if is_regex == True:
         try:
@@ -173,81 +569,126 @@ def query_direct(query: Union[str, re.Pattern]
             # Store lowercase version of query for fast counting
             pattern = preprocess(query).lower()
     
-    # Determine if we should use parallel processing
-    # Only use parallel for large databases and regex searches
     num_chunks = len(chunks['processed_chunk'])
-    use_parallel = use_parallel and num_chunks > 1000
-    
+
+    # Narrow the search to the chunks containing every trigram the query requires
+    candidates = None
+    if trigram_index is not None:
+        if trigram_index.num_chunks != num_chunks:
+            logging.warning("Trigram index does not match the chunk database, searching all chunks.")
+        elif is_regex:
+            candidates = trigram_index.candidates(regex_query(pattern.pattern, pattern.flags))
+        else:
+            candidates = trigram_index.candidates(literal_query(pattern, case_sensitive))
+    if mask is not None:
+        # Chunks outside the mask are skipped like chunks the trigram index ruled out
+        candidates = np.flatnonzero(mask) if candidates is None else candidates[mask[candidates]]
+    chunk_ids = range(num_chunks) if candidates is None else candidates.tolist()
+
+    # Scan the whole arena in one pass unless the trigram index left only a small share of the chunks
+    arena_counts = None
+    if arena is not None and (candidates is None or len(candidates) > arena_min_candidate_fraction * num_chunks):
+        if arena.num_chunks != num_chunks:
+            logging.warning("Corpus arena does not match the chunk database, searching chunk by chunk.")
+        elif is_regex:
+            arena_counts = arena.count_regex(pattern, chunks['processed_chunk'])
+        else:
+            arena_counts = arena.count_literal(pattern, case_sensitive)
+
     # Search through chunks
     results_list = []
     
-    if use_parallel and is_regex:
-        # Parallel processing for regex searches on large databases
-        chunk_enum = list(enumerate(chunks['processed_chunk']))
-        
-        # Use ProcessPoolExecutor for CPU-bound regex operations
-        with ProcessPoolExecutor(max_workers=max_workers) as executor:
-            # Create partial function with pattern
-            search_func = partial(_count_matches_chunk, pattern=pattern, is_regex=is_regex)
-            
-            # Submit all chunks for processing
-            futures = {executor.submit(search_func, item): item for item in chunk_enum}
-            
-            # Collect results as they complete
-            for future in as_completed(futures):
-                result = future.result()
-                if result is not None:
-                    results_list.append(result)
+    if arena_counts is not None:
+        ids, counts = arena_counts
+        if mask is not None:
+            ids, counts = ids[mask[ids]], counts[mask[ids]]
+        results_list = list(zip(ids.tolist(), counts.tolist()))
+    elif is_regex:
+        # Runs on the worker pool if the arena is available and that is measured to be faster
+        results_list = scan_regex(pattern, chunks['processed_chunk'], chunk_ids, num_results,
+                                  arena=arena if use_parallel else None, max_workers=max_workers)
     else:
-        # Sequential processing for non-regex or small databases
-        for idx, chunk_text in enumerate(chunks['processed_chunk']):
-            if is_regex:
-                # Use finditer for memory efficiency - only count matches
-                match_count = sum(1 for _ in pattern.finditer(chunk_text))
+        # Sequential processing for non-regex searches
+        texts = chunks['processed_chunk']
+        for idx in chunk_ids:
+            chunk_text = texts[idx]
+            # Fast string counting for non-regex case-insensitive
+            if case_sensitive:
+                match_count = chunk_text.count(pattern)
             else:
-                # Fast string counting for non-regex case-insensitive
-                if case_sensitive:
-                    match_count = chunk_text.count(pattern)
-                else:
-                    match_count = chunk_text.lower().count(pattern)
+                match_count = chunk_text.lower().count(pattern)
             
             if match_count > 0:
                 results_list.append((idx, match_count))
     
     # If no results found, return empty structure
     if not results_list:
+        if cache is not None:
+            cache.put('direct', cache_query, {'id': [], 'score': []}, **cache_options)
         return {'id': [], 'score': []}
     
-    # Use heap to get top num_results efficiently (O(n log k) instead of O(n log n))
-    if len(results_list) <= num_results:
-        # If we have fewer results than requested, use all of them
-        top_results = sorted(results_list, key=lambda x: (-x[1], x[0]))
-    else:
-        # Use nlargest for efficient partial sorting
-        top_results = heapq.nlargest(num_results, results_list, key=lambda x: (x[1], -x[0]))
-        # Sort by score descending, then by id ascending
-        top_results = sorted(top_results, key=lambda x: (-x[1], x[0]))
-
-    # normalize query scores to sum to 1
-    scores = [r[1] for r in top_results]
-    t = sum(scores)
-    scores = [x / t for x in scores]
+    results = _rank_matches(results_list, num_results)
 
-    # Format results to match the structure of other query functions
-    results = {
-        'id': [r[0] for r in top_results],
-        'score': scores
-    }
+    if cache is not None:
+        cache.put('direct', cache_query, results, **cache_options)
 
     return results
 
+def _mmr(query_vec:np.ndarray, ids:np.ndarray, vectors:np.ndarray, num_results:int, mmr_lambda:float):
+    """
+    Pick a diverse subset of candidates by Maximal Marginal Relevance.
+
+    Each step picks the candidate with the highest mmr_lambda * (similarity to the query) minus
+    (1 - mmr_lambda) * (highest similarity to an already picked candidate). All pairwise similarities
+    come from one matrix product of the normalized candidate vectors.
+
+    Args:
+        query_vec (numpy.ndarray): Query vector.
+        ids (numpy.ndarray): Chunk IDs of the candidates.
+        vectors (numpy.ndarray): Embeddings of every chunk, indexed by chunk ID.
+        num_results (int): Number of candidates to pick.
+        mmr_lambda (float): Weight of relevance against diversity, from 0 (only diversity) to 1 (only relevance).
+
+    Returns:
+        tuple: Tuple of (picked chunk IDs, their cosine distances to the query), in the order they were picked.
+    """
+    # Sorted IDs read a memory-mapped matrix front to back
+    ids = np.sort(ids)
+    cand = np.asarray(vectors[ids], dtype=np.float32)
+    norms = np.linalg.norm(cand, axis=1, keepdims=True)
+    norms[norms == 0] = 1
+    cand = cand / norms
+    query_vec = np.asarray(query_vec, dtype=np.float32).ravel()
+    query_vec = query_vec / (np.linalg.norm(query_vec) or 1)
+
+    relevance = cand @ query_vec
+    pairwise = cand @ cand.T
+    max_sim = np.full(len(ids), -np.inf)
+    available = np.ones(len(ids), dtype=bool)
+    picked = []
+    for _ in range(min(num_results, len(ids))):
+        # Nothing is picked yet in the first step, so it takes the most relevant candidate
+        mmr = mmr_lambda * relevance - (1 - mmr_lambda) * (max_sim if picked else 0)
+        mmr[~available] = -np.inf
+        pick = int(np.argmax(mmr))
+        picked.append(pick)
+        available[pick] = False
+        max_sim = np.maximum(max_sim, pairwise[pick])
+    picked = np.array(picked, dtype=np.int64)
+    return ids[picked], 1 - relevance[picked]
+
 def query_nn(
         query:str, 
-        index:pynndescent.pynndescent_.NNDescent = None,
+        index:Union[IncrementalIndex, pynndescent.pynndescent_.NNDescent, ExactIndex] = None,
         index_path:str = None,
-        model_name:str = "minishlab/potion-retrieval-32M",
+        model_name:str = default_model_name,
         num_results:int = 3,
-        query_epsilon:float = 0.1
+        query_epsilon:float = 0.1,
+        cache = None,
+        mmr_lambda:float = None,
+        mmr_candidates:int = None,
+        embeddings:np.ndarray = None,
+        mask:np.ndarray = None
     ):
     """
     Perform semantic similarity search using Approximate Nearest Neighbor (ANN) index.
@@ -256,71 +697,568 @@ def query_nn(
     most semantically similar chunks using cosine distance. The query is preprocessed before encoding.
     Scores are inverted (since lower distance is better) and normalized to sum to 1.
 
+    The model is loaded once per process and kept resident (see models.get_model), and query vectors
+    are cached by their preprocessed text, so a repeated query only pays for the index lookup.
+
+    With an incremental.IncrementalIndex, rows of chunks deleted or changed since the last full build are
+    tombstones and are filtered out of the results, and rows added since are searched along with the rest.
+
+    With mmr_lambda set, results are diversified by Maximal Marginal Relevance: mmr_candidates chunks are
+    taken from the index and num_results of them picked one at a time, trading similarity to the query
+    against similarity to the chunks already picked, which skips near-duplicates such as overlapping
+    neighbouring chunks. The candidates' similarities come from the stored chunk embeddings
+    (see embeddings.embed_chunks).
+
+    If a mask is given, chunks outside it are treated like tombstones: an exact index scores only the
+    chunks inside it, and an NNDescent index is asked for more neighbors until enough of them pass.
+
     Args:
         query (str): The search query string to find semantically similar documents.
-        index (pynndescent.NNDescent, optional): Pre-loaded nearest neighbor index. If provided, index_path is ignored.
-        index_path (str, optional): Path to the pickled NN index file. If None and index is None,
-            attempts to load from default location './search_utils/nn_database.pkl'.
+        index (incremental.IncrementalIndex, exact.ExactIndex or pynndescent.NNDescent, optional): Pre-loaded
+            nearest neighbor index. If provided, index_path is ignored.
+        index_path (str, optional): Path to the saved index (.npy for an exact index, otherwise a pickled
+            NN index file). If None and index is None, attempts to load from the default locations in
+            './search_utils'.
         model_name (str, optional): Name of the Model2Vec embedding model to use. Must match the model
             used during index creation. Defaults to "minishlab/potion-retrieval-32M".
         num_results (int, optional): Maximum number of top results to return. Defaults to 3. Minimum value is 1.
         query_epsilon (float, optional): Search accuracy parameter for ANN algorithm. Lower values are more accurate
             but slower. Defaults to 0.1. Minimum value is 0.01.
+        cache (cache.ResultCache, optional): Result cache to answer repeat queries from. Defaults to None.
+        mmr_lambda (float, optional): Weight of relevance against diversity for Maximal Marginal Relevance,
+            from 0 (only diversity) to 1 (only relevance). Defaults to None, which returns the nearest chunks.
+        mmr_candidates (int, optional): Number of candidates taken from the index for Maximal Marginal
+            Relevance. Defaults to 4 * num_results. Never less than num_results.
+        embeddings (numpy.ndarray, optional): Stored chunk embeddings, indexed by chunk ID, used for Maximal
+            Marginal Relevance. Defaults to the embeddings stored in './search_utils', which must line up
+            with the chunks of an incremental.IncrementalIndex.
+        mask (numpy.ndarray, optional): Boolean mask over chunk IDs, e.g. from filters.filter_mask; only
+            chunks where it is True are returned. Defaults to None.
 
     Returns:
         dict: Dictionary containing:
-            - 'id': List of chunk IDs (indices) for the most similar results
+            - 'id': List of chunk IDs (indices) for the most similar results, in the order picked when
+              mmr_lambda is set
             - 'score': List of normalized inverted distance scores (sum to 1, higher is more similar)
 
     Raises:
-        ValueError: If neither index_path nor index are provided and default location is not found.
+        ValueError: If neither index_path nor index are provided and default location is not found, if
+            mmr_lambda is not between 0 and 1, or if mmr_lambda is set and there are no stored embeddings
+            of model_name that line up with the index.
         
     Note:
-        Model configuration (normalize, dimensionality, quantize_to) must match the settings used
+        Model configuration (models.default_model_options) must match the settings used
         during index creation for consistent results.
     """
 
-    # If given a file_list, don't load anything
-    if index is None:
-        if index_path is None:
-            # Search for a default location index
-            try:
-                index = pickle.load(open("./search_utils/nn_database.pkl", 'rb'))
-            except Exception as e:
-                raise ValueError("Either index_path or index must be provided.")
-
-        # Load the NN index
-        index = pickle.load(open(index_path, 'rb'))
-
     ### Error checks
     num_results = 1 if num_results < 1 else num_results
     query_epsilon = 0.01 if query_epsilon < 0.01 else query_epsilon
+    if mmr_lambda is not None and not 0 <= mmr_lambda <= 1:
+        raise ValueError(f"mmr_lambda must be between 0 and 1, not {mmr_lambda}.")
+    mmr_candidates = 4 * num_results if mmr_candidates is None else max(mmr_candidates, num_results)
+    query = preprocess(query)
+    cache_options = {'num_results': num_results, 'query_epsilon': query_epsilon, 'model_name': model_name}
+    if mmr_lambda is not None:
+        cache_options.update({'mmr_lambda': mmr_lambda, 'mmr_candidates': mmr_candidates})
+    if mask is not None:
+        cache_options['mask'] = mask_key(mask)
 
-    # Define the model. USE SAME OPTIONS AS IN create_ann_index.py
-    model = StaticModel.from_pretrained(
-        model_name,
-        normalize=True,
-        dimensionality=256,
-        quantize_to="float16",
-        force_download=False
-        ) # make sure these options work with your chosen model
-    
-    # Encode the query
-    query_vec = model.encode(preprocess(query), max_length=None)
+    if cache is not None:
+        results = cache.get('nn', query, **cache_options)
+        if results is not None:
+            return results
+
+    # If given an index, don't load anything
+    index = _load_nn_index(index_path, index)
+    if mask is not None and not isinstance(index, IncrementalIndex):
+        # Masked search skips rows the same way as tombstones
+        index = IncrementalIndex(index)
+
+    # Encode the query with the resident model. Uses the same options as create_ann_index
+    query_vec = encode_query(query, model_name)
+    query_options = {} if mask is None else {'mask': mask}
     id, score = index.query(query_vec.reshape(1,-1)
-                          , k = num_results
-                          , epsilon = query_epsilon)
+                          , k = num_results if mmr_lambda is None else mmr_candidates
+                          , epsilon = query_epsilon
+                          , **query_options)
+
+    if mmr_lambda is not None:
+        if embeddings is None:
+            # Check the stored rows against the chunks the index holds, so stale embeddings are never used
+            keys = index.keys_by_chunk() if isinstance(index, IncrementalIndex) else None
+            embeddings, _ = load_embeddings('./search_utils', model_name, keys=keys)
+        id, score = _mmr(query_vec, id[0], embeddings, num_results, mmr_lambda)
+        id, score = id[None], score[None]
     
     # normalize query scores to sum to 1
-    scores = score.flatten().tolist()
-    # NOTE: scores are distances, so lower is better
-    inv_scores = [1 - s for s in scores]  # Invert scores for normalization. This works for cosine distance, but confirm if using a different metric.
-    t=sum(inv_scores)
-    inv_scores = [x / t for x in inv_scores]
+    results = _nn_results(id[0], score[0])
 
-    results = {
-        'id': id.flatten().tolist()
-        , 'score': inv_scores
-    }
+    if cache is not None:
+        cache.put('nn', query, results, **cache_options)
 
     return(results)
+
+def _fuse_results(result_lists:list, fusion:str, weights:list, rrf_k:int, num_results:int):
+    """
+    Merge ranked result lists into one, deduplicating by chunk ID.
+
+    Args:
+        result_lists (list): Results dictionaries with 'id' and 'score', each ranked best first.
+        fusion (str): 'rrf' for reciprocal rank fusion or 'weighted' for weighted score fusion.
+        weights (list): One weight per result list.
+        rrf_k (int): Rank offset of reciprocal rank fusion.
+        num_results (int): Maximum number of top results to return.
+
+    Returns:
+        dict: Dictionary with 'id' and 'score' lists, scores normalized to sum to 1.
+    """
+    fused = {}
+    for results, weight in zip(result_lists, weights):
+        for rank, (idx, score) in enumerate(zip(results['id'], results['score']), start=1):
+            contribution = 1.0 / (rrf_k + rank) if fusion == 'rrf' else score
+            fused[idx] = fused.get(idx, 0.0) + weight * contribution
+
+    top_results = heapq.nsmallest(num_results, fused.items(), key=lambda x: (-x[1], x[0]))
+    t = sum(score for _, score in top_results)
+    return {
+        'id': [idx for idx, _ in top_results],
+        'score': [score / t if t > 0 else score for _, score in top_results]
+    }
+
+def query_hybrid(
+        query:str,
+        retriever = None,
+        bm25_index_path:str = None,
+        index:Union[IncrementalIndex, pynndescent.pynndescent_.NNDescent, ExactIndex] = None,
+        nn_index_path:str = None,
+        model_name:str = default_model_name,
+        num_results:int = 3,
+        num_candidates:int = None,
+        fusion:str = 'rrf',
+        weights:tuple = (0.5, 0.5),
+        rrf_k:int = 60,
+        query_epsilon:float = 0.1,
+        cache = None,
+        mask:np.ndarray = None
+    ):
+    """
+    Search with BM25 and the ANN index at the same time and fuse the two rankings into one.
+
+    Both retrievals run concurrently in a thread pool, so the latency is close to that of the slower
+    one rather than their sum. Each returns num_candidates chunks, and chunks found by both count once.
+    With reciprocal rank fusion ('rrf') a chunk scores weight / (rrf_k + rank) in each ranking it
+    appears in, which needs no score calibration between the backends. With weighted score fusion
+    ('weighted') the normalized scores of the two backends are combined with the weights instead.
+    BM25 results with a score of 0 (the query shares no terms with them) are left out.
+
+    Args:
+        query (str): The search query string.
+        retriever (bm25s.BM25 or segments.SegmentedBM25, optional): Pre-loaded BM25 retriever object.
+            If provided, bm25_index_path is ignored.
+        bm25_index_path (str, optional): Path to the BM25 index directory. If None and retriever is None,
+            attempts to load from the default locations in './search_utils'.
+        index (incremental.IncrementalIndex, exact.ExactIndex or pynndescent.NNDescent, optional): Pre-loaded
+            nearest neighbor index. If provided, nn_index_path is ignored.
+        nn_index_path (str, optional): Path to the saved index (.npy for an exact index, otherwise a pickled
+            NN index file). If None and index is None, attempts to load from the default locations in
+            './search_utils'.
+        model_name (str, optional): Name of the Model2Vec embedding model. Must match the model used during
+            index creation. Defaults to "minishlab/potion-retrieval-32M".
+        num_results (int, optional): Maximum number of top results to return. Defaults to 3. Minimum value is 1.
+        num_candidates (int, optional): Number of results taken from each backend before fusion. Defaults
+            to 5 * num_results. Never less than num_results, and never more than the number of chunks.
+        fusion (str, optional): 'rrf' for reciprocal rank fusion or 'weighted' for weighted score fusion.
+            Defaults to 'rrf'.
+        weights (tuple, optional): Weights of the (BM25, ANN) rankings. Defaults to (0.5, 0.5).
+        rrf_k (int, optional): Rank offset of reciprocal rank fusion; larger values flatten the
+            advantage of top ranks. Defaults to 60.
+        query_epsilon (float, optional): Search accuracy parameter for the ANN search. Defaults to 0.1.
+        cache (cache.ResultCache, optional): Result cache to answer repeat queries from. Defaults to None.
+        mask (numpy.ndarray, optional): Boolean mask over chunk IDs, e.g. from filters.filter_mask, passed
+            to both searches. Defaults to None.
+
+    Returns:
+        dict: Dictionary containing:
+            - 'id': List of chunk IDs (indices) for the top results
+            - 'score': List of normalized fused scores (sum to 1)
+
+    Raises:
+        ValueError: If fusion is not 'rrf' or 'weighted', if weights doesn't have two entries, or if an
+            index is not provided and not found in its default location.
+    """
+
+    ### Error checks
+    if fusion not in ('rrf', 'weighted'):
+        raise ValueError(f"Unknown fusion method: {fusion}. Use 'rrf' or 'weighted'.")
+    if len(weights) != 2:
+        raise ValueError("weights must hold one weight for BM25 and one for the ANN index.")
+    num_results = 1 if num_results < 1 else num_results
+    num_candidates = 5 * num_results if num_candidates is None else max(num_candidates, num_results)
+    cache_options = {'num_results': num_results, 'num_candidates': num_candidates, 'fusion': fusion,
+                     'weights': list(weights), 'rrf_k': rrf_k, 'query_epsilon': query_epsilon, 'model_name': model_name}
+    if mask is not None:
+        cache_options['mask'] = mask_key(mask)
+
+    if cache is not None:
+        results = cache.get('hybrid', preprocess(query), **cache_options)
+        if results is not None:
+            return results
+
+    # Load the indexes here, so a missing index raises before any search starts
+    retriever = _load_bm25_retriever(bm25_index_path, retriever)
+    index = _load_nn_index(nn_index_path, index)
+    # Both indexes hold the same chunks, and neither can return more than it holds
+    num_candidates = min(num_candidates, _bm25_num_docs(retriever))
+
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        bm25_future = executor.submit(query_bm25, query, retriever=retriever, num_results=num_candidates, mask=mask)
+        nn_future = executor.submit(query_nn, query, index=index, model_name=model_name,
+                                    num_results=num_candidates, query_epsilon=query_epsilon, mask=mask)
+        bm25_results, nn_results = bm25_future.result(), nn_future.result()
+
+    # Chunks that share no terms with the query have no BM25 rank worth counting
+    keep = [i for i, score in enumerate(bm25_results['score']) if score > 0]
+    bm25_results = {key: [values[i] for i in keep] for key, values in bm25_results.items()}
+
+    results = _fuse_results([bm25_results, nn_results], fusion, weights, rrf_k, num_results)
+
+    if cache is not None:
+        cache.put('hybrid', preprocess(query), results, **cache_options)
+
+    return results
+
+def query_files(
+        query,
+        chunks:dict,
+        search:str = 'bm25',
+        num_files:int = 3,
+        aggregation:str = 'max',
+        top_m:int = 3,
+        num_candidates:int = None,
+        **search_options
+    ):
+    """
+    Retrieve the top files instead of the top chunks, with the best chunk of each file as its snippet.
+
+    The chunk search is asked for a larger candidate set, num_candidates chunks, and the candidates'
+    scores are combined per file through a compact chunk-to-file code array (see filelevel). If the
+    candidates come from fewer than num_files files, the search is repeated with more candidates,
+    up to every chunk.
+
+    Args:
+        query (str, re.Pattern or list): The search query, as accepted by the chosen search.
+        chunks (dict): The chunk database dictionary with 'processed_chunk' and 'file_id' keys.
+        search (str, optional): 'bm25', 'direct', 'nn' or 'hybrid', for query_bm25, query_direct,
+            query_nn or query_hybrid. Defaults to 'bm25'.
+        num_files (int, optional): Maximum number of files to return. Defaults to 3. Minimum value is 1.
+        aggregation (str, optional): 'max', 'sum' or 'mean' (of each file's top_m chunk scores) to combine
+            chunk scores into file scores. Defaults to 'max'.
+        top_m (int, optional): Number of chunks per file averaged by the 'mean' aggregation. Defaults to 3.
+        num_candidates (int, optional): Number of chunks first taken from the search. Defaults to
+            filelevel.file_candidate_factor * num_files.
+        **search_options: Other arguments of the chosen search function, e.g. retriever, index,
+            case_sensitive, is_regex, trigram_index, arena or cache.
+
+    Returns:
+        dict: Dictionary containing:
+            - 'id': List of chunk IDs of the best chunk of each file, usable with convert_results
+            - 'score': List of normalized file scores (sum to 1)
+            - 'file_id': List of file IDs of the top files
+
+    Raises:
+        ValueError: If search or aggregation is unknown, or if the chosen search raises it.
+    """
+    searches = {'bm25': query_bm25, 'direct': query_direct, 'nn': query_nn, 'hybrid': query_hybrid}
+    if search not in searches:
+        raise ValueError(f"Unknown search: {search}. Use 'bm25', 'direct', 'nn' or 'hybrid'.")
+    if aggregation not in file_aggregations:
+        raise ValueError(f"Unknown aggregation: {aggregation}. Use 'max', 'sum' or 'mean'.")
+    num_files = 1 if num_files < 1 else num_files
+    num_chunks = len(chunks['processed_chunk'])
+    num_candidates = file_candidate_factor * num_files if num_candidates is None else max(num_candidates, num_files)
+    if search == 'direct':
+        search_options['chunks'] = chunks
+    codes, file_ids = chunk_file_codes(chunks)
+
+    while True:
+        num_candidates = min(num_candidates, num_chunks)
+        results = searches[search](query, num_results=num_candidates, **search_options)
+        ids = np.asarray(results['id'], dtype=np.int64)
+        scores = np.asarray(results['score'], dtype=np.float64)
+        if search == 'bm25':
+            # BM25 pads with chunks that share no terms with the query
+            ids, scores = ids[scores > 0], scores[scores > 0]
+        # Fewer matching chunks than asked for means there are no more to find
+        exhausted = len(ids) < num_candidates or num_candidates == num_chunks
+        if exhausted or len(np.unique(codes[ids])) >= num_files:
+            break
+        num_candidates *= file_candidate_growth
+
+    files, file_scores, best_chunks = aggregate_by_file(ids, scores, codes, num_files, aggregation, top_m)
+    t = file_scores.sum()
+    file_scores = file_scores / t if t > 0 else file_scores
+    return {'id': best_chunks.tolist(), 'score': file_scores.tolist(), 'file_id': [file_ids[c] for c in files.tolist()]}
+
+def query_filenames(query:str
+            , index_path:str = None
+            , index = None
+            , num_results:int = 3
+            , cache = None
+            ):
+    """
+    Find files by name, searching only file names, folders and extensions.
+
+    The query is preprocessed like the filenames and split into tokens, which are looked up in the
+    filename prefix index (see filenames.FilenameIndex.search): a token matches indexed tokens equal
+    to it or starting with it, and matches in the filename count more than matches in the folders.
+    Scores are normalized to sum to 1.
+
+    Args:
+        query (str): The search query, e.g. part of a file or folder name.
+        index_path (str, optional): Path to the filename index directory. If None and index is None,
+            attempts to load from default location './search_utils/index_filenames'.
+        index (filenames.FilenameIndex, optional): Pre-loaded filename index. If provided, index_path is ignored.
+        num_results (int, optional): Maximum number of files to return. Defaults to 3. Minimum value is 1.
+        cache (cache.ResultCache, optional): Result cache to answer repeat queries from. Defaults to None.
+
+    Returns:
+        dict: Dictionary containing:
+            - 'file_id': List of file IDs of the top files
+            - 'score': List of normalized scores (sum to 1)
+
+    Raises:
+        ValueError: If neither index_path nor index are provided and default location is not found.
+    """
+
+    ### Error checks
+    num_results = 1 if num_results < 1 else num_results
+    query = preprocess(query)
+
+    if cache is not None:
+        # The filename tokens are lowercased, so case doesn't change the result
+        results = cache.get('filenames', query.lower(), num_results=num_results)
+        if results is not None:
+            return results
+
+    # If given an index, don't load anything
+    index = _load_filename_index(index_path, index)
+
+    files, scores = index.search(query, num_results)
+    t = scores.sum()
+    scores = scores / t if t > 0 else scores
+    results = {'file_id': index.file_ids[files].tolist(), 'score': scores.tolist()}
+
+    if cache is not None:
+        cache.put('filenames', query.lower(), results, num_results=num_results)
+
+    return results
+
+def query_with_filename_boost(
+        query,
+        chunks:dict,
+        search:str = 'bm25',
+        filename_index = None,
+        boost:float = filename_boost,
+        num_results:int = 3,
+        num_candidates:int = None,
+        **search_options
+    ):
+    """
+    Run a chunk search and boost the chunks of files whose name or path matches the query.
+
+    The chunk search is asked for num_candidates chunks. Each candidate's score, relative to the best
+    candidate, is blended with the filename match score of its file, relative to the best matching file
+    (see query_filenames): (1 - boost) * chunk score + boost * filename score. The candidates are then
+    re-ranked, so a chunk from a file named after the query can overtake a slightly better chunk from an
+    unrelated file. Chunks that aren't among the candidates are never added.
+
+    Args:
+        query (str, re.Pattern or list): The search query, as accepted by the chosen search. Only a string
+            query is matched against filenames; other queries are not boosted.
+        chunks (dict): The chunk database dictionary with 'processed_chunk' and 'file_id' keys.
+        search (str, optional): 'bm25', 'direct', 'nn' or 'hybrid', for query_bm25, query_direct,
+            query_nn or query_hybrid. Defaults to 'bm25'.
+        filename_index (filenames.FilenameIndex, optional): Pre-loaded filename index. Defaults to the
+            index in './search_utils/index_filenames'.
+        boost (float, optional): Share of the blended score that comes from the filename match, from 0
+            (no boost) to 1 (filename only). Defaults to filenames.filename_boost.
+        num_results (int, optional): Maximum number of top results to return. Defaults to 3. Minimum value is 1.
+        num_candidates (int, optional): Number of chunks taken from the search before re-ranking.
+            Defaults to 5 * num_results. Never less than num_results.
+        **search_options: Other arguments of the chosen search function, e.g. retriever, index,
+            case_sensitive, is_regex, trigram_index, arena, mask or cache.
+
+    Returns:
+        dict: Dictionary containing:
+            - 'id': List of chunk IDs (indices) for the top results
+            - 'score': List of normalized blended scores (sum to 1)
+            - Any other per-result lists of the chosen search, e.g. query_direct's 'term_counts'
+
+    Raises:
+        ValueError: If search is unknown, if boost is not between 0 and 1, if no filename index is given
+            or found, or if the chosen search raises it.
+    """
+    searches = {'bm25': query_bm25, 'direct': query_direct, 'nn': query_nn, 'hybrid': query_hybrid}
+    if search not in searches:
+        raise ValueError(f"Unknown search: {search}. Use 'bm25', 'direct', 'nn' or 'hybrid'.")
+    if not 0 <= boost <= 1:
+        raise ValueError(f"boost must be between 0 and 1, not {boost}.")
+    num_results = 1 if num_results < 1 else num_results
+    num_candidates = 5 * num_results if num_candidates is None else max(num_candidates, num_results)
+    num_candidates = min(num_candidates, len(chunks['processed_chunk']))
+    if search == 'direct':
+        search_options['chunks'] = chunks
+    filename_index = _load_filename_index(index=filename_index)
+
+    results = searches[search](query, num_results=num_candidates, **search_options)
+    ids = np.asarray(results['id'], dtype=np.int64)
+    scores = np.asarray(results['score'], dtype=np.float64)
+    if len(ids) == 0:
+        return results
+
+    # Filename match of each candidate's file, relative to the best matching file
+    files, file_scores = filename_index.search(preprocess(query)) if isinstance(query, str) else ([], [])
+    file_match = {}
+    if len(files):
+        file_match = dict(zip(filename_index.file_ids[files].tolist(), (file_scores / file_scores.max()).tolist()))
+    matches = np.array([file_match.get(chunks['file_id'][i], 0.0) for i in ids.tolist()])
+
+    best = scores.max()
+    blended = (1 - boost) * (scores / best if best > 0 else scores) + boost * matches
+    order = np.lexsort((ids, -blended))[:num_results]
+    t = blended[order].sum()
+    boosted = {'id': ids[order].tolist(), 'score': (blended[order] / t if t > 0 else blended[order]).tolist()}
+    # Keep any other per-result lists of the search, e.g. query_direct's term_counts
+    boosted.update({key: [values[i] for i in order.tolist()] for key, values in results.items() if key not in boosted})
+    return boosted
+
+def query_bm25_batch(queries:List[str]
+            , index_path:str = None
+            , retriever = None
+            , num_results:int = 3
+            , cache = None
+            , show_progress:bool = True
+            ):
+    """
+    Retrieve the top-k most relevant text chunks for many queries at once using BM25.
+
+    Same as calling query_bm25 for each query, but all queries are tokenized together with one shared
+    stemmer and scored with sparse matrix products over blocks of queries (see _bm25_top_k), which is
+    much faster for large query sets. Results can differ from query_bm25 only in the order of chunks
+    with tied scores.
+
+    Args:
+        queries (List[str]): The search query strings.
+        index_path (str, optional): Path to the BM25 index directory. If None and retriever is None,
+            attempts to load from the default locations in './search_utils'.
+        retriever (bm25s.BM25 or segments.SegmentedBM25, optional): Pre-loaded BM25 retriever object.
+            If provided, index_path is ignored.
+        num_results (int, optional): Maximum number of top results to return per query. Defaults to 3.
+            Minimum value is 1.
+        cache (cache.ResultCache, optional): Result cache to answer repeat queries from. Defaults to None.
+        show_progress (bool, optional): Show tokenization and scoring progress bars. Defaults to True.
+
+    Returns:
+        list: One dictionary per query, in input order, each containing:
+            - 'id': List of chunk IDs (indices) for the top results
+            - 'score': List of normalized relevance scores (sum to 1)
+
+    Raises:
+        ValueError: If neither index_path nor retriever are provided and default location is not found.
+    """
+
+    ### Error checks
+    num_results = 1 if num_results < 1 else num_results
+    queries = [preprocess(query) for query in queries]
+
+    results = [None] * len(queries)
+    if cache is not None:
+        results = [cache.get('bm25', query.lower(), num_results=num_results) for query in queries]
+    todo = [i for i, r in enumerate(results) if r is None]
+    if not todo:
+        return results
+
+    # If given a retriever, don't load anything
+    retriever = _load_bm25_retriever(index_path, retriever)
+
+    # Encode all queries together and score them in one call
+    query_tokens = bm25s.tokenize([queries[i] for i in todo], stopwords='en', stemmer=get_stemmer(), show_progress=show_progress)
+    if isinstance(retriever, SegmentedBM25):
+        # Segments have no single score matrix; they are scored with corpus-wide statistics instead
+        r, s = retriever.retrieve(query_tokens, k=num_results)
+    else:
+        r, s = _bm25_top_k(retriever, query_tokens, k=num_results, show_progress=show_progress)
+
+    for row, i in enumerate(todo):
+        results[i] = _bm25_results(r[row], s[row])
+        if cache is not None:
+            cache.put('bm25', queries[i].lower(), results[i], num_results=num_results)
+
+    return results
+
+def query_nn_batch(
+        queries:List[str],
+        index:Union[IncrementalIndex, pynndescent.pynndescent_.NNDescent, ExactIndex] = None,
+        index_path:str = None,
+        model_name:str = default_model_name,
+        num_results:int = 3,
+        query_epsilon:float = 0.1,
+        cache = None
+    ):
+    """
+    Perform semantic similarity search for many queries at once using the ANN index.
+
+    Same as calling query_nn for each query, but the queries are encoded in one model call and the
+    whole query matrix is searched with a single index.query call.
+
+    Args:
+        queries (List[str]): The search query strings.
+        index (incremental.IncrementalIndex, exact.ExactIndex or pynndescent.NNDescent, optional): Pre-loaded
+            nearest neighbor index. If provided, index_path is ignored.
+        index_path (str, optional): Path to the saved index (.npy for an exact index, otherwise a pickled
+            NN index file). If None and index is None, attempts to load from the default locations in
+            './search_utils'.
+        model_name (str, optional): Name of the Model2Vec embedding model to use. Must match the model
+            used during index creation. Defaults to "minishlab/potion-retrieval-32M".
+        num_results (int, optional): Maximum number of top results to return per query. Defaults to 3.
+            Minimum value is 1.
+        query_epsilon (float, optional): Search accuracy parameter for ANN algorithm. Lower values are more accurate
+            but slower. Defaults to 0.1. Minimum value is 0.01.
+        cache (cache.ResultCache, optional): Result cache to answer repeat queries from. Defaults to None.
+
+    Returns:
+        list: One dictionary per query, in input order, each containing:
+            - 'id': List of chunk IDs (indices) for the most similar results
+            - 'score': List of normalized inverted distance scores (sum to 1, higher is more similar)
+
+    Raises:
+        ValueError: If neither index_path nor index are provided and default location is not found.
+    """
+
+    ### Error checks
+    num_results = 1 if num_results < 1 else num_results
+    query_epsilon = 0.01 if query_epsilon < 0.01 else query_epsilon
+    queries = [preprocess(query) for query in queries]
+    cache_options = {'num_results': num_results, 'query_epsilon': query_epsilon, 'model_name': model_name}
+
+    results = [None] * len(queries)
+    if cache is not None:
+        results = [cache.get('nn', query, **cache_options) for query in queries]
+    todo = [i for i, r in enumerate(results) if r is None]
+    if not todo:
+        return results
+
+    # If given an index, don't load anything
+    index = _load_nn_index(index_path, index)
+
+    # Encode all queries together and search the whole query matrix at once
+    query_vecs = encode_queries([queries[i] for i in todo], model_name)
+    ids, scores = index.query(query_vecs, k = num_results, epsilon = query_epsilon)
+
+    for row, i in enumerate(todo):
+        results[i] = _nn_results(ids[row], scores[row])
+        if cache is not None:
+            cache.put('nn', queries[i], results[i], **cache_options)
+
+    return results
@@ -0,0 +1,290 @@
+import os
+import re
+import logging
+from typing import List
+from concurrent.futures import ThreadPoolExecutor, wait, FIRST_COMPLETED
+
+#### Define constants/defaults for various functions below
+# Directories that are never worth indexing. Uses .gitignore syntax.
+default_ignore_patterns = [
+    'search_utils/',
+    '.git/',
+    '.hg/',
+    '.svn/',
+    '.venv/',
+    'venv/',
+    'node_modules/',
+    '__pycache__/',
+    '.ipynb_checkpoints/',
+]
+
+# Optional file in the scanned root with extra ignore patterns, in .gitignore syntax
+ignore_filename = '.searchignore'
+
+def _glob_to_regex(pattern:str):
+    """
+    Translate a .gitignore-style glob into a regular expression string.
+
+    '*' and '?' do not match '/', '**' matches across directories, and '[...]' is a character class.
+
+    Args:
+        pattern (str): Glob pattern without leading '!' or trailing '/'.
+
+    Returns:
+        str: Regular expression matching the same paths.
+    """
+    out = []
+    i = 0
+    while i < len(pattern):
+        c = pattern[i]
+        if c == '*':
+            if pattern[i:i+2] == '**':
+                if pattern[i+2:i+3] == '/':
+                    # '**/' matches zero or more leading directories
+                    out.append('(?:.*/)?')
+                    i += 3
+                else:
+                    out.append('.*')
+                    i += 2
+                continue
+            out.append('[^/]*')
+        elif c == '?':
+            out.append('[^/]')
+        elif c == '[':
+            end = pattern.find(']', i + 2)
+            if end == -1:
+                out.append(re.escape(c))
+            else:
+                body = pattern[i+1:end]
+                if body.startswith('!'):
+                    body = '^' + body[1:]
+                out.append('[' + body.replace('\\', '\\\\') + ']')
+                i = end
+        elif c == '\\' and i + 1 < len(pattern):
+            out.append(re.escape(pattern[i+1]))
+            i += 1
+        else:
+            out.append(re.escape(c))
+        i += 1
+    return ''.join(out)
+
+def setup_scan_rules(ignore_patterns:List[str] = None, include_patterns:List[str] = None):
+    """
+    Compile .gitignore-style exclude rules and optional include rules into a single matcher function.
+
+    Exclude rules follow .gitignore syntax: blank lines and lines starting with '#' are skipped, a leading
+    '!' re-includes a path excluded by an earlier rule, a trailing '/' only matches directories, and a
+    pattern containing a '/' is anchored to the scanned root while other patterns match at any depth.
+    The last matching rule wins. If include patterns are given, a file must also match at least one of
+    them; include patterns are only applied to files, never to directories.
+
+    Patterns are compiled once, so the returned function only runs precompiled regular expressions.
+
+    Args:
+        ignore_patterns (List[str], optional): Exclude rules in .gitignore syntax.
+        include_patterns (List[str], optional): Glob patterns a file must match to be kept.
+
+    Returns:
+        function: A matcher with signature is_excluded(rel_path, is_dir) -> bool, where rel_path is the
+            '/'-separated path relative to the scanned root. Returns None if there are no rules at all.
+    """
+    rules = []
+    for line in ignore_patterns or []:
+        pattern = line.strip()
+        if not pattern or pattern.startswith('#'):
+            continue
+        negate = pattern.startswith('!')
+        if negate:
+            pattern = pattern[1:]
+        dir_only = pattern.endswith('/')
+        pattern = pattern.rstrip('/')
+        # A separator at the start or in the middle anchors the pattern; a trailing one does not
+        anchored = '/' in pattern
+        regex = _glob_to_regex(pattern.lstrip('/'))
+        if not anchored:
+            regex = '(?:.*/)?' + regex
+        rules.append((regex, negate, dir_only))
+
+    include = None
+    if include_patterns:
+        include = re.compile('|'.join(
+            f"(?:{'' if '/' in p.rstrip('/') else '(?:.*/)?'}{_glob_to_regex(p.strip('/'))})"
+            for p in include_patterns
+        ))
+
+    if not rules and include is None:
+        return None
+
+    if not any(negate for _, negate, _ in rules):
+        # No re-includes, so order does not matter: one combined regex each for directories and files
+        dir_regex = re.compile('|'.join(f'(?:{r})' for r, _, _ in rules)) if rules else None
+        file_rules = [r for r, _, dir_only in rules if not dir_only]
+        file_regex = re.compile('|'.join(f'(?:{r})' for r in file_rules)) if file_rules else None
+
+        def is_excluded(rel_path, is_dir):
+            if is_dir:
+                return dir_regex is not None and dir_regex.fullmatch(rel_path) is not None
+            if file_regex is not None and file_regex.fullmatch(rel_path) is not None:
+                return True
+            return include is not None and include.fullmatch(rel_path) is None
+        return is_excluded
+
+    compiled = [(re.compile(r), negate, dir_only) for r, negate, dir_only in reversed(rules)]
+
+    def is_excluded(rel_path, is_dir):
+        for regex, negate, dir_only in compiled:
+            if dir_only and not is_dir:
+                continue
+            if regex.fullmatch(rel_path) is not None:
+                if not negate:
+                    return True
+                break
+        if is_dir:
+            return False
+        return include is not None and include.fullmatch(rel_path) is None
+    return is_excluded
+
+def load_ignore_file(root:str):
+    """
+    Read ignore patterns from the .searchignore file in the scanned root, if there is one.
+
+    Args:
+        root (str): Root directory being scanned.
+
+    Returns:
+        List[str]: Lines of the ignore file, or an empty list if the file does not exist.
+    """
+    path = os.path.join(root, ignore_filename)
+    if not os.path.isfile(path):
+        return []
+    with open(path, 'r', encoding='utf-8') as f:
+        return f.read().splitlines()
+
+def _scan_dir(path:str, rel:str, allowed_text_types, is_excluded, max_bytes, descend:bool):
+    """
+    List a single directory with os.scandir and stat the files that have an allowed extension.
+
+    The stat result is taken from the DirEntry, so each file costs at most one stat call
+    (and none on Windows, where the directory listing already carries the metadata).
+    Excluded subdirectories are dropped here, so they are never listed.
+
+    Args:
+        path (str): Directory to list.
+        rel (str): Path of the directory relative to the scanned root, '/'-separated ('' for the root).
+        allowed_text_types (tuple): Allowed file extensions.
+        is_excluded (function): Matcher from setup_scan_rules, or None.
+        max_bytes (int): Maximum file size in bytes, or None for no limit.
+        descend (bool): Whether subdirectories should be returned for scanning.
+
+    Returns:
+        tuple: Tuple of (files, subdirs). files is a list of (full_path, name, mtime, size) tuples and
+            subdirs is a list of (subdirectory path, relative path) tuples, both in directory listing order.
+    """
+    files = []
+    subdirs = []
+    try:
+        with os.scandir(path) as it:
+            for entry in it:
+                try:
+                    if entry.is_dir():
+                        # Same as os.walk: don't descend into symlinked directories
+                        if not descend or entry.is_symlink():
+                            continue
+                        sub_rel = f"{rel}/{entry.name}" if rel else entry.name
+                        if is_excluded is not None and is_excluded(sub_rel, True):
+                            continue
+                        subdirs.append((entry.path, sub_rel))
+                        continue
+                    if not entry.name.endswith(allowed_text_types):
+                        continue
+                    if is_excluded is not None and is_excluded(f"{rel}/{entry.name}" if rel else entry.name, False):
+                        continue
+                    st = entry.stat()
+                    if max_bytes is not None and st.st_size > max_bytes:
+                        continue
+                    files.append((entry.path, entry.name, st.st_mtime, st.st_size))
+                except OSError as e:
+                    # Skip files we can't access (permissions, broken links, etc.)
+                    logging.warning(f"Could not access {entry.path}: {e}")
+    except OSError as e:
+        logging.warning(f"Could not access {path}: {e}")
+    return files, subdirs
+
+def scan_tree(
+        root:str,
+        allowed_text_types:List[str],
+        num_threads:int = 1,
+        ignore_patterns:List[str] = None,
+        include_patterns:List[str] = None,
+        max_file_size:float = None,
+        max_depth:int = None
+        ):
+    """
+    Recursively find files with allowed extensions and return their size and modification time.
+
+    Directories are listed with os.scandir and the stat results of the DirEntry objects are reused,
+    so no separate os.path.getmtime / os.path.getsize calls are needed. With num_threads > 1, subtrees
+    are listed concurrently by a thread pool, which mostly helps on network-mounted shares where each
+    directory listing waits on the network.
+
+    Ignore rules are compiled once with setup_scan_rules. Excluded directories are pruned before they
+    are listed, so nothing below them is ever read.
+
+    Files are always returned in the same order as a top-down os.walk, regardless of num_threads.
+
+    Args:
+        root (str): Root directory to search for files.
+        allowed_text_types (List[str]): List of allowed file extensions.
+        num_threads (int, optional): Number of threads used to list directories. Defaults to 1.
+        ignore_patterns (List[str], optional): Exclude rules in .gitignore syntax. Defaults to
+            default_ignore_patterns if None; pass an empty list to scan everything.
+            Patterns in a .searchignore file in the root are always added.
+        include_patterns (List[str], optional): Glob patterns a file must match to be kept. Defaults to None.
+        max_file_size (float, optional): Skip files larger than this many megabytes. Defaults to None (no limit).
+        max_depth (int, optional): Maximum number of directory levels to descend below root;
+            0 only scans the root itself. Defaults to None (no limit).
+
+    Returns:
+        list: List of (full_path, name, mtime, size) tuples, where mtime is a POSIX timestamp and size is in bytes.
+    """
+    allowed_text_types = tuple(allowed_text_types)
+    if ignore_patterns is None:
+        ignore_patterns = default_ignore_patterns
+    is_excluded = setup_scan_rules(list(ignore_patterns) + load_ignore_file(root), include_patterns)
+    max_bytes = None if max_file_size is None else int(max_file_size * 1024**2)
+
+    def scan(path, rel, depth):
+        descend = max_depth is None or depth < max_depth
+        return _scan_dir(path, rel, allowed_text_types, is_excluded, max_bytes, descend)
+
+    if num_threads <= 1:
+        results = []
+        stack = [(root, '', 0)]
+        while stack:
+            path, rel, depth = stack.pop()
+            files, subdirs = scan(path, rel, depth)
+            results.extend(files)
+            # Push in reverse so subdirectories are visited in listing order
+            stack.extend((p, r, depth + 1) for p, r in reversed(subdirs))
+        return results
+
+    # Parallel: list every directory in the pool, then stitch the listings together in walk order
+    listings = {}
+    with ThreadPoolExecutor(max_workers=num_threads) as executor:
+        pending = {executor.submit(scan, root, '', 0): (root, 0)}
+        while pending:
+            finished, _ = wait(pending, return_when=FIRST_COMPLETED)
+            for future in finished:
+                path, depth = pending.pop(future)
+                files, subdirs = future.result()
+                listings[path] = (files, subdirs)
+                for p, r in subdirs:
+                    pending[executor.submit(scan, p, r, depth + 1)] = (p, depth + 1)
+
+    results = []
+    stack = [root]
+    while stack:
+        files, subdirs = listings[stack.pop()]
+        results.extend(files)
+        stack.extend(p for p, _ in reversed(subdirs))
+    return results
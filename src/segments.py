@@ -0,0 +1,428 @@
+import os
+import json
+import shutil
+import logging
+import threading
+import numpy as np
+import bm25s, Stemmer
+from embeddings import chunk_keys
+
+#### Define constants/defaults for various functions below
+# BM25 parameters, the defaults of bm25s, so segmented and single indexes score alike
+bm25_k1 = 1.5
+bm25_b = 0.75
+
+# A merge is due once there are more segments than this; it combines this many of the smallest ones
+bm25_merge_factor = 8
+
+# A segment with more than this fraction of tombstones is rewritten without them by the next merge
+bm25_max_tombstone_fraction = 0.3
+
+# File holding the segment list, the row maps and the tombstones
+segments_state_filename = 'state.npz'
+
+def _tokenize(texts:list):
+    """
+    Tokenize chunk texts as create_bm25_index does.
+
+    Returns:
+        tuple: Tuple of (list of token strings, list of token ID lists, one per text).
+    """
+    tokenized = bm25s.tokenize(texts, stopwords="en", stemmer=Stemmer.Stemmer("english"), show_progress=False)
+    vocab = [None] * len(tokenized.vocab)
+    for token, token_id in tokenized.vocab.items():
+        vocab[token_id] = token
+    return vocab, tokenized.ids
+
+class _Segment:
+    """
+    Immutable BM25 segment: term frequencies of a set of chunks, stored as token x document CSR arrays.
+
+    Args:
+        path (str): Directory holding the segment files.
+    """
+
+    def __init__(self, path:str):
+        self.path = path
+        self.name = os.path.basename(path)
+        with open(os.path.join(path, 'vocab.json'), 'r', encoding='utf-8') as f:
+            self.tokens = json.load(f)
+        self.vocab = {token: token_id for token_id, token in enumerate(self.tokens)}
+        self.indptr = np.load(os.path.join(path, 'indptr.npy'), mmap_mode='r')
+        self.docs = np.load(os.path.join(path, 'docs.npy'), mmap_mode='r')
+        self.tfs = np.load(os.path.join(path, 'tfs.npy'), mmap_mode='r')
+        self.doc_lens = np.load(os.path.join(path, 'doc_lens.npy'), mmap_mode='r')
+        self.keys = np.load(os.path.join(path, 'keys.npy'), mmap_mode='r')
+
+    @property
+    def num_docs(self):
+        """Number of documents, including tombstones."""
+        return len(self.doc_lens)
+
+    def postings(self, token_id:int):
+        """Documents containing a token and the token's frequency in each."""
+        lo, hi = self.indptr[token_id], self.indptr[token_id + 1]
+        return self.docs[lo:hi], self.tfs[lo:hi]
+
+    def doc_terms(self):
+        """(token ID, document, frequency) triplets of every posting."""
+        token_ids = np.repeat(np.arange(len(self.tokens), dtype=np.int64), np.diff(self.indptr))
+        return token_ids, np.asarray(self.docs), np.asarray(self.tfs)
+
+    @classmethod
+    def write(cls, path:str, tokens:list, token_ids:np.ndarray, doc_ids:np.ndarray, tfs:np.ndarray,
+              doc_lens:np.ndarray, keys:np.ndarray):
+        """
+        Write a new segment from postings triplets and load it.
+
+        Args:
+            path (str): New segment directory.
+            tokens (list): Token strings, indexed by token ID.
+            token_ids, doc_ids, tfs (numpy.ndarray): One entry per (token, document) posting, or per
+                token occurrence with a frequency of 1; duplicates are summed.
+            doc_lens (numpy.ndarray): Number of tokens of every document.
+            keys (numpy.ndarray): Content key of every document.
+
+        Returns:
+            _Segment: The segment.
+        """
+        num_docs = len(doc_lens)
+        order = np.argsort(token_ids * num_docs + doc_ids, kind='stable')
+        pairs = (token_ids * num_docs + doc_ids)[order]
+        first = np.flatnonzero(np.concatenate(([True], pairs[1:] != pairs[:-1]))) if len(pairs) else np.empty(0, dtype=np.int64)
+        summed = np.add.reduceat(tfs[order], first) if len(first) else np.empty(0, dtype=np.float32)
+        posting_tokens = pairs[first] // max(num_docs, 1)
+
+        os.makedirs(path)
+        with open(os.path.join(path, 'vocab.json'), 'w', encoding='utf-8') as f:
+            json.dump(tokens, f, ensure_ascii=False)
+        indptr = np.zeros(len(tokens) + 1, dtype=np.int64)
+        np.cumsum(np.bincount(posting_tokens, minlength=len(tokens)), out=indptr[1:])
+        np.save(os.path.join(path, 'indptr.npy'), indptr)
+        np.save(os.path.join(path, 'docs.npy'), (pairs[first] % max(num_docs, 1)).astype(np.int32))
+        np.save(os.path.join(path, 'tfs.npy'), summed.astype(np.float32))
+        np.save(os.path.join(path, 'doc_lens.npy'), np.asarray(doc_lens, dtype=np.float32))
+        np.save(os.path.join(path, 'keys.npy'), keys)
+        return cls(path)
+
+class SegmentedBM25:
+    """
+    BM25 index split into immutable segments that is updated by adding segments instead of rebuilding.
+
+    Every segment holds the term frequencies of a set of chunks. Chunks added or changed since the last
+    update are tokenized into a new segment, and rows of chunks that were deleted or changed are marked in
+    their segment's tombstone bitmap. row_chunk maps every row of a segment to the current ID of its chunk,
+    matched by content key, so chunks renumbered by update_chunk_db keep their rows. Queries score every
+    segment with corpus-wide statistics (live document count, average length and document frequencies),
+    so the scores equal those of a single bm25s index over the current chunks. A merge combines the
+    smallest segments, or rewrites one with many tombstones, into a new segment, in a background thread
+    if asked, and swaps it in once written.
+
+    retrieve has the same signature and return values as bm25s.BM25.retrieve, so query_bm25 and
+    query_hybrid accept this index as well.
+
+    Args:
+        path (str): Directory holding the segments and their state.
+    """
+
+    def __init__(self, path:str):
+        self.path = path
+        self.segments = []
+        self.row_chunk = {}
+        self.tombstones = {}
+        self.next_segment = 0
+        self._live_df = {}
+        self._lock = threading.RLock()
+        self._merge_lock = threading.Lock()
+        self._merge_thread = None
+
+    @classmethod
+    def create(cls, path:str, texts:list):
+        """
+        Create a new index at path holding one segment with every chunk. Anything at path is removed.
+
+        Args:
+            path (str): Index directory.
+            texts (list): Chunk texts, in chunk ID order.
+
+        Returns:
+            SegmentedBM25: The index.
+        """
+        if os.path.exists(path):
+            shutil.rmtree(path)
+        os.makedirs(path)
+        index = cls(path)
+        index.update(texts)
+        return index
+
+    @classmethod
+    def load(cls, path:str):
+        """
+        Load an index. Segment directories left behind by an interrupted merge or update are removed.
+
+        Args:
+            path (str): Index directory.
+
+        Returns:
+            SegmentedBM25: The index.
+        """
+        index = cls(path)
+        with np.load(os.path.join(path, segments_state_filename)) as state:
+            index.next_segment = int(state['next_segment'])
+            for name in state['segments'].tolist():
+                index.segments.append(_Segment(os.path.join(path, name)))
+                index.row_chunk[name] = state[f'{name}.row_chunk']
+                index.tombstones[name] = state[f'{name}.tombstones']
+        names = {segment.name for segment in index.segments}
+        for entry in os.listdir(path):
+            if os.path.isdir(os.path.join(path, entry)) and entry not in names:
+                shutil.rmtree(os.path.join(path, entry))
+        index._refresh()
+        return index
+
+    @property
+    def num_docs(self):
+        """Number of live rows, i.e. of indexed chunks."""
+        return sum(int((~self.tombstones[s.name]).sum()) for s in self.segments)
+
+    def _save(self):
+        """Write the segment list, row maps and tombstones, and swap the new state file in."""
+        arrays = {'next_segment': self.next_segment, 'segments': np.array([s.name for s in self.segments], dtype=str)}
+        for segment in self.segments:
+            arrays[f'{segment.name}.row_chunk'] = self.row_chunk[segment.name]
+            arrays[f'{segment.name}.tombstones'] = self.tombstones[segment.name]
+        path = os.path.join(self.path, segments_state_filename)
+        with open(path + '.tmp', 'wb') as f:
+            np.savez(f, **arrays)
+        os.replace(path + '.tmp', path)
+
+    def _refresh(self):
+        """Recompute the corpus-wide statistics after the segments or tombstones changed."""
+        self._live_df = {}
+        total_len = 0.0
+        for segment in self.segments:
+            live = ~self.tombstones[segment.name]
+            token_ids, docs, _ = segment.doc_terms()
+            self._live_df[segment.name] = np.bincount(token_ids[live[docs]], minlength=len(segment.tokens))
+            total_len += float(np.asarray(segment.doc_lens, dtype=np.float64)[live].sum())
+        self._num_live = self.num_docs
+        self._avg_len = total_len / self._num_live if self._num_live else 0.0
+
+    def _new_segment_path(self):
+        """Reserve the directory of the next segment."""
+        name = f'seg_{self.next_segment:06d}'
+        self.next_segment += 1
+        return os.path.join(self.path, name)
+
+    def update(self, texts:list):
+        """
+        Bring the index in line with a new set of chunks.
+
+        Every chunk takes a live row with the same content key, whatever its new chunk ID. Rows left over
+        become tombstones, chunks without a row are tokenized into a new segment, and segments with no live
+        rows left are dropped.
+
+        Args:
+            texts (list): Chunk texts, in chunk ID order.
+        """
+        keys = chunk_keys(texts)
+        with self._lock:
+            # Live rows by content key; the same text can occur in several chunks
+            free = {}
+            for segment in self.segments:
+                seg_keys = segment.keys.tolist()
+                for row in np.flatnonzero(~self.tombstones[segment.name]).tolist():
+                    free.setdefault(seg_keys[row], []).append((segment.name, row))
+
+            row_chunk = {s.name: np.full(s.num_docs, -1, dtype=np.int64) for s in self.segments}
+            missing = []
+            for chunk, key in enumerate(keys.tolist()):
+                rows = free.get(key)
+                if rows:
+                    name, row = rows.pop()
+                    row_chunk[name][row] = chunk
+                else:
+                    missing.append(chunk)
+            self.row_chunk = row_chunk
+            self.tombstones = {name: rows < 0 for name, rows in row_chunk.items()}
+
+            if missing:
+                tokens, ids = _tokenize([texts[i] for i in missing])
+                doc_lens = np.array([len(doc) for doc in ids], dtype=np.int64)
+                token_ids = np.fromiter((t for doc in ids for t in doc), dtype=np.int64, count=int(doc_lens.sum()))
+                doc_ids = np.repeat(np.arange(len(missing), dtype=np.int64), doc_lens)
+                segment = _Segment.write(self._new_segment_path(), tokens, token_ids, doc_ids,
+                                         np.ones(len(token_ids), dtype=np.float32), doc_lens, keys[missing])
+                self.segments.append(segment)
+                self.row_chunk[segment.name] = np.array(missing, dtype=np.int64)
+                self.tombstones[segment.name] = np.zeros(len(missing), dtype=bool)
+
+            dropped = [s for s in self.segments if self.tombstones[s.name].all()]
+            for segment in dropped:
+                self.segments.remove(segment)
+                del self.row_chunk[segment.name], self.tombstones[segment.name]
+            self._save()
+            for segment in dropped:
+                shutil.rmtree(segment.path)
+            self._refresh()
+
+        logging.info(f"BM25 update: {len(missing)} chunks added in a new segment, {len(dropped)} segments dropped, "
+                     f"{len(self.segments)} segments.")
+
+    def _select_merge(self):
+        """Names of the segments the merge policy would merge now, or an empty list."""
+        with self._lock:
+            by_size = sorted(self.segments, key=lambda s: int((~self.tombstones[s.name]).sum()))
+            if len(by_size) > bm25_merge_factor:
+                return [s.name for s in by_size[:bm25_merge_factor]]
+            for segment in by_size:
+                if self.tombstones[segment.name].mean() > bm25_max_tombstone_fraction:
+                    return [segment.name]
+            return []
+
+    def merge(self, background:bool = False):
+        """
+        Run the merge policy: merge the bm25_merge_factor smallest segments if there are more segments than
+        that, otherwise rewrite a segment with more than bm25_max_tombstone_fraction tombstones.
+
+        Args:
+            background (bool, optional): Merge in a daemon thread and return at once. Queries and updates
+                keep running meanwhile; the merged segment is swapped in when it is written. Defaults to False.
+
+        Returns:
+            threading.Thread: The merge thread if background is True and a merge is due, otherwise None.
+        """
+        if not background:
+            while self._merge_once():
+                pass
+            return None
+        if self._merge_thread is not None and self._merge_thread.is_alive():
+            return self._merge_thread
+        if not self._select_merge():
+            return None
+        self._merge_thread = threading.Thread(target=self.merge, daemon=True)
+        self._merge_thread.start()
+        return self._merge_thread
+
+    def _merge_once(self):
+        """Merge the segments selected by the merge policy. Returns False if no merge was due."""
+        with self._merge_lock:
+            with self._lock:
+                names = self._select_merge()
+                if not names:
+                    return False
+                sources = [s for s in self.segments if s.name in names]
+                # The merged rows follow the segment order, so the row maps must be joined in that order too
+                names = [s.name for s in sources]
+                live_rows = {s.name: np.flatnonzero(~self.tombstones[s.name]) for s in sources}
+                path = self._new_segment_path()
+
+            # Gather the live postings of the sources under a shared vocabulary, without holding the lock
+            tokens, vocab = [], {}
+            parts, doc_lens, keys = [], [], []
+            offset = 0
+            for segment in sources:
+                rows = live_rows[segment.name]
+                new_row = np.full(segment.num_docs, -1, dtype=np.int64)
+                new_row[rows] = np.arange(offset, offset + len(rows))
+                token_map = np.empty(len(segment.tokens), dtype=np.int64)
+                for token_id, token in enumerate(segment.tokens):
+                    token_map[token_id] = vocab.setdefault(token, len(vocab))
+                    if token_map[token_id] == len(tokens):
+                        tokens.append(token)
+                token_ids, docs, tfs = segment.doc_terms()
+                keep = new_row[docs] >= 0
+                parts.append((token_map[token_ids[keep]], new_row[docs[keep]], tfs[keep]))
+                doc_lens.append(np.asarray(segment.doc_lens)[rows])
+                keys.append(np.asarray(segment.keys)[rows])
+                offset += len(rows)
+            merged = _Segment.write(path, tokens, *(np.concatenate(p) for p in zip(*parts)),
+                                    np.concatenate(doc_lens), np.concatenate(keys))
+
+            with self._lock:
+                # Updates that ran during the merge may have renumbered or deleted some of the rows
+                current = {s.name for s in self.segments}
+                row_chunk = np.concatenate([
+                    self.row_chunk[name][live_rows[name]] if name in current else np.full(len(live_rows[name]), -1)
+                    for name in names])
+                position = min(i for i, s in enumerate(self.segments) if s.name in names) if current & set(names) else len(self.segments)
+                self.segments = [s for s in self.segments if s.name not in names]
+                for name in names:
+                    self.row_chunk.pop(name, None)
+                    self.tombstones.pop(name, None)
+                if (row_chunk >= 0).any():
+                    self.segments.insert(position, merged)
+                    self.row_chunk[merged.name] = row_chunk
+                    self.tombstones[merged.name] = row_chunk < 0
+                self._save()
+                for segment in sources:
+                    shutil.rmtree(segment.path, ignore_errors=True)
+                if not (row_chunk >= 0).any():
+                    shutil.rmtree(merged.path)
+                self._refresh()
+
+        logging.info(f"Merged {len(names)} BM25 segments into {merged.name} ({offset} chunks).")
+        return True
+
+    def retrieve(self, query_tokens, k:int = 10, weight_mask:np.ndarray = None):
+        """
+        Score every chunk against each query and return the top k.
+
+        Args:
+            query_tokens (bm25s.tokenization.Tokenized): Tokenized queries.
+            k (int, optional): Number of results per query. Defaults to 10.
+            weight_mask (numpy.ndarray, optional): Weight of every chunk ID, multiplied into its score as
+                in bm25s; chunks weighted 0 never match. Defaults to None.
+
+        Returns:
+            tuple: Tuple of (ids, scores), two arrays of shape (number of queries, k), best first. Ties
+                are broken by lower chunk ID; if fewer than k chunks match, the rest are filled with the
+                lowest chunk IDs that don't match, which score 0.
+
+        Raises:
+            ValueError: If k is larger than the number of chunks in the index.
+        """
+        with self._lock:
+            segments = list(self.segments)
+            row_chunk = dict(self.row_chunk)
+            tombstones = dict(self.tombstones)
+            live_df = dict(self._live_df)
+            num_docs, avg_len = self._num_live, self._avg_len
+        if k > num_docs:
+            raise ValueError(f"k of {k} is larger than the number of indexed chunks, which is {num_docs}.")
+
+        queries = bm25s.tokenization.convert_tokenized_to_string_list(query_tokens)
+        ids = np.zeros((len(queries), k), dtype=np.int64)
+        scores = np.zeros((len(queries), k), dtype=np.float32)
+        for q, query in enumerate(queries):
+            # Corpus-wide document frequency of every query token, as in bm25s' Lucene variant
+            df = np.array([sum(int(live_df[s.name][s.vocab[t]]) for s in segments if t in s.vocab) for t in query])
+            idf = np.log(1 + (num_docs - df + 0.5) / (df + 0.5))
+
+            chunk_parts, score_parts = [], []
+            for segment in segments:
+                doc_scores = np.zeros(segment.num_docs, dtype=np.float32)
+                norm = bm25_k1 * (1 - bm25_b + bm25_b * np.asarray(segment.doc_lens) / avg_len)
+                for token, token_idf in zip(query, idf):
+                    token_id = segment.vocab.get(token)
+                    if token_id is None:
+                        continue
+                    docs, tfs = segment.postings(token_id)
+                    doc_scores[docs] += (token_idf * tfs / (norm[docs] + tfs)).astype(np.float32)
+                if weight_mask is not None:
+                    live_chunks = np.where(tombstones[segment.name], 0, row_chunk[segment.name])
+                    doc_scores *= np.asarray(weight_mask, dtype=np.float32)[live_chunks]
+                matched = np.flatnonzero((doc_scores > 0) & ~tombstones[segment.name])
+                chunk_parts.append(row_chunk[segment.name][matched])
+                score_parts.append(doc_scores[matched])
+
+            chunks = np.concatenate(chunk_parts)
+            chunk_scores = np.concatenate(score_parts)
+            order = np.lexsort((chunks, -chunk_scores))[:k]
+            n = len(order)
+            ids[q, :n] = chunks[order]
+            scores[q, :n] = chunk_scores[order]
+            if n < k:
+                # Pad with the lowest non-matching chunk IDs, which all score 0
+                ids[q, n:] = np.setdiff1d(np.arange(min(num_docs, k + n)), chunks)[:k - n]
+        return ids, scores
@@ -0,0 +1,351 @@
+import os
+import re
+import logging
+import numpy as np
+from tqdm import tqdm
+try:
+    from re import _parser as sre_parse
+    from re import _constants as sre_constants
+except ImportError: # Python < 3.11
+    import sre_parse
+    import sre_constants
+
+#### Define constants/defaults for various functions below
+# Number of chunks whose trigrams are extracted per numpy batch while building the index
+build_batch_size = 10000
+
+# Under re.IGNORECASE these ASCII letters also match non-ASCII characters that lowercase to
+# something else ('ı', 'İ', 'ſ'), so they can't be looked up in a lowercased index.
+_ignorecase_unsafe = set('iIsS')
+
+_repeat_ops = {sre_constants.MAX_REPEAT, sre_constants.MIN_REPEAT}
+if hasattr(sre_constants, 'POSSESSIVE_REPEAT'):
+    _repeat_ops.add(sre_constants.POSSESSIVE_REPEAT)
+
+def _trigram_codes(text:str):
+    """
+    Encode every trigram of a string as an int64: three 21-bit code points.
+
+    Args:
+        text (str): Text to encode.
+
+    Returns:
+        numpy.ndarray: One code per trigram start position (empty if the text is shorter than 3 characters).
+    """
+    cps = np.frombuffer(text.encode('utf-32-le'), dtype=np.uint32).astype(np.int64)
+    if len(cps) < 3:
+        return np.empty(0, dtype=np.int64)
+    return (cps[:-2] << 42) | (cps[1:-1] << 21) | cps[2:]
+
+def _simple_lower(c:str, ignorecase:bool = False):
+    """
+    Return the lowercase of a query character if it can be looked up in the lowercased index, else None.
+
+    A character is usable if lowercasing it gives one character regardless of its context, so every
+    text that contains it also contains its lowercase at the same place after str.lower. Under
+    re.IGNORECASE, only ASCII characters that can't match other characters are usable.
+
+    Args:
+        c (str): Single character from the query.
+        ignorecase (bool, optional): Whether the character is matched case-insensitively by a regex.
+
+    Returns:
+        str: The lowercase character, or None if it can't be used.
+    """
+    if ignorecase:
+        return c.lower() if c.isascii() and c not in _ignorecase_unsafe else None
+    lower = c.lower()
+    # 'Σ' lowercases to 'σ' or 'ς' depending on its position in a word
+    return lower if len(lower) == 1 and c != 'Σ' else None
+
+def _run_query(run:list):
+    """
+    Turn a run of consecutive, lowercased literal characters into a trigram query node.
+
+    Args:
+        run (list): Lowercased characters that must appear consecutively in a match.
+
+    Returns:
+        tuple: ('tri', frozenset of trigrams), or None if the run is too short to constrain anything.
+    """
+    if len(run) < 3:
+        return None
+    text = ''.join(run)
+    return ('tri', frozenset(text[i:i+3] for i in range(len(text) - 2)))
+
+def _and_query(parts:list):
+    """
+    Combine query nodes that must all match. None (no constraint) parts are dropped.
+    """
+    parts = [p for p in parts if p is not None]
+    if not parts:
+        return None
+    if len(parts) == 1:
+        return parts[0]
+    return ('and', parts)
+
+def literal_query(text:str, case_sensitive:bool = False):
+    """
+    Build a trigram query for a plain substring search.
+
+    Args:
+        text (str): The substring being searched for, as matched by query_direct.
+        case_sensitive (bool, optional): Whether the substring is matched case-sensitively. If False,
+            text must already be lowercased with str.lower. Defaults to False.
+
+    Returns:
+        tuple: Query node for TrigramIndex.candidates, or None if the text can't narrow the search.
+    """
+    if not case_sensitive:
+        return _run_query(list(text))
+    parts = []
+    run = []
+    for c in text:
+        lower = _simple_lower(c)
+        if lower is None:
+            parts.append(_run_query(run))
+            run = []
+        else:
+            run.append(lower)
+    parts.append(_run_query(run))
+    return _and_query(parts)
+
+def _sequence_query(parsed, ignorecase:bool):
+    """
+    Build a trigram query from a parsed regular expression sequence.
+
+    Consecutive literal characters form runs whose trigrams must all appear in a match. Groups and
+    repeats with a minimum of at least one are required as a whole; alternations become an OR of
+    their branches. Anything else (classes, wildcards, anchors, lookarounds, optional parts) ends
+    the current run and adds no requirement, so the query never excludes a chunk that could match.
+
+    Args:
+        parsed (list): Sequence of (opcode, argument) pairs from sre_parse.
+        ignorecase (bool): Whether the sequence is matched case-insensitively.
+
+    Returns:
+        tuple: Query node, or None if the sequence can't narrow the search.
+    """
+    parts = []
+    run = []
+    for op, av in parsed:
+        if op is sre_constants.LITERAL:
+            lower = _simple_lower(chr(av), ignorecase)
+            if lower is not None:
+                run.append(lower)
+                continue
+        parts.append(_run_query(run))
+        run = []
+        if op is sre_constants.SUBPATTERN:
+            _, add_flags, del_flags, sub = av
+            sub_ignorecase = (ignorecase or bool(add_flags & re.IGNORECASE)) and not (del_flags & re.IGNORECASE)
+            parts.append(_sequence_query(sub, sub_ignorecase))
+        elif op in _repeat_ops:
+            min_count, _, sub = av
+            if min_count >= 1:
+                parts.append(_sequence_query(sub, ignorecase))
+        elif op is sre_constants.BRANCH:
+            branches = [_sequence_query(branch, ignorecase) for branch in av[1]]
+            if all(b is not None for b in branches):
+                parts.append(('or', branches))
+    parts.append(_run_query(run))
+    return _and_query(parts)
+
+def regex_query(pattern:str, flags:int = 0):
+    """
+    Build a trigram query for a regular expression, in the style of code-search engines.
+
+    Args:
+        pattern (str): Regular expression pattern.
+        flags (int, optional): re flags the pattern is compiled with. Defaults to 0.
+
+    Returns:
+        tuple: Query node for TrigramIndex.candidates, or None if the pattern can't narrow the search
+            (for example '.*' or a pattern without a literal of at least 3 characters).
+    """
+    try:
+        parsed = sre_parse.parse(pattern, flags)
+    except Exception:
+        return None
+    ignorecase = bool(parsed.state.flags & re.IGNORECASE)
+    return _sequence_query(list(parsed), ignorecase)
+
+class TrigramIndex:
+    """
+    Posting index from every trigram of the lowercased chunks to the IDs of the chunks containing it.
+
+    Postings are stored in compressed sparse row form: keys holds the sorted trigram codes, and the
+    chunk IDs of keys[i] are postings[indptr[i]:indptr[i+1]], in ascending order. The three arrays are
+    saved as .npy files and memory-mapped on load.
+
+    Args:
+        keys (numpy.ndarray): Sorted int64 trigram codes.
+        indptr (numpy.ndarray): Offsets into postings, one more than the number of keys.
+        postings (numpy.ndarray): Chunk IDs (int32).
+        num_chunks (int): Number of chunks the index was built from.
+    """
+
+    def __init__(self, keys, indptr, postings, num_chunks:int):
+        self.keys = keys
+        self.indptr = indptr
+        self.postings = postings
+        self.num_chunks = int(num_chunks)
+
+    @classmethod
+    def build(cls, texts:list, show_progress:bool = False):
+        """
+        Build the index from chunk texts.
+
+        Trigrams are extracted with numpy in batches of chunks, so the build does no per-trigram Python
+        work. Each (trigram, chunk) pair is packed into one int64 sort key, with the characters numbered
+        within the corpus alphabet, so deduplicating and grouping the pairs is a plain np.sort. If the
+        alphabet and the chunk IDs don't fit in 63 bits, the pairs are sorted with np.lexsort instead.
+
+        Args:
+            texts (list): Chunk texts, in chunk ID order.
+            show_progress (bool, optional): Show a progress bar. Defaults to False.
+
+        Returns:
+            TrigramIndex: The index.
+        """
+        alphabet = set()
+        for text in texts:
+            alphabet.update(text.lower())
+        alphabet = np.array(sorted(map(ord, alphabet)), dtype=np.int64)
+        char_bits = max(1, (len(alphabet) - 1).bit_length())
+        id_bits = max(1, (len(texts) - 1).bit_length())
+        packed = 3 * char_bits + id_bits <= 63
+        if packed:
+            char_ids = np.zeros(int(alphabet[-1]) + 1 if len(alphabet) else 1, dtype=np.int64)
+            char_ids[alphabet] = np.arange(len(alphabet))
+
+        all_keys = []
+        all_ids = []
+        for start in tqdm(range(0, len(texts), build_batch_size), desc="Indexing trigrams", disable=not show_progress):
+            batch = [text.lower() for text in texts[start:start + build_batch_size]]
+            lengths = np.fromiter((len(text) for text in batch), dtype=np.int64, count=len(batch))
+            cps = np.frombuffer(''.join(batch).encode('utf-32-le'), dtype=np.uint32)
+            if len(cps) < 3:
+                continue
+            # Chunk of every character; a trigram is kept only if it starts and ends in the same chunk
+            doc_ids = np.repeat(np.arange(start, start + len(batch), dtype=np.int64), lengths)
+            keep = doc_ids[:-2] == doc_ids[2:]
+            ids = doc_ids[:-2][keep]
+            if packed:
+                d = char_ids[cps]
+                tri = (d[:-2] << (2 * char_bits)) | (d[1:-1] << char_bits) | d[2:]
+                keys = np.sort((tri[keep] << id_bits) | ids)
+                unique = np.ones(len(keys), dtype=bool)
+                unique[1:] = keys[1:] != keys[:-1]
+                all_keys.append(keys[unique])
+            else:
+                cps = cps.astype(np.int64)
+                codes = ((cps[:-2] << 42) | (cps[1:-1] << 21) | cps[2:])[keep]
+                order = np.lexsort((ids, codes))
+                codes, ids = codes[order], ids[order]
+                unique = np.ones(len(codes), dtype=bool)
+                unique[1:] = (codes[1:] != codes[:-1]) | (ids[1:] != ids[:-1])
+                all_keys.append(codes[unique])
+                all_ids.append(ids[unique])
+
+        if not all_keys:
+            codes, ids = np.empty(0, dtype=np.int64), np.empty(0, dtype=np.int64)
+        elif packed:
+            keys = np.sort(np.concatenate(all_keys))
+            ids = keys & ((1 << id_bits) - 1)
+            tri = keys >> id_bits
+            # Unpack the alphabet numbers back into code points; the alphabet is sorted, so order is kept
+            char_mask = (1 << char_bits) - 1
+            codes = (alphabet[tri >> (2 * char_bits)] << 42) | (alphabet[(tri >> char_bits) & char_mask] << 21) | alphabet[tri & char_mask]
+        else:
+            codes = np.concatenate(all_keys)
+            ids = np.concatenate(all_ids)
+            # Batches are in chunk order, so a stable sort keeps each posting list ascending
+            order = np.argsort(codes, kind='stable')
+            codes, ids = codes[order], ids[order]
+
+        # Codes are sorted, so each new value starts a posting list
+        starts = np.flatnonzero(np.concatenate(([True], codes[1:] != codes[:-1]))) if len(codes) else np.empty(0, dtype=np.int64)
+        indptr = np.append(starts, len(codes)).astype(np.int64)
+        return cls(codes[starts], indptr, ids.astype(np.int32), len(texts))
+
+    def save(self, path:str):
+        """
+        Save the index to a directory.
+
+        Args:
+            path (str): Directory to save to. Created if it doesn't exist.
+        """
+        os.makedirs(path, exist_ok=True)
+        np.save(os.path.join(path, 'keys.npy'), self.keys)
+        np.save(os.path.join(path, 'indptr.npy'), self.indptr)
+        np.save(os.path.join(path, 'postings.npy'), self.postings)
+        with open(os.path.join(path, 'num_chunks.txt'), 'w') as f:
+            f.write(str(self.num_chunks))
+
+    @classmethod
+    def load(cls, path:str, mmap:bool = True):
+        """
+        Load an index saved with save.
+
+        Args:
+            path (str): Directory the index was saved to.
+            mmap (bool, optional): Memory-map the arrays instead of reading them into memory. Defaults to True.
+
+        Returns:
+            TrigramIndex: The index.
+        """
+        mmap_mode = 'r' if mmap else None
+        with open(os.path.join(path, 'num_chunks.txt'), 'r') as f:
+            num_chunks = int(f.read())
+        return cls(
+            np.load(os.path.join(path, 'keys.npy'), mmap_mode=mmap_mode),
+            np.load(os.path.join(path, 'indptr.npy'), mmap_mode=mmap_mode),
+            np.load(os.path.join(path, 'postings.npy'), mmap_mode=mmap_mode),
+            num_chunks
+            )
+
+    def _postings(self, trigram:str):
+        """Chunk IDs containing a trigram (empty if it never occurs)."""
+        code = int(_trigram_codes(trigram)[0])
+        i = np.searchsorted(self.keys, code)
+        if i == len(self.keys) or self.keys[i] != code:
+            return np.empty(0, dtype=np.int32)
+        return self.postings[self.indptr[i]:self.indptr[i+1]]
+
+    def candidates(self, query):
+        """
+        Find the chunks that can match a trigram query.
+
+        Args:
+            query (tuple): Query node from literal_query or regex_query, or None.
+
+        Returns:
+            numpy.ndarray: Sorted IDs of the candidate chunks, or None if every chunk is a candidate.
+        """
+        if query is None:
+            return None
+        kind, arg = query
+        if kind == 'tri':
+            # Intersect the shortest posting lists first
+            lists = sorted((self._postings(t) for t in arg), key=len)
+            result = np.asarray(lists[0])
+            for ids in lists[1:]:
+                if len(result) == 0:
+                    break
+                result = np.intersect1d(result, ids, assume_unique=True)
+            return result
+        if kind == 'and':
+            result = None
+            for part in arg:
+                ids = self.candidates(part)
+                if ids is not None:
+                    result = ids if result is None else np.intersect1d(result, ids, assume_unique=True)
+                    if len(result) == 0:
+                        break
+            return result
+        # 'or'
+        branches = [self.candidates(part) for part in arg]
+        if any(ids is None for ids in branches):
+            return None
+        return np.unique(np.concatenate(branches)) if branches else np.empty(0, dtype=np.int32)
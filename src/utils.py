@@ -1,14 +1,26 @@
 import pymupdf
 import os, json, logging, hashlib, argparse, sys, json
+import numpy as np
 from typing import Dict, Union, List
 from datetime import datetime
+from itertools import accumulate
+from collections import deque
+from bisect import bisect_right
 from tqdm import tqdm
+from concurrent.futures import ProcessPoolExecutor, as_completed
+from concurrent.futures.process import BrokenProcessPool
+from scanner import scan_tree
+from chunktable import ChunkTable
+from chunkstore import ChunkStoreWriter, write_chunk_store, load_chunk_store
 
 logging.basicConfig(level=logging.INFO, format='%(levelname)s: %(message)s')
 
 #### Define constants/defaults for various functions below
 file_list_defaults = ['filepath', 'filename', 'last_modified', 'file_size', 'date_added', 'file_id']
 
+# Exact size of every file in bytes, used to detect changed files; file lists from earlier versions lack it
+file_bytes_key = 'file_bytes'
+
 UNICODE_WHITESPACE_CHARACTERS = [
     "\u0000", # null
     "\u0009", # character tabulation
@@ -49,6 +61,83 @@ drop_words = [
     ,'_','|', '.','*','`'
 ] + UNICODE_WHITESPACE_CHARACTERS
 
+# Characters whose doubled runs preprocess collapses
+collapse_chars = [' ', '.', ',', '!', '?']
+
+def _chunk_params(_chunk_size, _chunk_overlap):
+    """
+    Validate chunk size and overlap the same way for every chunker.
+
+    Args:
+        _chunk_size (int or bool): Target number of words per chunk. False treats the entire document as one chunk.
+        _chunk_overlap (int): Number of overlapping words between consecutive chunks.
+
+    Returns:
+        tuple: The (chunk_size, chunk_overlap) to use.
+    """
+    # Option to treat the entire document as 1 chunk
+    if _chunk_size == False:
+        _chunk_size = 999999999
+    if 2 * _chunk_overlap > _chunk_size:
+        _chunk_overlap = round(_chunk_size / 2)
+        print(f"Warning: chunk overlap too large, setting to {_chunk_overlap}.")
+    return _chunk_size, _chunk_overlap
+
+def _word_chunks(n:int, chunk_size:int, chunk_overlap:int):
+    """
+    Group n words into overlapping chunks of chunk_size words.
+
+    Args:
+        n (int): Number of words.
+        chunk_size (int): Number of words per chunk.
+        chunk_overlap (int): Number of overlapping words between consecutive chunks.
+
+    Returns:
+        list: List of (first, last) word indexes of every chunk.
+    """
+    if chunk_size > n:
+        return [(0, n - 1)]
+
+    ranges = []
+    start = 0
+    end = chunk_size
+    while end <= n:
+        ranges.append((start, end - 1))
+        start = end - chunk_overlap
+        end = start + chunk_size
+
+    # Handle remaining words if any
+    if start < n:
+        ranges.append((start, n - 1))
+    return ranges
+
+def setup_offset_chunker(_chunk_size:int, _chunk_overlap:int):
+    """
+    Create a chunking function that returns character offsets instead of chunk strings.
+
+    Words are the pieces of text between single spaces, exactly as in setup_chunker, and the chunk
+    boundaries are identical: text[start:end] for each returned offset pair equals the corresponding
+    chunk from setup_chunker. No word list is joined back together, so a chunk is only copied when
+    it is sliced out of the stored document.
+
+    Args:
+        _chunk_size (int or bool): Target number of words per chunk. Set to False to treat entire document as one chunk.
+        _chunk_overlap (int): Number of overlapping words between consecutive chunks to maintain context.
+
+    Returns:
+        function: A chunker function that takes text and returns a list of (start, end) character offsets.
+            The returned function signature is: chunker(text, chunk_size, chunk_overlap) -> List[Tuple[int, int]]
+    """
+    _chunk_size, _chunk_overlap = _chunk_params(_chunk_size, _chunk_overlap)
+
+    def chunker(text, chunk_size = _chunk_size, chunk_overlap = _chunk_overlap):
+        words = text.split(' ')
+        # cum[i] is the total length of the words before word i, so word i starts at cum[i] + i
+        cum = list(accumulate(map(len, words), initial=0))
+        return [(cum[first] + first, cum[last + 1] + last)
+                for first, last in _word_chunks(len(words), chunk_size, chunk_overlap)]
+    return chunker
+
 # Faster chunker by approximating 1 word per 1 token. No tokenizer.
 def setup_chunker(_chunk_size:int, _chunk_overlap:int):
     """
@@ -56,7 +145,8 @@ def setup_chunker(_chunk_size:int, _chunk_overlap:int):
     
     This function returns a closure that splits text into overlapping chunks based on word boundaries.
     It approximates 1 word per 1 token for efficiency without using a tokenizer. If chunk_size is False,
-    the entire document is treated as a single chunk.
+    the entire document is treated as a single chunk. Chunk boundaries come from setup_offset_chunker,
+    so each chunk is a single slice of the text.
 
     Args:
         _chunk_size (int or bool): Target number of words per chunk. Set to False to treat entire document as one chunk.
@@ -66,36 +156,64 @@ def setup_chunker(_chunk_size:int, _chunk_overlap:int):
         function: A chunker function that takes text and returns a list of text chunks.
             The returned function signature is: chunker(text, chunk_size, chunk_overlap) -> List[str]
     """
-    # Option to treat the entire document as 1 chunk
-    if _chunk_size == False:
-        _chunk_size = 999999999
-    if 2 * _chunk_overlap > _chunk_size:
-        _chunk_overlap = round(_chunk_size / 2)
-        print(f"Warning: chunk overlap too large, setting to {_chunk_overlap}.")
+    _chunk_size, _chunk_overlap = _chunk_params(_chunk_size, _chunk_overlap)
+    offset_chunker = setup_offset_chunker(_chunk_size, _chunk_overlap)
 
     def chunker(text, chunk_size = _chunk_size, chunk_overlap = _chunk_overlap):
-        # Split text into words
-        words = text.split(' ')
-        
-        if chunk_size > len(words):
-            return [text]
-        else:
-            chunks = []
-            start = 0
-            end = chunk_size  # Fixed: Remove the -1
-            while end <= len(words):  # Fixed: Use <= since we're now using inclusive end
-                chunk = ' '.join(words[start:end])  # This now correctly includes chunk_size words
-                chunks.append(chunk)
-                start = end - chunk_overlap
-                end = start + chunk_size  # Fixed: Maintain consistent chunk size
-
-            # Handle remaining words if any
-            if start < len(words):
-                chunks.append(' '.join(words[start:]))
-
-            return chunks
+        return [text[start:end] for start, end in offset_chunker(text, chunk_size, chunk_overlap)]
     return chunker
 
+def setup_normalizer(_drop_words:List[str] = drop_words, _collapse_chars:List[str] = collapse_chars):
+    """
+    Create a text normalization function that performs the preprocess cleanup with a precompiled plan.
+
+    The drop words are deduplicated and compiled once. ASCII text, which covers most queries, filenames
+    and text files, goes through a single bytes.translate call (str.isascii is a constant-time check,
+    and encoding ASCII text is a plain copy). Other text uses one str.replace per distinct drop word, skipping words that
+    are replaced with themselves; on non-ASCII text this is faster than str.translate or a regex. Runs
+    of repeated punctuation are only collapsed for characters that can still be present, and only if a
+    doubled mark is found. The result is identical to replacing each drop word in turn and then running
+    two rounds of pairwise replacement per collapse character.
+
+    Args:
+        _drop_words (List[str], optional): Words/symbols to replace with a space. Defaults to drop_words.
+        _collapse_chars (List[str], optional): Characters whose doubled runs are collapsed.
+            Defaults to space, period, comma, exclamation and question marks.
+
+    Returns:
+        function: A normalizer function with signature normalize(text) -> str.
+    """
+    words = [w for w in dict.fromkeys(_drop_words) if w != ' ']
+    single = [w for w in words if len(w) == 1]
+    multi = [w for w in words if len(w) > 1]
+    # Byte translation table for ASCII text. Only used when there are no multi-character words, since
+    # translating single characters first could break one up.
+    ascii_drop = ''.join(w for w in single if w.isascii()).encode('ascii')
+    ascii_table = bytes.maketrans(ascii_drop, b' ' * len(ascii_drop)) if not multi else None
+
+    # Characters that are dropped can never form a run after the drop step
+    collapse = [(c, c + c) for c in _collapse_chars if c not in single]
+    fix_period = '.' not in single
+
+    def normalize(text):
+        # Connect words across lines
+        text = text.replace('-\n', '')
+        # Drop words we don't care about where the symbol appears, doesn't need spaces
+        if ascii_table is not None and text.isascii():
+            text = text.encode('ascii').translate(ascii_table).decode('ascii')
+        else:
+            for word in words:
+                text = text.replace(word, ' ')
+        # Removing double marks
+        for c, cc in collapse:
+            if cc in text:
+                text = text.replace(cc, c).replace(cc, c)
+        if fix_period:
+            text = text.replace(' .', '.')
+        return text.strip()
+    return normalize
+
+_normalize = setup_normalizer()
 
 # Preprocessing function for PDFs
 def preprocess(text:str):
@@ -104,6 +222,7 @@ def preprocess(text:str):
     
     This function performs several text cleaning operations including connecting hyphenated words across lines,
     removing special characters and Unicode whitespace, eliminating double punctuation, and trimming whitespace.
+    The replacement plan is compiled once by setup_normalizer.
 
     Args:
         text (str): Raw text to be preprocessed.
@@ -111,40 +230,28 @@ def preprocess(text:str):
     Returns:
         str: Cleaned and normalized text with standardized spacing and punctuation.
     """
-    # Connect words across lines
-    text = text.replace('-\n', '')
-    # Drop words we don't care about where the symbol appears, doesn't need spaces
-    for word in drop_words:
-        text = text.replace(f'{word}', ' ')
-    # Removing double marks
-    for i in [' ', '.', ',', '!', '?']:
-        text = text.replace(f'{i}{i}', f'{i}').replace(f'{i}{i}', f'{i}')
-    text = text.replace(' .', '.')
-    text = text.strip()
-    return(text)
+    return _normalize(text)
 
-# Function to convert PDF to chunkable text
-def prepare_PDF(in_path:str, _chunk_size:int, _chunk_overlap:int):
+def extract_pdf_pages(in_path:str):
     """
-    Converts a PDF document into preprocessed text chunks for further analysis or embedding.
-    
-    This function reads a PDF file, extracts all text content, splits it into overlapping chunks
-    of specified size, and preprocesses each chunk to clean and standardize the text.
-    
+    Extract the raw text of every non-empty page of a PDF.
+
     Parameters:
     -----------
     in_path : str
         File path to the PDF document to be processed
-    _chunk_size : int
-        Target size of each chunk in words (approximate tokens)
-        Set to False to treat the entire document as one chunk
-    _chunk_overlap : int
-        Number of overlapping words between consecutive chunks to maintain context
-    
+
     Returns:
     --------
     list
-        A list of preprocessed text chunks
+        A list of (page_number, page_text) tuples, with 1-based page numbers
+
+    Raises:
+    -------
+    FileNotFoundError
+        If the file does not exist
+    RuntimeError
+        If the PDF cannot be opened or a page cannot be read
     """
     # Assert that the file is a PDF
     assert in_path.lower().endswith('.pdf'), "This is not a PDF file. Use a different function."
@@ -155,18 +262,15 @@ def prepare_PDF(in_path:str, _chunk_size:int, _chunk_overlap:int):
     except Exception as e:
         raise RuntimeError(f"Failed to open PDF: {e}")
 
-    paper_one_string = ""
+    pages = []
     # Iterate through each page and extract text
     try:
-        counter=0
-        #for page in tqdm(doc, desc="Extracting text from PDF"):
         for page in doc:
             try: 
-                #print(f"Processing page {page.number + 1} of {len(doc)}")   
                 # Extract text from each page
                 page_text = page.get_text()
                 if page_text:
-                    paper_one_string += ' ' + page_text
+                    pages.append((page.number + 1, page_text))
             except Exception as e:
                 logging.warning(f"Error processing file {in_path} page {page.number}: {e}")
                 raise RuntimeError(f"Error processing file {in_path} page {page.number}: {e}")
@@ -174,6 +278,71 @@ def prepare_PDF(in_path:str, _chunk_size:int, _chunk_overlap:int):
         logging.warning(f"Error processing file {in_path}: {e}")
         raise RuntimeError(f"Failed to extract text from PDF: {e}")
 
+    return pages
+
+def _join_pages(pages, sep:str = ' '):
+    """
+    Join page texts into one document in linear time, recording where each page starts.
+
+    Each page is prefixed with the separator, so the document matches the old `+= ' ' + page_text` assembly.
+
+    Args:
+        pages (list): List of (page_number, page_text) tuples.
+        sep (str, optional): Separator placed before each page. Defaults to ' '.
+
+    Returns:
+        tuple: Tuple of (text, page_offsets, page_numbers), where page_offsets[i] is the offset in text
+            at which the text of page page_numbers[i] starts.
+    """
+    lengths = [len(sep) + len(page_text) for _, page_text in pages]
+    page_offsets = [offset + len(sep) for offset in accumulate(lengths, initial=0)][:-1]
+    text = ''.join(sep + page_text for _, page_text in pages)
+    return text, page_offsets, [number for number, _ in pages]
+
+def _page_ranges(spans, page_offsets, page_numbers):
+    """
+    Find the first and last page of each chunk with a binary search on the page start offsets.
+
+    Args:
+        spans (list): List of (start, end) chunk offsets into the joined document.
+        page_offsets (list): Sorted start offset of each page, as returned by _join_pages.
+        page_numbers (list): Page number of each entry in page_offsets.
+
+    Returns:
+        tuple: Tuple of (page_start, page_end) lists with the first and last page number of each chunk.
+    """
+    page_start = []
+    page_end = []
+    for start, end in spans:
+        page_start.append(page_numbers[max(bisect_right(page_offsets, start) - 1, 0)])
+        page_end.append(page_numbers[max(bisect_right(page_offsets, max(end - 1, start)) - 1, 0)])
+    return page_start, page_end
+
+# Function to convert PDF to chunkable text
+def prepare_PDF(in_path:str, _chunk_size:int, _chunk_overlap:int):
+    """
+    Converts a PDF document into preprocessed text chunks for further analysis or embedding.
+    
+    This function reads a PDF file, extracts all text content, splits it into overlapping chunks
+    of specified size, and preprocesses each chunk to clean and standardize the text.
+    
+    Parameters:
+    -----------
+    in_path : str
+        File path to the PDF document to be processed
+    _chunk_size : int
+        Target size of each chunk in words (approximate tokens)
+        Set to False to treat the entire document as one chunk
+    _chunk_overlap : int
+        Number of overlapping words between consecutive chunks to maintain context
+    
+    Returns:
+    --------
+    list
+        A list of preprocessed text chunks
+    """
+    paper_one_string, _, _ = _join_pages(extract_pdf_pages(in_path))
+
     if paper_one_string == '':
         logging.warning(f"Empty PDF: {in_path}")
     else:
@@ -181,6 +350,53 @@ def prepare_PDF(in_path:str, _chunk_size:int, _chunk_overlap:int):
         chunker = setup_chunker(_chunk_size, _chunk_overlap)
         return chunker(preprocess(paper_one_string))
 
+def prepare_PDF_pages(in_path:str, _chunk_size:int, _chunk_overlap:int):
+    """
+    Converts a PDF document into preprocessed text chunks that know which pages they come from.
+
+    The pages are joined into one document in linear time, keeping the offset where each page starts, and
+    the document is preprocessed and chunked exactly like prepare_PDF, so the chunks are identical to its
+    chunks (including words hyphenated across pages). Page offsets are carried over to the preprocessed
+    text through _normalize_offsets, and the first and last page of every chunk is found with a binary
+    search on them.
+
+    Parameters:
+    -----------
+    in_path : str
+        File path to the PDF document to be processed
+    _chunk_size : int
+        Target size of each chunk in words (approximate tokens)
+        Set to False to treat the entire document as one chunk
+    _chunk_overlap : int
+        Number of overlapping words between consecutive chunks to maintain context
+
+    Returns:
+    --------
+    dict
+        A dictionary containing (or None if the PDF holds no text):
+        - 'processed_chunk': List of preprocessed text chunks
+        - 'page_start': List of the 1-based first page of each chunk
+        - 'page_end': List of the 1-based last page of each chunk
+    """
+    document, page_offsets, page_numbers = _join_pages(extract_pdf_pages(in_path))
+    if document == '':
+        logging.warning(f"Empty PDF: {in_path}")
+        return None
+
+    text, positions = _normalize_offsets(document)
+    # A page starts at the first preprocessed character that comes from it or a later page
+    page_offsets = np.searchsorted(positions, page_offsets).tolist()
+
+    chunker = setup_offset_chunker(_chunk_size, _chunk_overlap)
+    spans = chunker(text)
+    page_start, page_end = _page_ranges(spans, page_offsets, page_numbers)
+
+    return {
+        'processed_chunk': [text[start:end] for start, end in spans],
+        'page_start': page_start,
+        'page_end': page_end
+    }
+
 # Function to chunk PDFs by page
 def prepare_PDF_page(in_path:str):
     """
@@ -284,11 +500,183 @@ def prepare_text(in_path:str, _chunk_size:int, _chunk_overlap:int):
         except Exception as e:
             raise RuntimeError(f"Failed to read text file: {e}")
 
+def extract_text(in_path:str):
+    """
+    Read the raw text of a PDF or text file, without any preprocessing.
+
+    PDF pages are joined with a space, the same way prepare_PDF assembles a document. Text files are
+    read as UTF-8, falling back to the platform default encoding.
+
+    Args:
+        in_path (str): Path to the file.
+
+    Returns:
+        str: The raw text of the file.
+
+    Raises:
+        FileNotFoundError: If the file does not exist.
+        RuntimeError: If the file cannot be opened or read.
+    """
+    if not os.path.isfile(in_path):
+        raise FileNotFoundError(f"File not found: {in_path}")
+
+    if in_path.lower().endswith('.pdf'):
+        return _join_pages(extract_pdf_pages(in_path))[0]
+
+    try:
+        with open(in_path, 'r', encoding='utf-8') as file:
+            return file.read()
+    except Exception:
+        try:
+            with open(in_path, 'r') as file: # try non-utf8 encoding
+                return file.read()
+        except Exception as e:
+            raise RuntimeError(f"Failed to read text file: {e}")
+
+# Characters that preprocess turns into spaces, as code points
+_drop_codes = np.array([ord(w) for w in dict.fromkeys(drop_words) if w != ' '], dtype=np.uint32)
+
+def _codes(text:str):
+    """Code points of a string, as a numpy array."""
+    return np.frombuffer(text.encode('utf-32-le', 'surrogatepass'), dtype=np.uint32)
+
+def _normalize_offsets(text:str):
+    """
+    Preprocess text, also returning the position in text of every character of the result.
+
+    Runs the steps of preprocess (setup_normalizer with the default drop words and collapse characters)
+    on an array of code points, deleting characters instead of building new strings, so the result is
+    identical to preprocess(text) and each of its characters can be traced back to the raw text.
+
+    Args:
+        text (str): Raw text.
+
+    Returns:
+        tuple: Tuple of (normalized text, positions), where positions[i] is the index in text of character
+            i of the normalized text.
+    """
+    codes = _codes(text)
+    positions = np.arange(len(codes), dtype=np.int64)
+
+    # Connect words across lines
+    starts = np.flatnonzero((codes[:-1] == ord('-')) & (codes[1:] == ord('\n')))
+    keep = np.ones(len(codes), dtype=bool)
+    keep[starts] = keep[starts + 1] = False
+    codes, positions = codes[keep], positions[keep]
+
+    # Drop words we don't care about
+    codes = np.where(np.isin(codes, _drop_codes), np.uint32(ord(' ')), codes)
+
+    # Removing double marks: each str.replace pass keeps every other character of a run
+    for c in collapse_chars:
+        if ord(c) in _drop_codes:
+            continue
+        for _ in range(2):
+            is_c = codes == ord(c)
+            index = np.arange(len(codes))
+            run_start = np.maximum.accumulate(np.where(is_c & ~np.concatenate(([False], is_c[:-1])), index, 0))
+            keep = ~(is_c & ((index - run_start) % 2 == 1))
+            codes, positions = codes[keep], positions[keep]
+    if ord('.') not in _drop_codes:
+        keep = np.ones(len(codes), dtype=bool)
+        keep[:-1] = ~((codes[:-1] == ord(' ')) & (codes[1:] == ord('.')))
+        codes, positions = codes[keep], positions[keep]
+
+    normalized = codes.astype('<u4').tobytes().decode('utf-32-le', 'surrogatepass')
+    start = len(normalized) - len(normalized.lstrip())
+    end = len(normalized.rstrip())
+    return normalized[start:end], positions[start:end]
+
+def prepare_original(in_path:str, _chunk_size:int, _chunk_overlap:int, track_pages:bool = False):
+    """
+    Chunk a PDF or text file while keeping its original, unprocessed text.
+
+    The document is preprocessed and chunked exactly as prepare_text and prepare_PDF do, so the processed
+    chunks are identical to theirs, while every character of the preprocessed text is traced back to the raw
+    text (see _normalize_offsets). Each chunk is then also described by the (start, end) character offsets of
+    its text in the raw document, so the original text of any chunk can be sliced out on demand with
+    get_original_text. The processed chunks are still returned as strings, since every index and search
+    reads them; the raw document is returned in addition to them, not in place of them.
+
+    Args:
+        in_path (str): File path to the document to be processed.
+        _chunk_size (int): Target size of each chunk in words (approximate tokens).
+            Set to False to treat the entire document as one chunk.
+        _chunk_overlap (int): Number of overlapping words between consecutive chunks to maintain context.
+        track_pages (bool, optional): Also return the first and last page of each chunk (0 for non-PDF files).
+            Defaults to False.
+
+    Returns:
+        dict: Dictionary containing (or None if the file holds no text):
+            - 'document': The raw text of the file
+            - 'processed_chunk': List of preprocessed text chunks
+            - 'text_start': List of chunk start offsets into the document
+            - 'text_end': List of chunk end offsets into the document
+            - 'page_start', 'page_end': First and last page of each chunk (only if track_pages)
+    """
+    if in_path.lower().endswith('.pdf'):
+        document, page_offsets, page_numbers = _join_pages(extract_pdf_pages(in_path))
+    else:
+        document, page_offsets, page_numbers = extract_text(in_path), None, None
+    text, positions = _normalize_offsets(document)
+    if text == '':
+        logging.warning(f"Empty file: {in_path}")
+        return None
+
+    # Word i of the preprocessed text ends at its i-th space, as in text.split(' '), without a word list
+    spaces = np.flatnonzero(_codes(text) == ord(' '))
+    word_starts = np.concatenate(([0], spaces + 1))
+    word_ends = np.concatenate((spaces, [len(text)]))
+    chunk_size, chunk_overlap = _chunk_params(_chunk_size, _chunk_overlap)
+    ranges = _word_chunks(len(word_starts), chunk_size, chunk_overlap)
+    chunk_spans = [(int(word_starts[first]), int(word_ends[last])) for first, last in ranges]
+
+    # The raw text of a chunk runs from the source of its first character to that of its last
+    spans = [
+        (int(positions[start]), int(positions[end - 1]) + 1 if end > start else int(positions[start]))
+        for start, end in chunk_spans
+    ]
+
+    result = {
+        'document': document,
+        'processed_chunk': [text[start:end] for start, end in chunk_spans],
+        'text_start': [start for start, _ in spans],
+        'text_end': [end for _, end in spans]
+    }
+    if track_pages:
+        if page_offsets is None:
+            result['page_start'] = [0] * len(spans)
+            result['page_end'] = [0] * len(spans)
+        else:
+            result['page_start'], result['page_end'] = _page_ranges(spans, page_offsets, page_numbers)
+    return result
+
+def get_original_text(chunks, chunk_id:int):
+    """
+    Return the original, unprocessed text of a chunk.
+
+    Args:
+        chunks (dict): Chunk database created with keep_original=True.
+        chunk_id (int): ID of the chunk.
+
+    Returns:
+        str: The original text the chunk was made from, or None if the database has no original text.
+    """
+    if 'documents' not in chunks:
+        return None
+    document = chunks['documents'][chunks['file_id'][chunk_id]]
+    return document[chunks['text_start'][chunk_id]:chunks['text_end'][chunk_id]]
+
 def file_scanner(
         filepath:str = None, 
         allowed_text_types:List[str] = allowed_texts,
         file_list_path:str = None,
-        output_filename:str = None
+        output_filename:str = None,
+        num_threads:int = 1,
+        ignore_patterns:List[str] = None,
+        include_patterns:List[str] = None,
+        max_file_size:float = None,
+        max_depth:int = None
         ) -> Dict[str, float]:
     """
     Recursively scans a directory for files with allowed extensions, tracks their metadata, and saves the results to a JSON file.
@@ -298,20 +686,28 @@ def file_scanner(
         allowed_text_types (List[str], optional): List of allowed file extensions. Defaults to allowed_texts.
         file_list_path (str, optional): Path to an existing JSON file list to update. If None, starts a new list.
         output_filename (str, optional): Filename to save the resulting file list. Defaults to "file_list.json".
+        num_threads (int, optional): Number of threads used to list directories. Values above 1 mostly
+            help on network-mounted shares. Defaults to 1.
+        ignore_patterns (List[str], optional): Files and directories to skip, in .gitignore syntax. Excluded
+            directories are pruned without being read. Defaults to scanner.default_ignore_patterns
+            (search_utils, .git, .venv, node_modules, ...); pass an empty list to scan everything.
+            Patterns in a .searchignore file in the root directory are always applied as well.
+        include_patterns (List[str], optional): Glob patterns a file must match to be included. Defaults to None.
+        max_file_size (float, optional): Skip files larger than this many megabytes. Defaults to None (no limit).
+        max_depth (int, optional): Maximum number of directory levels to descend below filepath. Defaults to None (no limit).
 
     Returns:
         Dict[str, float]: Dictionary containing lists of filepaths, last modified times, date added, and file IDs.
     """
     
     flag_existing=0
-    start_length=0
 
     if filepath is None:
         filepath = os.getcwd()
         logging.info("You did not specify a path, so using the current working directory.")
 
     if file_list_path is None:
-        file_list = {key: [] for key in file_list_defaults}
+        file_list = {key: [] for key in file_list_defaults + [file_bytes_key]}
     else:
         with open(file_list_path, 'r') as f:
             file_list = json.load(f)
@@ -321,64 +717,84 @@ def file_scanner(
         else:
             logging.info("Successfully loaded existing file list.")
             flag_existing=1
-            start_length=len(file_list['filepath'])
+        file_list.setdefault(file_bytes_key, [None] * len(file_list['file_id']))
 
     if output_filename is None:
         output_filename = "./search_utils/file_list.json"
 
-    # Use os.walk for recursive directory traversal
+    # Position of each known file in the list, so existing entries can be refreshed in place
+    known = {f_id: i for i, f_id in enumerate(file_list['file_id'])}
+    seen = set()
+    added = 0
+
     logging.info(f"Searching for files in {filepath} with allowed types: {allowed_text_types}")
-    for root, dirs, files in os.walk(filepath):
-        for file in files:
-            # Check if the file type is allowed
-            if not any(file.endswith(ext) for ext in allowed_text_types):
-                continue
-            
-            full_path = os.path.join(root, file)
-            try:
-                # Get last modified time
-                mod_time = datetime.fromtimestamp(os.path.getmtime(full_path)).strftime('%Y-%m-%d %H:%M:%S')
-                size = os.path.getsize(full_path)
-
-                # Hash the file properties to uniquely identify it
-                hash_id = hashlib.sha1(full_path.encode('utf-8')).hexdigest()
-
-                # check if file-instance already in the list
-                if hash_id in file_list['file_id']:
-                    continue
-
-                # Extract filename from path
-                filename =  os.path.splitext(file)[0]
-                
-                file_list['filepath'].append(full_path)
-                file_list['filename'].append(preprocess(filename))
-                file_list['last_modified'].append(mod_time)
-                file_list['file_size'].append(int(size/(1024**2)))  # Size in MB
-                file_list['date_added'].append(datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
-                file_list['file_id'].append(hash_id)
-            except (OSError, IOError) as e:
-                # Skip files we can't access (permissions, etc.)
-                logging.warning(f"Could not access {full_path}: {e}")
-                continue
+    scanned = scan_tree(
+        filepath, allowed_text_types, num_threads=num_threads,
+        ignore_patterns=ignore_patterns, include_patterns=include_patterns,
+        max_file_size=max_file_size, max_depth=max_depth
+    )
+    for full_path, file, mtime, size in scanned:
+        # Get last modified time
+        mod_time = datetime.fromtimestamp(mtime).strftime('%Y-%m-%d %H:%M:%S')
+
+        # Hash the file properties to uniquely identify it
+        hash_id = hashlib.sha1(full_path.encode('utf-8')).hexdigest()
+        seen.add(hash_id)
+
+        # If the file is already in the list, refresh its metadata so changes can be detected
+        if hash_id in known:
+            i = known[hash_id]
+            file_list['last_modified'][i] = mod_time
+            file_list['file_size'][i] = int(size/(1024**2))  # Size in MB
+            file_list[file_bytes_key][i] = size
+            continue
+
+        # Extract filename from path
+        filename =  os.path.splitext(file)[0]
+        
+        known[hash_id] = len(file_list['file_id'])
+        file_list['filepath'].append(full_path)
+        file_list['filename'].append(preprocess(filename))
+        file_list['last_modified'].append(mod_time)
+        file_list['file_size'].append(int(size/(1024**2)))  # Size in MB
+        file_list[file_bytes_key].append(size)
+        file_list['date_added'].append(datetime.now().strftime('%Y-%m-%d %H:%M:%S'))
+        file_list['file_id'].append(hash_id)
+        added += 1
     logging.info("Done scanning.")
 
-    if start_length > 0:
-        added = len(file_list['filepath']) - start_length
+    # Drop files from an existing list that have since been deleted, or that are under the scanned
+    # directory but were not found because they are now excluded
+    root_prefix = os.path.join(os.path.abspath(filepath), '')
+    keep = [
+        f_id in seen or (not os.path.abspath(path).startswith(root_prefix) and os.path.exists(path))
+        for f_id, path in zip(file_list['file_id'], file_list['filepath'])
+    ]
+    removed = len(keep) - sum(keep)
+    if removed > 0:
+        for key in file_list_defaults + [file_bytes_key]:
+            file_list[key] = [v for v, k in zip(file_list[key], keep) if k]
+        logging.info(f"Removed {removed} deleted or excluded files from the file list.")
 
     # Create a dict where file_id is the key and the element is another dict with the rest of the info
-    file_dict = {file_list['file_id'][i]: {
-        'filepath': file_list['filepath'][i],
-        'last_modified': file_list['last_modified'][i],
-        'file_size': file_list['file_size'][i],
-        'date_added': file_list['date_added'][i]
-    } for i in range(len(file_list['file_id']))}
+    file_dict = {f_id: {
+        'filepath': path,
+        'last_modified': mod_time,
+        'file_size': size,
+        file_bytes_key: num_bytes,
+        'date_added': date_added
+    } for f_id, path, mod_time, size, num_bytes, date_added in zip(
+        file_list['file_id'], file_list['filepath'], file_list['last_modified'],
+        file_list['file_size'], file_list[file_bytes_key], file_list['date_added']
+    )}
 
     # Save to JSON files
+    # json.dumps without indent uses the C encoder, which is much faster than json.dump on large lists
     try:
         with open(output_filename, 'w') as f:
-            json.dump(file_list, f, indent=2)
+            f.write(json.dumps(file_list))
         with open("./search_utils/file_dict.json", 'w') as f:
-            json.dump(file_dict, f, indent=2)
+            f.write(json.dumps(file_dict))
         if flag_existing == 0:
             logging.info(f"File list saved to {output_filename} with {len(file_list['filepath'])} files.")
         else:
@@ -388,35 +804,240 @@ def file_scanner(
 
     return (file_list, file_dict)
 
+def _chunk_file(task):
+    """
+    Extract, clean and chunk a single file. Worker function for chunk_db.
+
+    This is kept at module level so it can be pickled to worker processes. Errors are caught and
+    returned instead of raised, so one unreadable file cannot abort the whole ingestion run.
+
+    Args:
+        task (tuple): Tuple containing (file_index, filepath, chunk_size, chunk_overlap, keep_original, track_pages).
+
+    Returns:
+        tuple: Tuple of (file_index, chunks, error). chunks is a list of text chunks, or a dictionary of
+            per-chunk columns if keep_original or track_pages is set (None if the file was skipped or failed),
+            and error is a message string (or None on success).
+    """
+    idx, file, chunk_size, chunk_overlap, keep_original, track_pages = task
+    try:
+        # Confirm file exists
+        if not os.path.exists(file):
+            return (idx, None, f"File {file} does not exist, skipping.")
+
+        # determine file type
+        if keep_original:
+            chunks = prepare_original(file, _chunk_overlap=chunk_overlap, _chunk_size=chunk_size, track_pages=track_pages)
+        elif file.endswith('.pdf'):
+            if track_pages:
+                chunks = prepare_PDF_pages(file, _chunk_overlap=chunk_overlap, _chunk_size=chunk_size)
+            else:
+                chunks = prepare_PDF(file, _chunk_overlap=chunk_overlap, _chunk_size=chunk_size)
+        else:
+            chunks = prepare_text(file, _chunk_overlap=chunk_overlap, _chunk_size=chunk_size)
+            if track_pages and chunks is not None:
+                chunks = {
+                    'processed_chunk': chunks,
+                    'page_start': [0] * len(chunks),
+                    'page_end': [0] * len(chunks)
+                }
+        return (idx, chunks, None)
+    except Exception as e:
+        return (idx, None, f"Error processing file {file}, skipping: {e}")
+
+def _chunk_isolated(tasks):
+    """
+    Chunk files one at a time in a single worker process, skipping any file whose worker crashes.
+
+    Used after a worker pool breaks: running the remaining files in the main process would let the file
+    that crashed the pool take it down too. Files are submitted one at a time, so when the worker dies
+    the file it was processing is known; it is skipped and a fresh worker takes the rest.
+
+    Args:
+        tasks (list): Task tuples for _chunk_file.
+
+    Yields:
+        tuple: Tuple of (file_index, chunks, error) for every task, as returned by _chunk_file.
+    """
+    tasks = deque(tasks)
+    while tasks:
+        try:
+            with ProcessPoolExecutor(max_workers=1) as executor:
+                while tasks:
+                    result = executor.submit(_chunk_file, tasks[0]).result()
+                    tasks.popleft()
+                    yield result
+        except BrokenProcessPool:
+            idx, file = tasks.popleft()[:2]
+            yield (idx, None, f"Worker crashed while processing file {file}, skipping.")
+
+def iter_chunk_files(
+        filepaths:List[str]
+        , chunk_size=default_chunk_size, chunk_overlap=default_chunk_overlap
+        , num_workers:int = None
+        , progress_callback=None
+        , keep_original:bool = False
+        , track_pages:bool = False
+        , errors:dict = None
+        ):
+    """
+    Chunk a list of files, optionally in parallel, yielding the chunks of each file in input order.
+
+    Files are processed by a pool of worker processes that each extract, clean and chunk one file at
+    a time. A file's chunks are yielded as soon as it and every file before it are done, so they can be
+    written out while later files are still being chunked; results that finish early are held until
+    then. A file that fails to process is logged and skipped. If a worker dies (e.g. a crash inside the
+    PDF parser), the files that are not done yet are retried one at a time in a fresh worker process,
+    and any file that crashes its worker again is skipped.
+
+    Args:
+        filepaths (List[str]): Paths of the files to chunk.
+        chunk_size (int, optional): Number of words per chunk. Defaults to 512.
+        chunk_overlap (int, optional): Number of overlapping words between chunks. Defaults to 32.
+        num_workers (int, optional): Number of worker processes. Defaults to the CPU count if None.
+            Set to 1 to process files sequentially in the current process.
+        progress_callback (callable, optional): Called with the number of completed files after each file.
+        keep_original (bool, optional): Chunk with prepare_original to keep each file's original text.
+            Defaults to False.
+        track_pages (bool, optional): Record the first and last page of each chunk. Defaults to False.
+        errors (dict, optional): If given, the error message of every file that failed to process is stored
+            in it, keyed by the file's index in filepaths. Files that hold no text are not errors.
+
+    Yields:
+        list or dict: For every input file, its list of chunks (or dictionary of per-chunk columns if
+            keep_original or track_pages is set), or None if the file was skipped.
+    """
+    if num_workers is None:
+        num_workers = os.cpu_count() or 1
+    num_workers = max(1, min(num_workers, len(filepaths)))
+
+    tasks = [(idx, file, chunk_size, chunk_overlap, keep_original, track_pages) for idx, file in enumerate(filepaths)]
+    pending = {}
+    next_idx = 0
+    completed = 0
+
+    def _collect(result):
+        nonlocal completed
+        idx, chunks, error = result
+        if error is not None:
+            logging.warning(error)
+            if errors is not None:
+                errors[idx] = error
+        pending[idx] = chunks
+        completed += 1
+        if progress_callback is not None:
+            progress_callback(completed)
+
+    broken = False
+    if num_workers > 1:
+        logging.info(f"Chunking files with {num_workers} worker processes...")
+        try:
+            with ProcessPoolExecutor(max_workers=num_workers) as executor:
+                futures = [executor.submit(_chunk_file, task) for task in tasks]
+                for future in tqdm(as_completed(futures), total=len(futures), desc="Chunking files"):
+                    _collect(future.result())
+                    while next_idx in pending:
+                        yield pending.pop(next_idx)
+                        next_idx += 1
+        except BrokenProcessPool as e:
+            # A worker died (e.g. a crash inside the PDF parser). Retry the remaining files in isolation.
+            logging.warning(f"Worker pool failed, retrying the remaining files one at a time: {e}")
+            broken = True
+
+    remaining = [task for task in tasks[next_idx:] if task[0] not in pending]
+    results = _chunk_isolated(remaining) if broken else map(_chunk_file, remaining)
+    for result in tqdm(results, total=len(remaining), desc="Chunking files", disable=len(remaining) == 0):
+        _collect(result)
+        while next_idx in pending:
+            yield pending.pop(next_idx)
+            next_idx += 1
+
+def chunk_files(
+        filepaths:List[str]
+        , chunk_size=default_chunk_size, chunk_overlap=default_chunk_overlap
+        , num_workers:int = None
+        , progress_callback=None
+        , keep_original:bool = False
+        , track_pages:bool = False
+        , errors:dict = None
+        ):
+    """
+    Chunk a list of files, optionally in parallel, and return the chunks in input order.
+
+    Same as iter_chunk_files, but collects the chunks of all files into a list.
+
+    Args:
+        filepaths (List[str]): Paths of the files to chunk.
+        chunk_size (int, optional): Number of words per chunk. Defaults to 512.
+        chunk_overlap (int, optional): Number of overlapping words between chunks. Defaults to 32.
+        num_workers (int, optional): Number of worker processes. Defaults to the CPU count if None.
+            Set to 1 to process files sequentially in the current process.
+        progress_callback (callable, optional): Called with the number of completed files after each file.
+        keep_original (bool, optional): Chunk with prepare_original to keep each file's original text.
+            Defaults to False.
+        track_pages (bool, optional): Record the first and last page of each chunk. Defaults to False.
+        errors (dict, optional): If given, the error message of every file that failed to process is stored
+            in it, keyed by the file's index in filepaths. Files that hold no text are not errors.
+
+    Returns:
+        list: One entry per input file, holding its list of chunks (or dictionary of per-chunk columns
+            if keep_original or track_pages is set) or None if the file was skipped.
+    """
+    return list(iter_chunk_files(
+        filepaths
+        , chunk_size=chunk_size, chunk_overlap=chunk_overlap
+        , num_workers=num_workers
+        , progress_callback=progress_callback
+        , keep_original=keep_original
+        , track_pages=track_pages
+        , errors=errors
+        ))
+
 def chunk_db(
         file_list_path:str = None
         , file_list = None
-        , output_path = "./search_utils/chunked_db.json"
+        , output_path = "./search_utils/chunk_store.bin"
         , chunk_size=default_chunk_size, chunk_overlap=default_chunk_overlap
         , progress_callback=None
+        , num_workers:int = None
+        , keep_original:bool = False
+        , track_pages:bool = False
         ):
     """
     Process a list of files into preprocessed text chunks and save to a database.
     
     This function takes a file list, processes each file (PDF or text) into overlapping chunks,
-    preprocesses the text, and saves the results to a JSON file. Each chunk is associated with
-    its source file ID for traceability.
+    preprocesses the text, and saves the results to a binary chunk store (see chunkstore.py). Each
+    chunk is associated with its source file ID for traceability. Files are processed in parallel by a
+    pool of worker processes; chunks are always stored in file list order, and each file's chunks are
+    written to the store as soon as they are ready rather than collected in memory first.
 
     Args:
         file_list_path (str, optional): Path to JSON file containing the file list with required keys:
             'filepath', 'last_modified', 'file_size', 'date_added', 'file_id'.
         file_list (dict, optional): Pre-loaded file list dictionary. If provided, file_list_path is ignored.
-        output_path (str, optional): Path where the chunk database JSON file will be saved.
-            Defaults to "./search_utils/chunked_db.json".
+        output_path (str, optional): Path where the chunk store will be saved.
+            Defaults to "./search_utils/chunk_store.bin".
         chunk_size (int, optional): Number of words per chunk. Defaults to 512.
         chunk_overlap (int, optional): Number of overlapping words between chunks. Defaults to 32.
-        progress_callback (callable, optional): Callback function called with progress updates (currently unused).
+        progress_callback (callable, optional): Callback function called with the number of completed files
+            after each file.
+        num_workers (int, optional): Number of worker processes used for chunking. Defaults to the CPU count
+            if None. Set to 1 to disable multiprocessing.
+        keep_original (bool, optional): Also store the original text of every file once, with per-chunk
+            offsets into it, so get_original_text can return a chunk's unprocessed text. Defaults to False.
+        track_pages (bool, optional): Record the first and last page of every chunk ('page_start', 'page_end',
+            1-based, 0 for non-PDF files). The chunks are the same either way: the joined PDF text is
+            preprocessed in one pass, as in prepare_PDF, and page offsets are mapped onto it. Defaults to False.
 
     Returns:
-        dict: Dictionary containing:
+        chunktable.ChunkTable: The chunk database, memory-mapped from the saved store. It reads like a
+            dictionary containing:
             - 'processed_chunk': List of preprocessed text chunks
             - 'file_id': List of file IDs corresponding to each chunk
             - 'chunk_id': List of sequential chunk identifiers
+            - 'text_start', 'text_end', 'documents': Original text offsets and documents (only if keep_original)
+            - 'page_start', 'page_end': First and last page of each chunk (only if track_pages)
 
     Raises:
         ValueError: If neither file_list_path nor file_list are provided and default location is not found,
@@ -429,14 +1050,14 @@ def chunk_db(
         if file_list_path is None:
             # Search for a default location
             try:
-                with open("./search_utils/chunked_db.json", 'r') as f:
+                with open("./search_utils/file_list.json", 'r') as f:
                     file_list = json.load(f)
             except Exception as e:
-                raise ValueError("Either index_path or retriever must be provided.")
-        
-        # Load the file list from the given path
-        with open(file_list_path, 'r') as f:
-            file_list = json.load(f)
+                raise ValueError("Either file_list_path or file_list must be provided.")
+        else:
+            # Load the file list from the given path
+            with open(file_list_path, 'r') as f:
+                file_list = json.load(f)
 
     # Check if the file_list has the required keys
     if not all(key in file_list for key in file_list_defaults):
@@ -444,56 +1065,183 @@ def chunk_db(
     else:
         logging.info("Successfully loaded existing file list.")
 
-    full_dict = {
-        'processed_chunk': []
-        , 'file_id': []
-        , 'file_name': []
-    }
-
     assert len(file_list['filepath']) > 0, "No files found in the file list."
 
-    # Process files
+    # Process files, streaming each file's chunks to the store; chunk IDs are implicit in the store
     logging.info(f"Processing {len(file_list['filepath'])} files for chunking...")
-    for idx, file in enumerate(tqdm(file_list['filepath'], desc="Chunking files")):
-        #logging.info(f"Processing file {idx + 1}/{len(file_list['filepath'])}: {file}")
-        # Find the corresponding file_id
-        f_id = file_list['file_id'][idx]
-
+    errors = {}
+    with ChunkStoreWriter(output_path, keep_original=keep_original, track_pages=track_pages) as writer:
+        file_chunks = iter_chunk_files(
+            file_list['filepath']
+            , chunk_size=chunk_size, chunk_overlap=chunk_overlap
+            , num_workers=num_workers
+            , progress_callback=progress_callback
+            , keep_original=keep_original
+            , track_pages=track_pages
+            , errors=errors
+            )
+        for f_id, chunks in zip(file_list['file_id'], file_chunks):
+            if chunks is not None:
+                writer.add_file(f_id, chunks)
+
+        logging.info("Done processing files.")
+
+        # Record the file state and settings the chunks were built from, for incremental updates
+        failed = {file_list['file_id'][i] for i in errors}
+        writer.metadata['source_files'] = _file_state(file_list, failed)
+        writer.metadata['chunk_size'] = chunk_size
+        writer.metadata['chunk_overlap'] = chunk_overlap
+
+    logging.info(f"Processed {writer.num_chunks} chunks from {len(file_list['filepath'])} files.")
+    logging.info(f"Data saved to {output_path}")
 
-        # Confirm file exists
-        if not os.path.exists(file):
-            logging.warning(f"Warning: File {file} does not exist, skipping.")
-            continue
+    return load_chunk_store(output_path)
 
-        # determine file type
-        if file.endswith('.pdf'):
-            chunks = prepare_PDF(file, _chunk_overlap=chunk_overlap, _chunk_size=chunk_size)
+def _file_state(file_list, failed=()):
+    """
+    Build a mapping of file_id to the metadata used for change detection.
 
-        else:
-            chunks = prepare_text(file, _chunk_overlap=chunk_overlap, _chunk_size=chunk_size)
-        
-        if chunks is not None:
-            full_dict['processed_chunk'].extend(chunks)
-            full_dict['file_id'].extend([f_id] * len(chunks))
+    Files are compared by modification time and exact size in bytes. A file without a byte size (from a
+    file list written by an earlier version, until it is scanned again) falls back to its size in MB.
 
-        # Call the progress callback if provided
-        #if progress_callback is not None:
-        #    progress_callback(idx + 1)
+    Args:
+        file_list (dict): File list dictionary as returned by file_scanner.
+        failed (set, optional): File IDs of files that failed to process. They are left out, so they are
+            retried by the next update. Defaults to none.
 
-    logging.info("Done processing files.")
+    Returns:
+        dict: Dictionary mapping each file_id to [last_modified, size].
+    """
+    sizes = file_list.get(file_bytes_key) or [None] * len(file_list['file_id'])
+    return {
+        f_id: [mod_time, size_mb if size is None else size]
+        for f_id, mod_time, size_mb, size in zip(
+            file_list['file_id'], file_list['last_modified'], file_list['file_size'], sizes)
+        if f_id not in failed
+    }
 
-    # Add a chunk id field which is just the number
-    full_dict['chunk_id'] = list(range(len(full_dict['processed_chunk'])))
+def save_chunk_db(full_dict, output_path = "./search_utils/chunk_store.bin"):
+    """
+    Save a chunk database to a chunk store, or to a JSON file if output_path ends in '.json'.
 
-    # Export as JSON
+    Args:
+        full_dict (dict or chunktable.ChunkTable): Chunk database dictionary as returned by chunk_db, or a
+            ChunkTable, which is saved to JSON as the dictionary it converts to.
+        output_path (str, optional): Path where the chunk database will be saved.
+            Defaults to "./search_utils/chunk_store.bin".
+    """
     logging.info(f"Saving chunk database to file...")
-    with open(output_path, 'w', encoding='utf-8') as f:
-        json.dump(full_dict, f, ensure_ascii=False, indent=2)
-
-    logging.info(f"Processed {len(full_dict['processed_chunk'])} chunks from {len(file_list['filepath'])} files.")
+    if output_path.endswith('.json'):
+        if isinstance(full_dict, ChunkTable):
+            full_dict = full_dict.to_dict()
+        with open(output_path, 'w', encoding='utf-8') as f:
+            json.dump(full_dict, f, ensure_ascii=False, indent=2)
+    else:
+        write_chunk_store(full_dict, output_path)
     logging.info(f"Data saved to {output_path}")
 
-    return full_dict
+def update_chunk_db(
+        chunks
+        , file_list
+        , output_path = "./search_utils/chunk_store.bin"
+        , chunk_size=default_chunk_size, chunk_overlap=default_chunk_overlap
+        , progress_callback=None
+        , num_workers:int = None
+        , keep_original:bool = False
+        , track_pages:bool = False
+        ):
+    """
+    Incrementally update an existing chunk database to match a new file list.
+
+    The 'last_modified' time and size in bytes of every file are compared against the state recorded when
+    the chunk database was last built. Only files that were added or changed are re-extracted and re-chunked.
+    Chunks of deleted or changed files are dropped, and all other chunks are kept as they are. New chunks
+    are appended after the kept ones and chunk IDs are renumbered. The new database is written to a
+    temporary file and moved into place, so chunks may be a store memory-mapped from output_path.
+
+    If the chunk database has no recorded file state (e.g. it was created by an older version) or was
+    built with a different chunk size, overlap, keep_original or track_pages setting, the whole database
+    is rebuilt with chunk_db instead.
+
+    Args:
+        chunks (dict or chunktable.ChunkTable): Existing chunk database as returned by chunk_db.
+        file_list (dict): Current file list dictionary, as returned by file_scanner.
+        output_path (str, optional): Path where the chunk store will be saved.
+            Defaults to "./search_utils/chunk_store.bin".
+        chunk_size (int, optional): Number of words per chunk. Defaults to 512.
+        chunk_overlap (int, optional): Number of overlapping words between chunks. Defaults to 32.
+        progress_callback (callable, optional): Callback function called with the number of completed files
+            after each re-chunked file.
+        num_workers (int, optional): Number of worker processes used for chunking. Defaults to the CPU count
+            if None. Set to 1 to disable multiprocessing.
+        keep_original (bool, optional): Keep the original text of every file, as in chunk_db. Defaults to False.
+        track_pages (bool, optional): Record page numbers of every chunk, as in chunk_db. Defaults to False.
+
+    Returns:
+        chunktable.ChunkTable: The updated chunk database, in the same format as chunk_db.
+
+    Note:
+        Files that failed to process are not recorded in the file state, so they are retried by the next
+        update. A database whose state was recorded in whole megabytes by an earlier version is re-chunked
+        once, as every file's size then appears changed.
+    """
+    if ('source_files' not in chunks
+            or chunks.get('chunk_size') != chunk_size
+            or chunks.get('chunk_overlap') != chunk_overlap
+            or ('documents' in chunks) != keep_original
+            or ('page_start' in chunks) != track_pages):
+        logging.info("Chunk database cannot be updated incrementally, rebuilding it.")
+        return chunk_db(
+            file_list=file_list, output_path=output_path
+            , chunk_size=chunk_size, chunk_overlap=chunk_overlap
+            , progress_callback=progress_callback, num_workers=num_workers
+            , keep_original=keep_original, track_pages=track_pages
+            )
+
+    old_state = chunks['source_files']
+    new_state = _file_state(file_list)
+
+    # Files whose chunks must be (re)built, and files whose old chunks are now invalid
+    to_chunk = [
+        i for i, f_id in enumerate(file_list['file_id'])
+        if old_state.get(f_id) != new_state[f_id]
+    ]
+    stale = {f_id for f_id, state in old_state.items() if new_state.get(f_id) != state}
+    added = sum(1 for i in to_chunk if file_list['file_id'][i] not in old_state)
+    logging.info(
+        f"Incremental update: {added} added, {len(to_chunk) - added} changed, "
+        f"{len(stale) - (len(to_chunk) - added)} deleted files."
+    )
+
+    errors = {}
+    with ChunkStoreWriter(output_path, keep_original=keep_original, track_pages=track_pages) as writer:
+        # Keep chunks of unchanged files
+        writer.add_chunks(chunks, exclude=stale)
+
+        # Re-chunk added and changed files
+        if to_chunk:
+            file_chunks = iter_chunk_files(
+                [file_list['filepath'][i] for i in to_chunk]
+                , chunk_size=chunk_size, chunk_overlap=chunk_overlap
+                , num_workers=num_workers
+                , progress_callback=progress_callback
+                , keep_original=keep_original
+                , track_pages=track_pages
+                , errors=errors
+                )
+            for i, new_chunks in zip(to_chunk, file_chunks):
+                if new_chunks is not None:
+                    writer.add_file(file_list['file_id'][i], new_chunks)
+
+        # Leave out files that failed, so the next update retries them
+        failed = {file_list['file_id'][to_chunk[j]] for j in errors}
+        writer.metadata['source_files'] = {f_id: state for f_id, state in new_state.items() if f_id not in failed}
+        writer.metadata['chunk_size'] = chunk_size
+        writer.metadata['chunk_overlap'] = chunk_overlap
+
+    logging.info(f"Chunk database now holds {writer.num_chunks} chunks from {len(file_list['filepath'])} files.")
+
+    return load_chunk_store(output_path)
 
 def chunk_db_page(
         file_list_path:str = None
@@ -501,29 +1249,33 @@ def chunk_db_page(
         , output_file = "chunked_db"
         , chunk_size=default_chunk_size, chunk_overlap=default_chunk_overlap
         , progress_callback=None
+        , num_workers:int = None
         ):
     """
     Process files into preprocessed text chunks with page number tracking for PDFs.
     
-    Similar to chunk_db but additionally tracks page numbers for PDF files. For non-PDF files,
-    page_number is set to 0. The resulting database includes page information for each chunk,
-    enabling page-level document navigation.
+    Same as chunk_db with track_pages=True. The pages of each PDF are joined and the whole document is
+    preprocessed and chunked in one pass, as prepare_PDF does, so chunks run across page boundaries and
+    every chunk records the first and last page it spans. For non-PDF files, the page numbers are set to 0.
 
     Args:
         file_list_path (str, optional): Path to JSON file containing the file list with required keys:
             'filepath', 'last_modified', 'file_size', 'date_added', 'file_id'.
         file_list (dict, optional): Pre-loaded file list dictionary. If provided, file_list_path is ignored.
-        output_file (str, optional): Filename (without extension) for the output JSON file.
-            Defaults to "chunked_db" (saved as "./chunked_db.json").
+        output_file (str, optional): Filename (without extension) for the output chunk store.
+            Defaults to "chunked_db" (saved as "./chunked_db.bin").
         chunk_size (int, optional): Number of words per chunk. Defaults to 512.
         chunk_overlap (int, optional): Number of overlapping words between chunks. Defaults to 32.
         progress_callback (callable, optional): Callback function called with progress updates after each file.
+        num_workers (int, optional): Number of worker processes used for chunking. Defaults to the CPU count
+            if None.
 
     Returns:
-        dict: Dictionary containing:
+        chunktable.ChunkTable: The chunk database, reading like a dictionary containing:
             - 'processed_chunk': List of preprocessed text chunks
             - 'file_id': List of file IDs corresponding to each chunk
-            - 'page_number': List of page numbers (0 for non-PDF files)
+            - 'page_start': List of the first page of each chunk (0 for non-PDF files)
+            - 'page_end': List of the last page of each chunk (0 for non-PDF files)
             - 'chunk_id': List of sequential chunk identifiers
 
     Raises:
@@ -531,79 +1283,15 @@ def chunk_db_page(
             or if the file list format is invalid.
         AssertionError: If no files are found in the file list.
     """
-
-    # If given a file_list, don't load anything
-    if file_list is None:
-        if file_list_path is None:
-            # Search for a default location
-            try:
-                with open("./search_utils/chunked_db.json", 'r') as f:
-                    file_list = json.load(f)
-            except Exception as e:
-                raise ValueError("Either index_path or retriever must be provided.")
-        
-        # Load the file list from the given path
-        with open(file_list_path, 'r') as f:
-            file_list = json.load(f)
-
-    # Check if the file_list has the required keys
-    if not all(key in file_list for key in file_list_defaults):
-        raise ValueError("Invalid file list format. Missing required keys.")
-    else:
-        logging.info("Successfully loaded existing file list.")
-
-    full_dict = {
-        'processed_chunk': []
-        , 'file_id': []
-        , 'page_number': []
-    }
-
-    assert len(file_list['filepath']) > 0, "No files found in the file list."
-
-    # Process files
-    logging.info(f"Processing {len(file_list['filepath'])} files for chunking...")
-    for idx, file in enumerate(file_list['filepath']):
-        logging.info(f"Processing file {idx + 1}/{len(file_list['filepath'])}: {file}")
-        # Find the corresponding file_id
-        f_id = file_list['file_id'][idx]
-
-        # Confirm file exists
-        if not os.path.exists(file):
-            logging.warning(f"Warning: File {file} does not exist, skipping.")
-            continue
-
-        # determine file type
-        if file.endswith('.pdf'):
-            iter_dict = prepare_PDF(file, _chunk_overlap=chunk_overlap, _chunk_size=chunk_size)
-
-        else:
-            iter_dict = {
-                'processed_chunk': prepare_text(file, _chunk_overlap=chunk_overlap, _chunk_size=chunk_size)
-            }
-            iter_dict['page_number'] = [0] * len(iter_dict['processed_chunk'])
-        
-        full_dict['processed_chunk'].extend(iter_dict['processed_chunk'])
-        full_dict['file_id'].extend([f_id] * len(iter_dict['processed_chunk']))
-        full_dict['page_number'].extend(iter_dict['page_number'])
-
-        # Call the progress callback if provided
-        if progress_callback is not None:
-            progress_callback(idx + 1)
-
-    logging.info("Done processing files.")
-
-    # Add a chunk id field which is just the number
-    full_dict['chunk_id'] = list(range(len(full_dict['processed_chunk'])))
-
-    # Export as JSON
-    logging.info(f"Saving chunk database to file...")
-    with open(f'./{output_file}.json', 'w', encoding='utf-8') as f:
-        json.dump(full_dict, f, ensure_ascii=False, indent=2)
-
-    logging.info(f"Processed {len(full_dict['processed_chunk'])} chunks from {len(file_list['filepath'])} files.")
-    logging.info(f"Data saved to ./{output_file}.json")
-
-    return full_dict
+    return chunk_db(
+        file_list_path=file_list_path
+        , file_list=file_list
+        , output_path=f'./{output_file}.bin'
+        , chunk_size=chunk_size, chunk_overlap=chunk_overlap
+        , progress_callback=progress_callback
+        , num_workers=num_workers
+        , track_pages=True
+        )
 
 def convert_results(results, chunks, file_dict):
     """
@@ -613,7 +1301,8 @@ def convert_results(results, chunks, file_dict):
         chunks (dict): The chunks data with 'processed_chunk', 'chunk_id', and 'file_id'.
         file_dict (dict): A dictionary mapping file_id to file properties.
     Returns:
-        dict: A dictionary with full chunk and file properties.
+        dict: A dictionary with full chunk and file properties, plus 'original_chunk' if the chunk
+            database keeps original text and 'page_start' / 'page_end' if it tracks page numbers.
     """
     results_full = {
         'processed_chunk': [chunks['processed_chunk'][i] for i in results['id']],
@@ -624,4 +1313,13 @@ def convert_results(results, chunks, file_dict):
 
     results_full['file_properties'] = [file_dict[i] for i in results_full['file_id']]
 
+    # Original, unprocessed text if the chunk database keeps it
+    if 'documents' in chunks:
+        results_full['original_chunk'] = [get_original_text(chunks, i) for i in results['id']]
+
+    # Page range of each chunk if the chunk database tracks it
+    if 'page_start' in chunks:
+        results_full['page_start'] = [chunks['page_start'][i] for i in results['id']]
+        results_full['page_end'] = [chunks['page_end'][i] for i in results['id']]
+
     return results_full
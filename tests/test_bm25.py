@@ -0,0 +1,55 @@
+import random
+import pytest
+from indexes import create_bm25_index
+import queries
+from filelevel import file_candidate_factor
+from queries import query_bm25, query_bm25_batch
+
+words = ['market', 'price', 'inflation', 'wage', 'labor', 'supply', 'demand', 'policy', 'rate', 'bank',
+         'trade', 'export', 'growth', 'capital', 'tax', 'budget', 'debt', 'credit', 'output', 'money']
+
+def _chunks(num_chunks, seed=0):
+    rng = random.Random(seed)
+    return {
+        'processed_chunk': [' '.join(rng.choice(words) for _ in range(rng.randint(5, 40))) for _ in range(num_chunks)],
+        'file_id': [f'f{i // 10}' for i in range(num_chunks)],
+    }
+
+def test_query_bm25_batch_matches_query_bm25(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'search_utils').mkdir()
+    retriever = create_bm25_index(chunks=_chunks(200))
+
+    rng = random.Random(1)
+    queries = [' '.join(rng.sample(words, rng.randint(1, 4))) for _ in range(50)] + ['nothing matches here']
+    batch = query_bm25_batch(queries, retriever=retriever, num_results=5, show_progress=False)
+
+    assert len(batch) == len(queries)
+    for query, result in zip(queries, batch):
+        single = query_bm25(query, retriever=retriever, num_results=5)
+        assert result['score'] == pytest.approx(single['score'])
+        # Chunks tied at the cut-off score may differ; everything scored above it must match
+        if single['score']:
+            above = lambda r: {i for i, s in zip(r['id'], r['score']) if s > single['score'][-1] + 1e-9}
+            assert above(result) == above(single)
+
+def test_query_files_stops_when_the_query_matches_few_files(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'search_utils').mkdir()
+    chunks = _chunks(200)
+    # Only the chunks of file f3 mention the query term
+    chunks['processed_chunk'][30:33] = ['unique zebra term', 'zebra again zebra', 'market zebra']
+    retriever = create_bm25_index(chunks=chunks)
+
+    requested = []
+    def recording_query_bm25(query, **options):
+        requested.append(options['num_results'])
+        return query_bm25(query, **options)
+    monkeypatch.setattr(queries, 'query_bm25', recording_query_bm25)
+
+    results = queries.query_files('zebra', chunks, search='bm25', num_files=3, retriever=retriever)
+    assert results['file_id'] == ['f3']
+    assert results['id'][0] in (30, 31, 32)
+    assert results['score'] == [1.0]
+    # One search is enough; the candidates are not grown up to every chunk
+    assert requested == [file_candidate_factor * 3]
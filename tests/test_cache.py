@@ -0,0 +1,83 @@
+import os
+import numpy as np
+import pytest
+from cache import ResultCache, bump_index_version, read_index_version
+from filters import mask_key
+
+result = {'id': [3, 1], 'score': [0.75, 0.25]}
+
+@pytest.fixture
+def search_utils(tmp_path):
+    return str(tmp_path)
+
+def test_hit_and_miss(search_utils):
+    cache = ResultCache(search_utils)
+    assert cache.get('bm25', 'wage growth', num_results=2) is None
+    cache.put('bm25', 'wage growth', result, num_results=2)
+    assert cache.get('bm25', 'wage growth', num_results=2) == result
+    assert cache.stats() | {'hit_rate': None} == {'hits': 1, 'disk_hits': 0, 'misses': 1, 'hit_rate': None,
+                                                   'entries': 1, 'max_entries': 256}
+
+    # Returned results are copies, so callers can't change what is cached
+    cache.get('bm25', 'wage growth', num_results=2)['id'].append(7)
+    assert cache.get('bm25', 'wage growth', num_results=2) == result
+
+def test_options_and_mask_change_the_key(search_utils):
+    cache = ResultCache(search_utils)
+    mask = np.array([True, False, True])
+    cache.put('bm25', 'wage', result, num_results=2, mask=mask_key(mask))
+    assert cache.get('bm25', 'wage', num_results=2, mask=mask_key(mask)) == result
+    assert cache.get('bm25', 'wage', num_results=2, mask=mask_key(mask.copy())) == result
+    assert cache.get('bm25', 'wage', num_results=2, mask=mask_key(~mask)) is None
+    assert cache.get('bm25', 'wage', num_results=2) is None
+    assert cache.get('bm25', 'wage', num_results=3, mask=mask_key(mask)) is None
+    assert cache.get('nn', 'wage', num_results=2, mask=mask_key(mask)) is None
+    assert cache.get('bm25', 'Wage', num_results=2, mask=mask_key(mask)) is None
+    # Option order doesn't matter
+    cache.put('direct', 'wage', result, case_sensitive=True, num_results=2)
+    assert cache.get('direct', 'wage', num_results=2, case_sensitive=True) == result
+
+def test_bump_index_version_invalidates(search_utils):
+    cache = ResultCache(search_utils, persist=True)
+    other = ResultCache(search_utils, persist=True)
+    assert read_index_version(search_utils) is None
+    cache.put('bm25', 'wage', result, num_results=2)
+    assert other.get('bm25', 'wage', num_results=2) == result
+
+    for _ in range(3):
+        # Bumps in quick succession must all be noticed, by this process and any other
+        version = bump_index_version(search_utils)
+        assert read_index_version(search_utils) == version
+        assert cache.get('bm25', 'wage', num_results=2) is None
+        assert other.get('bm25', 'wage', num_results=2) is None
+        cache.put('bm25', 'wage', result, num_results=2)
+        assert other.get('bm25', 'wage', num_results=2) == result
+
+def test_disk_tier_survives_a_restart(search_utils):
+    bump_index_version(search_utils)
+    ResultCache(search_utils, persist=True).put('bm25', 'wage', result, num_results=2)
+
+    restarted = ResultCache(search_utils, persist=True)
+    assert restarted.get('bm25', 'wage', num_results=2) == result
+    assert restarted.stats()['disk_hits'] == 1
+    # The entry is now in memory too
+    assert restarted.get('bm25', 'wage', num_results=2) == result
+    assert restarted.stats()['disk_hits'] == 1
+    # Without persist, nothing is read from disk
+    assert ResultCache(search_utils).get('bm25', 'wage', num_results=2) is None
+
+    restarted.clear()
+    assert ResultCache(search_utils, persist=True).get('bm25', 'wage', num_results=2) is None
+
+def test_lru_and_disk_limits(search_utils):
+    cache = ResultCache(search_utils, max_entries=2, persist=True, max_disk_entries=10)
+    for i in range(3):
+        cache.put('bm25', f'q{i}', result, num_results=2)
+    assert cache.stats()['entries'] == 2
+    # q0 was evicted from memory but is still on disk
+    assert cache.get('bm25', 'q0', num_results=2) == result
+    assert cache.stats()['disk_hits'] == 1
+
+    for i in range(3, 30):
+        cache.put('bm25', f'q{i}', result, num_results=2)
+    assert len([name for name in os.listdir(os.path.join(search_utils, 'result_cache')) if name.endswith('.json')]) <= 10
@@ -0,0 +1,54 @@
+import random
+import pytest
+from utils import preprocess, prepare_original, prepare_text, get_original_text, _normalize_offsets
+
+def test_normalize_offsets_matches_preprocess():
+    rng = random.Random(0)
+    pieces = ['a', 'b', 'é', ' ', '  ', '-', '\n', '-\n', '.', ',', ',,', '!!!', '?', '\t', '\x1c', ':', '@', ' .']
+    for _ in range(5000):
+        text = ''.join(rng.choice(pieces) for _ in range(rng.randint(0, 30)))
+        normalized, positions = _normalize_offsets(text)
+        assert normalized == preprocess(text)
+        assert len(positions) == len(normalized)
+        # Characters that aren't replaced by a space keep their value
+        assert all(c == ' ' or text[p] == c for c, p in zip(normalized, positions))
+
+@pytest.mark.parametrize('chunk_size, chunk_overlap', [(4, 1), (7, 3), (512, 32)])
+def test_prepare_original_matches_prepare_text(tmp_path, chunk_size, chunk_overlap):
+    rng = random.Random(chunk_size)
+    words = ['alpha', 'beta,,', 'gam-\nma', 'delta...', '  ', '\t', 'eps@lon', 'zeta!!', 'é', '\n\n']
+    path = tmp_path / 'doc.txt'
+    path.write_text(' '.join(rng.choice(words) for _ in range(300)), encoding='utf-8')
+
+    original = prepare_original(str(path), chunk_size, chunk_overlap)
+    assert original['processed_chunk'] == prepare_text(str(path), chunk_size, chunk_overlap)
+
+    chunks = {
+        'processed_chunk': original['processed_chunk'],
+        'file_id': ['f'] * len(original['processed_chunk']),
+        'text_start': original['text_start'],
+        'text_end': original['text_end'],
+        'documents': {'f': original['document']},
+    }
+    for chunk_id, processed in enumerate(original['processed_chunk']):
+        # The original text of a chunk covers exactly its words
+        assert preprocess(get_original_text(chunks, chunk_id)) == processed.strip()
+
+def test_prepare_pdf_pages_matches_prepare_pdf(tmp_path):
+    pymupdf = pytest.importorskip('pymupdf')
+    from utils import prepare_PDF, prepare_PDF_pages
+
+    path = str(tmp_path / 'doc.pdf')
+    doc = pymupdf.open()
+    # Pages end in a hyphen and trailing spaces, which preprocessing each page on its own would strip
+    for number in range(4):
+        page = doc.new_page()
+        page.insert_text((72, 72), f"onomics page {number} text,, with a few more words on it ..", fontsize=11)
+        page.insert_text((72, 100), f"ec{number}-      ", fontsize=11)
+    doc.save(path)
+
+    for chunk_size, chunk_overlap in [(3, 1), (512, 32)]:
+        pages = prepare_PDF_pages(path, chunk_size, chunk_overlap)
+        assert pages['processed_chunk'] == prepare_PDF(path, chunk_size, chunk_overlap)
+        assert pages['page_start'][0] == 1 and pages['page_end'][-1] == 4
+        assert all(start <= end for start, end in zip(pages['page_start'], pages['page_end']))
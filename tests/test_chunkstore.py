@@ -0,0 +1,54 @@
+import json
+import pytest
+from chunkstore import ChunkStoreWriter, write_chunk_store, load_chunk_store, load_chunk_db, _header
+from chunktable import DocumentMap
+from utils import convert_results
+from test_chunktable import _chunks, file_dict
+
+def _footer(path):
+    with open(path, 'rb') as f:
+        _, _, _, footer_offset, footer_length = _header.unpack(f.read(_header.size))
+        f.seek(footer_offset)
+        return json.loads(f.read(footer_length).decode('utf-8'))
+
+@pytest.mark.parametrize('mmap', [True, False])
+def test_chunk_store_round_trip(tmp_path, mmap):
+    chunks = _chunks()
+    path = str(tmp_path / 'chunk_store.bin')
+    write_chunk_store(chunks, path)
+    table = load_chunk_store(path, mmap=mmap)
+
+    assert table.to_dict() == chunks
+    assert isinstance(table['documents'], DocumentMap)
+    assert dict(table['documents']) == chunks['documents']
+    results = {'id': [4, 0, 5, 2], 'score': [0.4, 0.3, 0.2, 0.1]}
+    assert convert_results(results, table, file_dict) == convert_results(results, chunks, file_dict)
+
+    # Documents are a section of their own; the footer only keeps the small keys
+    footer = _footer(path)
+    assert 'documents' not in footer['metadata']
+    assert {'documents', 'document_offsets', 'document_index'} <= set(footer['sections'])
+
+    # Copying a loaded store copies its documents
+    copy_path = str(tmp_path / 'copy.bin')
+    write_chunk_store(table, copy_path)
+    assert load_chunk_db(copy_path).to_dict() == chunks
+
+def test_chunk_store_without_original_text(tmp_path):
+    chunks = _chunks()
+    for key in ('documents', 'text_start', 'text_end'):
+        del chunks[key]
+    path = str(tmp_path / 'chunk_store.bin')
+    write_chunk_store(chunks, path)
+    table = load_chunk_store(path)
+    assert 'documents' not in table
+    assert 'documents' not in _footer(path)['sections']
+    assert table.to_dict() == chunks
+
+def test_chunk_store_writer_abort_removes_temporary_files(tmp_path):
+    path = str(tmp_path / 'chunk_store.bin')
+    with pytest.raises(RuntimeError):
+        with ChunkStoreWriter(path, keep_original=True) as writer:
+            writer.add_file('a', {'processed_chunk': ['alpha'], 'text_start': [0], 'text_end': [5], 'document': 'Alpha'})
+            raise RuntimeError
+    assert list(tmp_path.iterdir()) == []
@@ -0,0 +1,48 @@
+import numpy as np
+from chunktable import ChunkTable
+from utils import convert_results
+
+documents = {'a': 'Alpha beta,, gamma.\nDelta', 'b': 'Zeta ée — eta theta', 'c': ''}
+
+def _chunks():
+    return {
+        'processed_chunk': ['alpha beta, gamma.', 'delta', 'zeta ée', '— eta theta', 'gamma. delta', ''],
+        'file_id': ['a', 'a', 'b', 'b', 'a', 'c'],
+        'chunk_id': list(range(6)),
+        'text_start': [0, 21, 0, 8, 14, 0],
+        'text_end': [19, 26, 7, 19, 26, 0],
+        'page_start': [1, 1, 0, 0, 1, 0],
+        'page_end': [1, 2, 0, 1, 2, 0],
+        'documents': documents,
+        'source_files': {'a': [1.0, 25], 'b': [2.0, 21], 'c': [3.0, 0]},
+        'chunk_size': 4,
+    }
+
+file_dict = {'a': {'filename': 'a.txt'}, 'b': {'filename': 'b.pdf'}, 'c': {'filename': 'c.txt'}}
+
+def test_chunk_table_reads_like_the_dictionary():
+    chunks = _chunks()
+    table = ChunkTable.from_dict(chunks)
+    assert table.num_chunks == 6 and table.num_files == 3
+    for key in ('processed_chunk', 'file_id', 'chunk_id', 'text_start', 'text_end', 'page_start', 'page_end'):
+        assert list(table[key]) == chunks[key]
+        assert table[key][1:4] == chunks[key][1:4]
+        assert table[key][-1] == chunks[key][-1]
+    assert table['documents'] == documents
+    assert set(table) == set(chunks)
+    # The chunks of file 'a' aren't contiguous
+    assert table.chunks_of('a').tolist() == [0, 1, 4]
+    assert table.chunks_of('b').tolist() == [2, 3]
+    assert table.chunks_of('missing').tolist() == []
+    assert table.to_dict() == chunks
+
+def test_convert_results_matches_the_dictionary():
+    chunks = _chunks()
+    table = ChunkTable.from_dict(chunks)
+    results = {'id': [4, 0, 5, 2], 'score': [0.4, 0.3, 0.2, 0.1]}
+    expected = convert_results(results, chunks, file_dict)
+    assert convert_results(results, table, file_dict) == expected
+    assert expected['original_chunk'][1] == 'Alpha beta,, gamma.'
+    assert expected['page_end'] == [2, 1, 0, 0]
+    # Values are plain Python objects, as read from JSON
+    assert all(type(i) is int for i in convert_results(results, table, file_dict)['chunk_id'])
@@ -0,0 +1,88 @@
+import re
+import random
+import numpy as np
+import pytest
+from trigram import TrigramIndex, literal_query, regex_query
+from arena import CorpusArena
+from queries import query_direct
+
+words = ['Market', 'market', 'marketing', 'price', 'prices', 'aaa', 'ab', 'baba', 'tax', 'taxes', 'É', 'éé',
+         'naïve', 'co-op', '42', 'x', 'mama', 'supermarket', 'PRICE', 'rate']
+
+literals = ['market', 'Market', 'price', 'aa', 'aaa', 'baba', 'ab', 'ma', 'é', 'naïve', 'rket', 'co-op', 'zzz', 'x mar']
+
+regexes = [r'mark\w*', r'pri(ce|mes)s?', r'(?<=super)market', r'(?<!super)market', r'\bprice\b', r'(\w)\1',
+           r'(a|b)+a', r'^mar', r'es$', r'[a-z]{3}ket', r'x?', r'\s+', r'ma(?=ma)', r'(?i)PRICE', r'(?-i:Market)',
+           r'\Arate', r'tax\Z', r'.*', r'a{2,}', r'(?P<w>ba)(?P=w)']
+
+def _chunks(seed=0, num_chunks=120):
+    rng = random.Random(seed)
+    texts = [' '.join(rng.choice(words) for _ in range(rng.randint(0, 12))) for _ in range(num_chunks)]
+    return {'processed_chunk': texts, 'file_id': ['f'] * num_chunks}
+
+def _scan(query, texts, case_sensitive, is_regex):
+    """Match counts per chunk by a plain scan of every chunk."""
+    if is_regex:
+        pattern = re.compile(query, 0 if case_sensitive else re.IGNORECASE)
+        counts = [len(list(pattern.finditer(text))) for text in texts]
+    elif case_sensitive:
+        counts = [text.count(query) for text in texts]
+    else:
+        counts = [text.lower().count(query.lower()) for text in texts]
+    return {i: c for i, c in enumerate(counts) if c > 0}
+
+@pytest.mark.parametrize('case_sensitive', [False, True])
+def test_trigram_candidates_cover_every_match(case_sensitive):
+    texts = _chunks()['processed_chunk']
+    index = TrigramIndex.build(texts)
+    for query in literals:
+        expected = _scan(query, texts, case_sensitive, False)
+        candidates = index.candidates(literal_query(query if case_sensitive else query.lower(), case_sensitive))
+        if candidates is not None:
+            assert set(expected) <= set(candidates.tolist()), query
+    for query in regexes:
+        expected = _scan(query, texts, case_sensitive, True)
+        candidates = index.candidates(regex_query(query, 0 if case_sensitive else re.IGNORECASE))
+        if candidates is not None:
+            assert set(expected) <= set(candidates.tolist()), query
+
+@pytest.mark.parametrize('case_sensitive', [False, True])
+@pytest.mark.parametrize('is_regex', [False, True])
+def test_query_direct_matches_plain_scan(tmp_path, case_sensitive, is_regex):
+    chunks = _chunks()
+    texts = chunks['processed_chunk']
+    index = TrigramIndex.build(texts)
+    arena = CorpusArena.build(texts, str(tmp_path / 'corpus_arena'))
+    mask = np.arange(len(texts)) % 3 != 0
+    try:
+        for query in (regexes if is_regex else literals):
+            expected = _scan(query, texts, case_sensitive, is_regex)
+            for options in ({}, {'trigram_index': index}, {'arena': arena}, {'trigram_index': index, 'arena': arena}):
+                for m in (None, mask):
+                    results = query_direct(query, chunks=chunks, num_results=len(texts), case_sensitive=case_sensitive,
+                                           is_regex=is_regex, use_parallel=False, mask=m, **options)
+                    hits = {i: c for i, c in expected.items() if m is None or m[i]}
+                    assert set(results['id']) == set(hits), (query, options, m is not None)
+                    if hits:
+                        # Scores are the counts normalized to sum to 1
+                        total = sum(hits.values())
+                        assert results['score'] == pytest.approx([hits[i] / total for i in results['id']])
+    finally:
+        arena.close()
+
+@pytest.mark.parametrize('case_sensitive', [False, True])
+def test_query_direct_terms_count_like_single_terms(tmp_path, case_sensitive):
+    chunks = _chunks(seed=2)
+    texts = chunks['processed_chunk']
+    terms = ['aa', 'aaa', 'baba', 'ab', 'Market', 'market', 'é', 'ma', 'zzz']
+    arena = CorpusArena.build(texts, str(tmp_path / 'corpus_arena'))
+    try:
+        for options in ({}, {'arena': arena}, {'trigram_index': TrigramIndex.build(texts)}):
+            results = query_direct(terms, chunks=chunks, num_results=len(texts), case_sensitive=case_sensitive, **options)
+            expected = {}
+            for term in dict.fromkeys(t if case_sensitive else t.lower() for t in terms):
+                for i, c in _scan(term, texts, case_sensitive, False).items():
+                    expected.setdefault(i, {})[term] = c
+            assert dict(zip(results['id'], results['term_counts'])) == expected, options
+    finally:
+        arena.close()
@@ -0,0 +1,77 @@
+import numpy as np
+import pytest
+import embeddings
+import queries
+from embeddings import chunk_keys, embed_chunks, load_embeddings
+from exact import ExactIndex
+from incremental import IncrementalIndex
+
+class FakeModel:
+    """Deterministic stand-in for a Model2Vec model that records what it encodes."""
+    dim = 8
+
+    def __init__(self):
+        self.encoded = []
+
+    def encode(self, texts, show_progress_bar=False, max_length=None):
+        self.encoded.extend(texts)
+        return np.array([np.random.default_rng(sum(text.encode())).standard_normal(self.dim) for text in texts],
+                        dtype=np.float16)
+
+@pytest.fixture
+def model(monkeypatch):
+    model = FakeModel()
+    monkeypatch.setattr(embeddings, 'get_model', lambda model_name=None, options=None: model)
+    return model
+
+def test_embed_chunks_reuses_rows_by_key(tmp_path, model):
+    path = str(tmp_path)
+    texts = ['alpha', 'beta', 'gamma', 'delta']
+    first = np.array(embed_chunks(texts, path, show_progress=False))
+    assert model.encoded == texts
+
+    # Reordered, one changed and one new chunk: only those two are encoded
+    model.encoded.clear()
+    new_texts = ['gamma', 'alpha', 'epsilon', 'delta', 'zeta']
+    second = np.array(embed_chunks(new_texts, path, show_progress=False))
+    assert model.encoded == ['epsilon', 'zeta']
+    np.testing.assert_array_equal(second[[0, 1, 3]], first[[2, 0, 3]])
+    np.testing.assert_array_equal(second, model.encode(new_texts))
+
+    matrix, keys = load_embeddings(path, keys=chunk_keys(new_texts))
+    np.testing.assert_array_equal(matrix, second)
+    np.testing.assert_array_equal(keys, chunk_keys(new_texts))
+
+def test_load_embeddings_rejects_mismatches(tmp_path, model):
+    path = str(tmp_path)
+    with pytest.raises(ValueError):
+        load_embeddings(path)
+    texts = ['alpha', 'beta', 'gamma']
+    embed_chunks(texts, path, show_progress=False)
+    with pytest.raises(ValueError, match="don't match 1 chunks"):
+        load_embeddings(path, keys=chunk_keys(['alpha', 'beta', 'changed']))
+    with pytest.raises(ValueError, match='3 rows'):
+        load_embeddings(path, keys=chunk_keys(texts[:2]))
+    with pytest.raises(ValueError, match='another model'):
+        load_embeddings(path, model_name='other/model')
+
+def test_query_nn_mmr_rejects_stale_embeddings(tmp_path, monkeypatch, model):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'search_utils').mkdir()
+    monkeypatch.setattr(queries, 'encode_query', lambda query, model_name: model.encode([query])[0])
+    texts = ['alpha', 'beta', 'gamma', 'delta']
+    vectors = model.encode(texts)
+    index = IncrementalIndex(ExactIndex.build(vectors), row_keys=chunk_keys(texts))
+    np.testing.assert_array_equal(index.keys_by_chunk(), chunk_keys(texts))
+
+    embed_chunks(texts, './search_utils', show_progress=False)
+    assert len(queries.query_nn('alpha', index=index, num_results=2, mmr_lambda=0.5)['id']) == 2
+
+    # The chunks changed, but only the index was updated
+    new_texts = ['delta', 'alpha', 'omega', 'beta']
+    updated = index.update(chunk_keys(new_texts), model.encode(new_texts))
+    np.testing.assert_array_equal(updated.keys_by_chunk(), chunk_keys(new_texts))
+    with pytest.raises(ValueError, match="don't match"):
+        queries.query_nn('alpha', index=updated, num_results=2, mmr_lambda=0.5)
+    embed_chunks(new_texts, './search_utils', show_progress=False)
+    assert len(queries.query_nn('alpha', index=updated, num_results=2, mmr_lambda=0.5)['id']) == 2
@@ -0,0 +1,35 @@
+import numpy as np
+import exact
+from exact import ExactIndex
+
+def test_ties_at_cutoff_go_to_lowest_ids(monkeypatch):
+    # Rows 1-8 are equally distant from the query and spread over several blocks
+    monkeypatch.setattr(exact, 'exact_block_size', 3)
+    vectors = np.zeros((10, 2))
+    vectors[:, 0] = 1
+    vectors[0] = [1, 0.2]
+    vectors[9] = [0, 1]
+    vectors[[8, 7, 5, 2]] = [1, 0.5]
+    index = ExactIndex.build(vectors)
+
+    ids, distances = index.query(np.array([[1, 0.5]]), k=4)
+    assert ids.tolist() == [[2, 5, 7, 8]]
+    ids, distances = index.query(np.array([[1, 0.5]]), k=6)
+    assert ids.tolist() == [[2, 5, 7, 8, 0, 1]]
+    assert np.all(np.diff(distances) >= 0)
+
+    mask = np.ones(10, dtype=bool)
+    mask[[2, 7]] = False
+    ids, _ = index.query(np.array([[1, 0.5], [0, 1]]), k=3, mask=mask)
+    assert ids.tolist() == [[5, 8, 0], [9, 5, 8]]
+
+def test_matches_full_sort():
+    rng = np.random.default_rng(0)
+    # Few distinct values, so many rows tie
+    index = ExactIndex.build(rng.integers(0, 3, size=(200, 4)).astype(np.float32) + 0.5)
+    queries = rng.integers(0, 3, size=(5, 4)).astype(np.float32)
+    ids, distances = index.query(queries, k=17)
+    sims = (queries / np.linalg.norm(queries, axis=1, keepdims=True)) @ index.vectors.astype(np.float32).T
+    for i in range(len(queries)):
+        expected = np.lexsort((np.arange(200), -sims[i]))[:17]
+        assert ids[i].tolist() == expected.tolist()
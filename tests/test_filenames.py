@@ -0,0 +1,72 @@
+import os
+import numpy as np
+import pytest
+from filenames import FilenameIndex, filename_path_weight, filename_prefix_weight
+from queries import query_filenames, query_with_filename_boost
+from utils import preprocess
+
+paths = ['/home/me/reports/annual_report.pdf', '/home/me/reports/budget.xlsx', '/home/me/notes/report_draft.docx',
+         '/home/me/archive/reporting tools.txt', '/home/me/photos/holiday.jpg']
+file_list = {
+    'filepath': paths,
+    'filename': [preprocess(os.path.splitext(os.path.basename(p))[0]) for p in paths],
+    'file_id': [f'f{i}' for i in range(len(paths))],
+}
+
+def _idf(df, n=len(paths)):
+    return np.log(1 + (n - df + 0.5) / (df + 0.5))
+
+@pytest.fixture(params=[False, True], ids=['built', 'loaded'])
+def index(request, tmp_path):
+    index = FilenameIndex.build(file_list)
+    if request.param:
+        index.save(str(tmp_path / 'index_filenames'))
+        index = FilenameIndex.load(str(tmp_path / 'index_filenames'))
+    return index
+
+def test_exact_prefix_and_path_matches(index):
+    files, scores = index.search('report')
+    # 'report' is in the names of f0 and f2; f3's name starts with it, and f0 and f1 sit in 'reports'
+    assert files.tolist() == [0, 2, 3, 1]
+    np.testing.assert_allclose(scores, [_idf(2), _idf(2), _idf(1) * filename_prefix_weight,
+                                        _idf(2) * filename_path_weight * filename_prefix_weight], rtol=1e-6)
+
+def test_prefix_range_and_summed_tokens(index):
+    # Every token starting with 'rep' is one range of the sorted vocabulary
+    # and only ever counts as a prefix match
+    files, scores = index.search('REP')
+    assert files.tolist() == [3, 0, 2, 1]
+    np.testing.assert_allclose(scores, [_idf(1) * filename_prefix_weight, _idf(2) * filename_prefix_weight,
+                                        _idf(2) * filename_prefix_weight,
+                                        _idf(2) * filename_path_weight * filename_prefix_weight], rtol=1e-6)
+
+    files, scores = index.search('report draft')
+    assert files[0] == 2
+    assert scores[0] == pytest.approx(_idf(2) + _idf(1))
+
+    files, _ = index.search('pdf')
+    assert files.tolist() == [0]
+    files, _ = index.search('nothing here')
+    assert len(files) == 0
+    files, _ = index.search('report', num_results=2)
+    assert files.tolist() == [0, 2]
+
+def test_query_filenames(index):
+    results = query_filenames('Report', index=index, num_results=3)
+    assert results['file_id'] == ['f0', 'f2', 'f3']
+    assert sum(results['score']) == pytest.approx(1)
+    assert query_filenames('zzz', index=index) == {'file_id': [], 'score': []}
+
+def test_query_with_filename_boost(index):
+    chunks = {
+        'processed_chunk': ['budget budget budget plan', 'the budget for next year', 'holiday budget'],
+        'file_id': ['f4', 'f1', 'f4'],
+    }
+    plain = query_with_filename_boost('budget', chunks, search='direct', filename_index=index, boost=0)
+    assert plain['id'] == [0, 1, 2]
+    # f1 is named budget, so its chunk overtakes the chunk with more hits
+    boosted = query_with_filename_boost('budget', chunks, search='direct', filename_index=index, boost=0.5)
+    assert boosted['id'] == [1, 0, 2]
+    assert sum(boosted['score']) == pytest.approx(1)
+    with pytest.raises(ValueError):
+        query_with_filename_boost('budget', chunks, search='direct', filename_index=index, boost=2)
@@ -0,0 +1,62 @@
+import numpy as np
+import pytest
+from filters import parse_filter, filter_mask, mask_key
+
+file_dict = {
+    'a': {'filepath': '/docs/reports/q1.pdf', 'last_modified': '2024-01-15 08:00:00', 'file_size': 0, 'file_bytes': 900 * 1024},
+    'b': {'filepath': '/docs/reports/q2.docx', 'last_modified': '2024-06-01 12:30:00', 'file_size': 10, 'file_bytes': 10 * 1024**2 + 1},
+    'c': {'filepath': '/docs/notes/todo.txt', 'last_modified': '2023-12-31 23:59:59', 'file_size': 0, 'file_bytes': 200},
+    # A file dictionary entry from an earlier version, without the exact size
+    'd': {'filepath': '/docs/reportsold/x.pdf', 'last_modified': '2024-03-01 00:00:00', 'file_size': 2},
+}
+chunks = {'file_id': ['a', 'a', 'b', 'c', 'c', 'c', 'd', 'missing']}
+
+def test_parse_filter():
+    assert parse_filter('path:/docs/reports ext:pdf,.docx after:2024-01-01 before:2024-06-01_12:00:00 min_size:0.5 max_size:10') == {
+        'path_prefix': '/docs/reports',
+        'extensions': ['pdf', '.docx'],
+        'modified_after': '2024-01-01',
+        'modified_before': '2024-06-01 12:00:00',
+        'min_size': 0.5,
+        'max_size': 10.0,
+    }
+    assert parse_filter('') == {}
+    for expression in ('path', 'size:3', 'ext:', 'max_size:big'):
+        with pytest.raises(ValueError):
+            parse_filter(expression)
+
+@pytest.mark.parametrize('expression, kept', [
+    ('', 'abcd'),
+    # A plain prefix also matches /docs/reportsold; a trailing separator limits it to the folder
+    ('path:/docs/reports', 'abd'),
+    ('path:/docs/reports/', 'ab'),
+    ('ext:pdf', 'ad'),
+    ('ext:docx,.txt', 'bc'),
+    ('after:2024-01-01', 'abd'),
+    ('before:2024-06-01_12:30:00', 'acd'),
+    ('after:2024-01-01 before:2024-06-01', 'ad'),
+    # Exact sizes: a is 0.88 MB, b just over 10 MB, d is 2 MB by its rounded-down size
+    ('min_size:0.5', 'abd'),
+    ('max_size:10', 'acd'),
+    ('min_size:0.5 max_size:1', 'a'),
+    ('ext:pdf min_size:1', 'd'),
+])
+def test_filter_mask(expression, kept):
+    mask = filter_mask(chunks, file_dict, expression)
+    assert mask.dtype == bool and len(mask) == len(chunks['file_id'])
+    # Chunks of files missing from the file dictionary never pass
+    assert mask.tolist() == [f_id in kept for f_id in chunks['file_id']]
+    assert filter_mask(chunks, file_dict, parse_filter(expression)).tolist() == mask.tolist()
+
+def test_filter_mask_errors():
+    with pytest.raises(ValueError):
+        filter_mask(chunks, file_dict, {'size': 3})
+    with pytest.raises(ValueError):
+        filter_mask(chunks, file_dict, 'after:yesterday')
+
+def test_mask_key():
+    mask = filter_mask(chunks, file_dict, 'ext:pdf')
+    assert mask_key(None) is None
+    assert mask_key(mask) == mask_key(mask.copy())
+    assert mask_key(mask) != mask_key(~mask)
+    assert mask_key(np.zeros(8, dtype=bool)) != mask_key(np.zeros(9, dtype=bool))
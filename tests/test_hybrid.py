@@ -0,0 +1,31 @@
+import numpy as np
+import pytest
+import queries
+from exact import ExactIndex
+from indexes import create_bm25_index
+from segments import SegmentedBM25
+
+texts = ['inflation and wage growth', 'central bank interest rate', 'trade balance and exports',
+         'tax policy and public debt', 'labor market and wage growth', 'money supply and inflation']
+
+@pytest.fixture
+def ann_index(monkeypatch):
+    vectors = np.random.default_rng(0).standard_normal((len(texts), 8)).astype(np.float32)
+    monkeypatch.setattr(queries, 'encode_query', lambda query, model_name: vectors[0])
+    return ExactIndex.build(vectors)
+
+@pytest.mark.parametrize('segmented', [False, True])
+def test_query_hybrid_on_corpus_smaller_than_candidates(tmp_path, monkeypatch, ann_index, segmented):
+    monkeypatch.chdir(tmp_path)
+    (tmp_path / 'search_utils').mkdir()
+    if segmented:
+        retriever = SegmentedBM25.create(str(tmp_path / 'search_utils' / 'index_bm25_segments'), texts)
+    else:
+        retriever = create_bm25_index(chunks={'processed_chunk': texts})
+
+    # The default of 5 * num_results candidates is more than the 6 chunks
+    for fusion in ('rrf', 'weighted'):
+        results = queries.query_hybrid('wage growth', retriever=retriever, index=ann_index, num_results=3, fusion=fusion)
+        assert len(results['id']) == 3
+        assert len(set(results['id'])) == 3
+        assert sum(results['score']) == pytest.approx(1)
@@ -0,0 +1,55 @@
+import random
+import numpy as np
+import pytest
+from embeddings import chunk_keys
+from exact import ExactIndex
+from incremental import IncrementalIndex
+
+pool = [f'chunk text number {i}' for i in range(60)]
+pool_vectors = np.random.default_rng(0).standard_normal((len(pool), 16)).astype(np.float32)
+
+def _vectors(texts):
+    return pool_vectors[[pool.index(text) for text in texts]]
+
+def _check_matches_rebuild(index, texts, queries, rng):
+    rebuilt = ExactIndex.build(_vectors(texts))
+    assert index.num_chunks == len(texts)
+    masks = [None, np.array([rng.random() < 0.5 for _ in texts])]
+    for mask in masks:
+        for k in (1, 5, len(texts) + 3):
+            ids, distances = index.query(queries, k=k, mask=mask)
+            expected_ids, expected_distances = rebuilt.query(queries, k=k, mask=mask)
+            # Chunks with the same text are equally near, so they may be returned in place of each other
+            assert [[texts[i] for i in row] for row in ids] == [[texts[i] for i in row] for row in expected_ids]
+            assert all(len(set(row)) == len(row) for row in ids.tolist())
+            if mask is not None:
+                assert mask[ids].all()
+            np.testing.assert_allclose(distances, expected_distances, atol=1e-6)
+
+def test_incremental_index_matches_exact_rebuild():
+    rng = random.Random(0)
+    texts = rng.choices(pool[:40], k=30)
+    index = IncrementalIndex(ExactIndex.build(_vectors(texts)), row_keys=chunk_keys(texts))
+    queries = np.random.default_rng(1).standard_normal((4, 16)).astype(np.float32)
+    _check_matches_rebuild(index, texts, queries, rng)
+
+    for _ in range(6):
+        # Delete some chunks, add new or repeated texts and shuffle the chunk IDs
+        texts = [t for t in texts if rng.random() > 0.2] + rng.choices(pool, k=rng.randint(0, 8))
+        rng.shuffle(texts)
+        updated = index.update(chunk_keys(texts), _vectors(texts))
+        _check_matches_rebuild(updated, texts, queries, rng)
+        index = updated
+
+def test_incremental_index_update_keeps_unchanged_rows():
+    texts = pool[:10]
+    index = IncrementalIndex(ExactIndex.build(_vectors(texts)), row_keys=chunk_keys(texts))
+    updated = index.update(chunk_keys(texts[::-1]), _vectors(texts[::-1]))
+    assert updated.delta is None
+    assert not updated.tombstones.any()
+    assert updated.row_chunk.tolist() == list(range(9, -1, -1))
+
+def test_incremental_index_without_row_keys_cannot_update():
+    index = IncrementalIndex(ExactIndex.build(_vectors(pool[:3])))
+    with pytest.raises(ValueError):
+        index.update(chunk_keys(pool[:3]), _vectors(pool[:3]))
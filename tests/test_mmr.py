@@ -0,0 +1,39 @@
+import numpy as np
+import pytest
+import queries
+from exact import ExactIndex
+
+def _unit(degrees, axis=1):
+    v = np.zeros(4, dtype=np.float32)
+    v[0], v[axis] = np.cos(np.radians(degrees)), np.sin(np.radians(degrees))
+    return v
+
+# The query points along the first axis. Chunk 1 is a near-duplicate of chunk 0, chunk 2 is about as
+# relevant but points the other way, and chunk 3 is unrelated.
+vectors = np.array([_unit(30), _unit(32), _unit(-35), _unit(90, axis=2)])
+
+@pytest.fixture
+def index(monkeypatch):
+    monkeypatch.setattr(queries, 'encode_query', lambda query, model_name: _unit(0))
+    return ExactIndex.build(vectors)
+
+def test_mmr_pushes_near_duplicates_down(index):
+    plain = queries.query_nn('query', index=index, num_results=3)
+    assert plain['id'] == [0, 1, 2]
+    diverse = queries.query_nn('query', index=index, num_results=3, mmr_lambda=0.5, embeddings=vectors)
+    # The near-duplicate adds nothing once chunk 0 is picked, so even the unrelated chunk comes first
+    assert diverse['id'] == [0, 2, 3]
+    assert sum(diverse['score']) == pytest.approx(1)
+
+def test_mmr_lambda_one_is_relevance_order(index):
+    plain = queries.query_nn('query', index=index, num_results=4)
+    relevant = queries.query_nn('query', index=index, num_results=4, mmr_lambda=1, embeddings=vectors)
+    assert relevant['id'] == plain['id']
+    assert relevant['score'] == pytest.approx(plain['score'], abs=1e-3)
+
+def test_mmr_picks_among_candidates_only(index):
+    ids, distances = queries._mmr(_unit(0), np.array([2, 0, 1]), vectors, 2, 0.5)
+    assert ids.tolist() == [0, 2]
+    np.testing.assert_allclose(distances, 1 - vectors[[0, 2]] @ _unit(0), atol=1e-6)
+    with pytest.raises(ValueError):
+        queries.query_nn('query', index=index, mmr_lambda=1.5, embeddings=vectors)
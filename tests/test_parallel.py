@@ -0,0 +1,31 @@
+import re
+import logging
+import parallel
+from arena import CorpusArena
+from parallel import scan_regex, _count_top_k
+
+def _top(results, num_results):
+    # Most matches first, then lowest chunk ID, as query_direct ranks them
+    return sorted(results, key=lambda item: (-item[1], item[0]))[:num_results]
+
+def test_pool_scan_matches_sequential(tmp_path, monkeypatch, caplog):
+    texts = [f'chunk {i} ' + 'ab ' * ((i * 7) % 11) + 'x' * (i % 5) for i in range(300)]
+    pattern = re.compile(r'a[b]')
+    arena = CorpusArena.build(texts, str(tmp_path / 'corpus_arena'))
+
+    # Force the pool path: a small sample, two workers even on one CPU, and no round-trip cost
+    get_pool = parallel.get_pool
+    monkeypatch.setattr(parallel, 'parallel_sample_chunks', 10)
+    monkeypatch.setattr(parallel.os, 'cpu_count', lambda: 2)
+    monkeypatch.setattr(parallel, 'get_pool', lambda max_workers=None: get_pool(max_workers)[:2] + (0.0,))
+    try:
+        with caplog.at_level(logging.INFO):
+            for num_results in (1, 5, 40):
+                for chunk_ids in (range(len(texts)), list(range(3, 290, 2))):
+                    results = scan_regex(pattern, texts, chunk_ids, num_results, arena=arena, max_workers=2)
+                    expected = _count_top_k(pattern, texts, chunk_ids, num_results)
+                    assert _top(results, num_results) == _top(expected, num_results)
+        assert any('workers' in record.getMessage() and 'Scanning' in record.getMessage() for record in caplog.records)
+    finally:
+        parallel.shutdown_pool()
+        arena.close()
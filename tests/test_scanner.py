@@ -0,0 +1,33 @@
+from scanner import setup_scan_rules
+
+def test_anchored_directory_rule():
+    is_excluded = setup_scan_rules(['/build/'])
+    assert is_excluded('build', True)
+    assert not is_excluded('a/build', True)
+    assert not is_excluded('build', False)
+
+def test_unanchored_directory_rule():
+    is_excluded = setup_scan_rules(['build/'])
+    assert is_excluded('build', True)
+    assert is_excluded('a/build', True)
+    assert not is_excluded('a/build', False)
+
+def test_anchored_rule():
+    is_excluded = setup_scan_rules(['/build'])
+    assert is_excluded('build', True)
+    assert is_excluded('build', False)
+    assert not is_excluded('a/build', True)
+    assert not is_excluded('a/build', False)
+
+def test_negated_rule():
+    is_excluded = setup_scan_rules(['*.log', '!keep.log'])
+    assert is_excluded('x.log', False)
+    assert is_excluded('a/x.log', False)
+    assert not is_excluded('keep.log', False)
+    assert not is_excluded('a/keep.log', False)
+
+def test_anchored_include_pattern():
+    is_excluded = setup_scan_rules(include_patterns=['/docs/*.md'])
+    assert not is_excluded('docs/a.md', False)
+    assert is_excluded('a/docs/a.md', False)
+    assert not is_excluded('a', True)
@@ -0,0 +1,59 @@
+import random
+import numpy as np
+import pytest
+import bm25s
+import segments
+from segments import SegmentedBM25
+from queries import get_stemmer
+
+words = ['market', 'price', 'inflation', 'wage', 'labor', 'supply', 'demand', 'policy', 'rate', 'bank',
+         'trade', 'export', 'growth', 'capital', 'tax', 'budget', 'debt', 'credit', 'output', 'money']
+queries = ['inflation', 'wage growth', 'bank credit rate', 'tax policy and public debt', 'nothing matches']
+
+def _text(rng):
+    return ' '.join(rng.choice(words) for _ in range(rng.randint(1, 30)))
+
+def _all_scores(retriever, num_docs):
+    """Score of every chunk for each query, by chunk ID."""
+    scores = np.zeros((len(queries), num_docs), dtype=np.float32)
+    for q, query in enumerate(queries):
+        tokens = bm25s.tokenize(query, stopwords='en', stemmer=get_stemmer(), show_progress=False)
+        ids, s = retriever.retrieve(tokens, k=num_docs, show_progress=False) if isinstance(retriever, bm25s.BM25) \
+            else retriever.retrieve(tokens, k=num_docs)
+        scores[q, ids[0]] = s[0]
+    return scores
+
+def _check_matches_fresh_index(index, texts):
+    fresh = bm25s.BM25()
+    fresh.index(bm25s.tokenize(texts, stopwords='en', stemmer=get_stemmer(), show_progress=False), show_progress=False)
+    assert index.num_docs == len(texts)
+    np.testing.assert_allclose(_all_scores(index, len(texts)), _all_scores(fresh, len(texts)), rtol=1e-5, atol=1e-6)
+
+def test_segmented_bm25_matches_fresh_index_after_updates_and_merges(tmp_path, monkeypatch):
+    # Merge often, so the updates below cross several merges
+    monkeypatch.setattr(segments, 'bm25_merge_factor', 3)
+    rng = random.Random(0)
+    texts = [_text(rng) for _ in range(40)]
+    index = SegmentedBM25.create(str(tmp_path / 'index_bm25_segments'), texts)
+    _check_matches_fresh_index(index, texts)
+
+    for step in range(8):
+        # Delete and change some chunks, add new ones and shuffle the chunk IDs
+        texts = [t if rng.random() > 0.1 else _text(rng) for t in texts if rng.random() > 0.15]
+        texts += [_text(rng) for _ in range(rng.randint(1, 10))]
+        rng.shuffle(texts)
+        index.update(texts)
+        _check_matches_fresh_index(index, texts)
+        if step % 3 == 2:
+            index.merge()
+            assert len(index.segments) <= segments.bm25_merge_factor
+            _check_matches_fresh_index(index, texts)
+
+    # The merged state is what a reload sees
+    _check_matches_fresh_index(SegmentedBM25.load(index.path), texts)
+
+def test_segmented_bm25_rejects_k_above_num_docs(tmp_path):
+    index = SegmentedBM25.create(str(tmp_path / 'index_bm25_segments'), ['market price', 'wage growth'])
+    tokens = bm25s.tokenize('market', stopwords='en', stemmer=get_stemmer(), show_progress=False)
+    with pytest.raises(ValueError):
+        index.retrieve(tokens, k=3)